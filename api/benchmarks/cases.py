@@ -0,0 +1,177 @@
+# coding=utf-8
+"""
+基准测试用例
+
+每个用例的setup(df, workdir)返回(被计时的无参函数, 附加信息字典)。
+sized=False的用例与数据行数无关, 只在第一个规模上运行; max_rows限制用例运行的最大规模。
+"""
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional, Tuple
+import pandas as pd
+
+from src.services.parameter_handler import replace_parameters_in_sql
+from src.services.option_handler import infer_options_from_dataframe, process_visualization_options
+from src.services.session_manager import SessionManager
+from src.services.share_manager import ShareManager
+from src.services.visualization import format_visualization_oupput
+from src.utils.cascade_options import get_cascade_options, CascadeIndex
+
+CACHE_FORMATS = ("json", "arrow", "parquet")
+
+
+class BenchmarkCase:
+    def __init__(self, name: str, setup: Callable[[pd.DataFrame, Path], Tuple[Callable[[], Any], Dict[str, Any]]],
+                 sized: bool = True, max_rows: Optional[int] = None):
+        self.name = name
+        self.setup = setup
+        self.sized = sized
+        self.max_rows = max_rows
+
+
+CASES: List[BenchmarkCase] = []
+
+
+def case(name: str, sized: bool = True, max_rows: Optional[int] = None):
+    def register(setup):
+        CASES.append(BenchmarkCase(name, setup, sized, max_rows))
+        return setup
+    return register
+
+
+@case("replace_parameters_in_sql", sized=False)
+def bench_replace_parameters(df: pd.DataFrame, workdir: Path):
+    parameters = [
+        {"name": "region", "type": "single_select"},
+        {"name": "categories", "type": "multi_select", "sep": ",", "wrapper": "'"},
+        {"name": "products", "type": "multi_input", "sep": ",", "wrapper": "'"},
+        {"name": "start_date", "type": "date_picker", "format": "yyyy-MM-dd"},
+        {"name": "limit", "type": "single_input"},
+    ]
+    param_values = {
+        "region": "华东",
+        "categories": ["电子产品", "配件", "家居"],
+        "products": [f"商品{i:04d}" for i in range(500)],
+        "start_date": "2023-01-01T00:00:00.000Z",
+        "limit": "1000",
+    }
+    sql = """
+        SELECT * FROM sales
+        WHERE region = '${region}' AND category IN (${categories}) AND product_name IN (${products})
+          AND sale_date >= '${start_date}' AND sale_date < '${yyyy-MM-dd+1d}'
+        LIMIT ${limit}
+    """
+    return (lambda: replace_parameters_in_sql(sql, param_values, parameters)), {}
+
+
+INFER_OPTIONS = [
+    {"name": "region", "infer": "column", "infer_column": "region", "type": "str", "multiple": True},
+    {"name": "category", "infer": "column", "infer_column": "category", "type": "str"},
+    {"name": "product", "infer": "column", "infer_column": "product_name", "type": "str", "multiple": True},
+    {"name": "channel", "infer": "column", "infer_column": "channel", "type": "str"},
+]
+
+
+@case("infer_options_from_dataframe")
+def bench_infer_options(df: pd.DataFrame, workdir: Path):
+    return (lambda: infer_options_from_dataframe([dict(option) for option in INFER_OPTIONS], df)), {}
+
+
+@case("session_manager.get_distinct_values[cached]")
+def bench_distinct_values_cached(df: pd.DataFrame, workdir: Path):
+    manager = SessionManager(cache_dir=str(workdir / "cache"), cache_format="arrow")
+    query_hash = manager.save_query_dataframe("bench", "SELECT * FROM sales", df)
+    columns = [option["infer_column"] for option in INFER_OPTIONS]
+    manager.get_distinct_values(query_hash, columns, df=df)
+    return (lambda: manager.get_distinct_values(query_hash, columns)), {}
+
+
+@case("process_visualization_options", sized=False)
+def bench_process_options(df: pd.DataFrame, workdir: Path):
+    options = [
+        {"name": "region", "type": "str", "choices": ["华东", "华南"], "multiple": True},
+        {"name": "top_n", "type": "int", "default": 10},
+        {"name": "ids", "type": "int", "multiple": True},
+        {"name": "ratio", "type": "double"},
+        {"name": "cumulative", "type": "bool"},
+    ]
+    option_values = {"region": ["华东"], "top_n": "20", "ids": [str(i) for i in range(1000)], "ratio": "0.5", "cumulative": "true"}
+    return (lambda: process_visualization_options(options, option_values, df)), {}
+
+
+@case("get_cascade_options")
+def bench_cascade_options(df: pd.DataFrame, workdir: Path):
+    hierarchy = ["province", "city", "district"]
+    param_values = {"province": df["province"].iloc[0], "city": None, "district": None}
+    return (lambda: get_cascade_options(df, hierarchy, param_values)), {}
+
+
+@case("cascade_index.options")
+def bench_cascade_index(df: pd.DataFrame, workdir: Path):
+    hierarchy = ["province", "city", "district"]
+    index = CascadeIndex(df, hierarchy)
+    param_values = {"province": df["province"].iloc[0], "city": None, "district": None}
+    return (lambda: index.options(param_values)), {}
+
+
+def _session_manager_cases(cache_format: str):
+    @case(f"session_manager.save[{cache_format}]", max_rows=1_000_000 if cache_format == "json" else None)
+    def bench_save(df: pd.DataFrame, workdir: Path):
+        manager = SessionManager(cache_dir=str(workdir / f"cache_{cache_format}"), cache_format=cache_format)
+
+        def save():
+            return manager.save_query_dataframe("bench", "SELECT * FROM sales", df)
+
+        query_hash = save()
+        return save, {"bytes": manager.result_store.size(query_hash)}
+
+    @case(f"session_manager.load[{cache_format}]", max_rows=1_000_000 if cache_format == "json" else None)
+    def bench_load(df: pd.DataFrame, workdir: Path):
+        manager = SessionManager(cache_dir=str(workdir / f"cache_{cache_format}"), cache_format=cache_format)
+        query_hash = manager.save_query_dataframe("bench", "SELECT * FROM sales", df)
+        return (lambda: manager.get_query_dataframe("bench", query_hash)), {"bytes": manager.result_store.size(query_hash)}
+
+
+for _cache_format in CACHE_FORMATS:
+    _session_manager_cases(_cache_format)
+
+
+@case("share_manager.save", max_rows=1_000_000)
+def bench_share_save(df: pd.DataFrame, workdir: Path):
+    manager = ShareManager(share_dir=str(workdir / "shares"))
+    state = {"sql_query": "SELECT * FROM sales", "dashboard_config": {"visualization": []}}
+    # 与/api/share相同: 分享时附带records格式的数据
+    return (lambda: manager.save_dashboard_state(dict(state), df.to_json(orient='records'))), {}
+
+
+@case("share_manager.load", max_rows=1_000_000)
+def bench_share_load(df: pd.DataFrame, workdir: Path):
+    manager = ShareManager(share_dir=str(workdir / "shares"))
+    share_id = manager.save_dashboard_state({"sql_query": "SELECT * FROM sales"}, df.to_json(orient='records'))
+
+    def load():
+        state = manager.get_dashboard_state(share_id)
+        return manager.get_dataframe_from_state(state)
+
+    return load, {"bytes": manager.get_share_path(share_id).stat().st_size}
+
+
+@case("format_visualization_oupput.dataframe", max_rows=1_000_000)
+def bench_format_dataframe(df: pd.DataFrame, workdir: Path):
+    return (lambda: format_visualization_oupput(result=df)), {}
+
+
+def _scatter(df: pd.DataFrame):
+    import plotly.express as px
+    return px.scatter(df, x="sale_date", y="price", color="category")
+
+
+@case("format_visualization_oupput.figure", max_rows=1_000_000)
+def bench_format_figure(df: pd.DataFrame, workdir: Path):
+    figure = _scatter(df)
+    return (lambda: format_visualization_oupput(result=figure)), {}
+
+
+@case("format_visualization_oupput.figure_raw_json", max_rows=1_000_000)
+def bench_format_figure_raw(df: pd.DataFrame, workdir: Path):
+    figure = _scatter(df)
+    return (lambda: format_visualization_oupput(result=figure, raw_json=True)), {}
@@ -0,0 +1,63 @@
+# coding=utf-8
+"""
+基准测试使用的合成数据
+
+列与示例数据库中的sales表类似, 另外包含省/市/区三级层级列用于级联选项。
+字符串列通过Arrow生成, 1000万行时也不会创建大量Python字符串对象。
+"""
+import numpy as np
+import pandas as pd
+
+SIZES = {
+    "1k": 1_000,
+    "100k": 100_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+CATEGORIES = ["电子产品", "配件", "家居", "服装", "食品", "图书", "运动", "美妆", "玩具", "办公"]
+REGIONS = ["华东", "华南", "华北", "华中", "西南", "西北", "东北"]
+CHANNELS = ["线上", "门店", "分销"]
+
+
+def _strings(labels, codes):
+    import pyarrow as pa
+    return pa.array(labels).take(pa.array(codes))
+
+
+def make_sales_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """生成rows行的销售数据"""
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    rng = np.random.default_rng(seed)
+    provinces = [f"省{i:02d}" for i in range(30)]
+    cities = [f"市{i:03d}" for i in range(300)]
+    districts = [f"区{i:04d}" for i in range(3000)]
+    products = [f"商品{i:04d}" for i in range(1000)]
+
+    # 区决定市, 市决定省, 保证层级关系一致
+    district_codes = rng.integers(0, len(districts), rows)
+    city_codes = district_codes // 10
+    province_codes = city_codes // 10
+
+    channel_codes = rng.integers(0, len(CHANNELS), rows)
+    channel = _strings(CHANNELS, channel_codes)
+    # 约5%的渠道为空
+    channel = pc.if_else(pa.array(rng.random(rows) < 0.05), pa.scalar(None, pa.string()), channel)
+
+    table = pa.table({
+        "id": np.arange(rows, dtype=np.int64),
+        "sale_date": pd.date_range("2023-01-01", periods=rows, freq="s").values,
+        "province": _strings(provinces, province_codes),
+        "city": _strings(cities, city_codes),
+        "district": _strings(districts, district_codes),
+        "category": _strings(CATEGORIES, rng.integers(0, len(CATEGORIES), rows)),
+        "product_name": _strings(products, rng.integers(0, len(products), rows)),
+        "region": _strings(REGIONS, rng.integers(0, len(REGIONS), rows)),
+        "channel": channel,
+        "price": rng.gamma(2.0, 500.0, rows).round(2),
+        "quantity": rng.integers(1, 100, rows).astype(np.int32),
+    })
+    string_dtypes = {pa.string(): pd.StringDtype("pyarrow")}
+    return table.to_pandas(types_mapper=string_dtypes.get)
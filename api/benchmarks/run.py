@@ -0,0 +1,163 @@
+# coding=utf-8
+"""
+运行基准测试
+
+    cd api
+    python -m benchmarks.run --sizes 1k,100k
+    python -m benchmarks.run --sizes 1k,100k --save-baseline      # 更新基准数据
+    python -m benchmarks.run --cases session_manager --sizes 1m    # 只运行名称包含session_manager的用例
+
+与基准数据相比变慢超过--threshold倍的用例视为性能回退, 退出码为1。
+基准数据与机器相关, 只在同一台机器上的结果之间比较。
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Any, List
+
+from benchmarks.cases import CASES, CACHE_FORMATS
+from benchmarks.data import SIZES, make_sales_frame
+
+DEFAULT_BASELINE = Path(__file__).parent / "baselines.json"
+
+
+def time_case(func, repeat: int) -> Dict[str, float]:
+    """预热一次后运行repeat次, 返回最短和中位耗时(秒)"""
+    durations = []
+    # 部分被测函数会打印调试信息, 计时时丢弃输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        func()
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - started_at)
+    return {"min": min(durations), "median": statistics.median(durations)}
+
+
+def run_benchmarks(sizes: List[str], case_filter: str = "", repeat: int = 5) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for size_index, size in enumerate(sizes):
+        rows = SIZES[size]
+        df = make_sales_frame(rows)
+        for case in CASES:
+            if case_filter and case_filter not in case.name:
+                continue
+            if not case.sized and size_index > 0:
+                continue
+            if case.max_rows is not None and rows > case.max_rows:
+                continue
+
+            key = f"{case.name}@{size}" if case.sized else case.name
+            with tempfile.TemporaryDirectory() as workdir:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    func, info = case.setup(df, Path(workdir))
+                timing = time_case(func, repeat)
+            results[key] = {**timing, **info}
+            print(f"{key:<55} min {timing['min'] * 1000:>10.2f} ms   median {timing['median'] * 1000:>10.2f} ms",
+                  flush=True)
+    return results
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float) -> List[str]:
+    """与基准数据比较最短耗时, 返回变慢超过threshold倍的用例"""
+    regressions = []
+    for key, result in results.items():
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        ratio = result["min"] / previous["min"] if previous["min"] > 0 else 1.0
+        if ratio > threshold:
+            regressions.append(f"{key}: {previous['min'] * 1000:.2f} ms -> {result['min'] * 1000:.2f} ms ({ratio:.2f}x)")
+    return regressions
+
+
+def print_cache_formats(results: Dict[str, Dict[str, Any]], sizes: List[str]):
+    """按数据规模对比不同缓存格式的写入/读取耗时和文件大小"""
+    rows = []
+    for size in sizes:
+        for cache_format in CACHE_FORMATS:
+            save = results.get(f"session_manager.save[{cache_format}]@{size}")
+            load = results.get(f"session_manager.load[{cache_format}]@{size}")
+            if save is None and load is None:
+                continue
+            rows.append((size, cache_format,
+                         f"{save['min'] * 1000:.1f}" if save else "-",
+                         f"{load['min'] * 1000:.1f}" if load else "-",
+                         f"{(save or load)['bytes'] / 1024 ** 2:.2f}"))
+    if not rows:
+        return
+    print()
+    print(f"{'size':<6} {'format':<8} {'save ms':>10} {'load ms':>10} {'size MB':>10}")
+    for size, cache_format, save, load, nbytes in rows:
+        print(f"{size:<6} {cache_format:<8} {save:>10} {load:>10} {nbytes:>10}")
+
+
+def environment() -> Dict[str, Any]:
+    import numpy
+    import pandas
+    import pyarrow
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "pandas": pandas.__version__,
+        "numpy": numpy.__version__,
+        "pyarrow": pyarrow.__version__,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the service-layer micro-benchmarks")
+    parser.add_argument("--sizes", default="1k,100k", help=f"comma separated, any of {','.join(SIZES)}")
+    parser.add_argument("--cases", default="", help="only run cases whose name contains this string")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+    parser.add_argument("--save-baseline", action="store_true", help="merge the results into the baseline file")
+    parser.add_argument("--threshold", type=float, default=1.25, help="slowdown ratio reported as a regression")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {unknown}, expected any of {list(SIZES)}")
+
+    results = run_benchmarks(sizes, args.cases, args.repeat)
+    print_cache_formats(results, sizes)
+
+    report = {"environment": environment(), "results": results}
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else {"results": {}}
+    if args.save_baseline:
+        baseline["environment"] = report["environment"]
+        baseline.setdefault("results", {}).update(results)
+        baseline_path.write_text(json.dumps(baseline, indent=2, ensure_ascii=False, sort_keys=True) + "\n")
+        print(f"\nBaseline saved to {baseline_path}")
+        return 0
+
+    regressions = compare(results, baseline.get("results", {}), args.threshold)
+    if regressions:
+        print(f"\nRegressions (slower than {args.threshold}x baseline):")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,105 @@
 # coding=utf-8
 from fastapi import FastAPI, HTTPException, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, Response, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
 import traceback
 import io
 import pandas as pd
 import json
 from pathlib import Path
 import os
+import asyncio
+import hashlib
+import time
+from typing import Dict, Any, Optional, List, Callable, Awaitable
 
-from src.services.visualization import process_analysis_request
+from src.services.visualization import process_analysis_request, RawJSON
 from src.services.session_manager import SessionManager
 from src.services.share_manager import ShareManager
-from src.database.db import execute_query, init_db
-from src.services.parameter_handler import replace_parameters_in_sql
+from src.services.cache_collector import CacheCollector
+from src.services.executors import BoundedExecutor
+from src.services.sandbox import SandboxPool
+from src.services.render_cache import RenderCache
+from src.services.memory_cache import ByteBudgetLRUCache
+from src.services.result_pages import query_page, encode_rows, is_valid_handle
+from src.utils.metrics import timed, start_request, metrics_registry, render_samples
+from src.database.db import (execute_query, stream_query, query_distinct_values, query_grouped_distinct_values, init_db, get_data_source, get_dialect,
+                             get_source_fingerprint, mark_table_changed, route_to_rollup, refresh_rollups,
+                             get_rollup_stats, close_connections)
+from src.services.parameter_handler import replace_parameters_in_sql, bind_parameters_in_sql
+from src.utils.cascade_options import CascadeIndex
 from src.services.option_handler import process_visualization_options
-from src.services.option_handler import infer_options_from_dataframe
+from src.services.option_handler import IncrementalOptionInference, apply_distinct_values, distinct_entry, get_infer_columns
 
 # Initialize session manager
-session_manager = SessionManager()
+# 查询结果缓存格式: "arrow"(默认) / "parquet" / "json"(兼容旧版本)
+# 内存中最多保留512MB已解码的DataFrame
+session_manager = SessionManager(cache_format="arrow", memory_budget_bytes=512 * 1024 * 1024)
+
+# 相同SQL的查询结果在该时间(秒)内直接复用, 不再重复执行;
+# DuckDB数据源按查询读取的表的版本判断: 表变化后立即重新执行, 表未变化时最多复用RESULT_REUSE_VERSIONED_MAX_AGE
+# (表版本无法发现行数不变的原地UPDATE; 调用now()、current_date、random()等函数或抽样的查询只按RESULT_REUSE_MAX_AGE)
+RESULT_REUSE_MAX_AGE = 300
+RESULT_REUSE_VERSIONED_MAX_AGE = 3600
+
+# 查询结果按批从数据库游标直接写入缓存文件, 不在内存中生成完整的DataFrame
+STREAM_QUERY_RESULTS = True
+STREAM_BATCH_SIZE = 100000
+# 从数据列推断的choices最多保留的唯一值数量, 超过时返回truncated标记
+INFER_MAX_CHOICES = 1000
+# 选项推断方式: "dataframe"在读取查询结果时推断; "pushdown"以SELECT DISTINCT子查询在数据库中推断,
+# 与主查询并发执行且不阻塞响应(未完成时返回options_pending, 由/api/infer_options获取),
+# 适合结果很大而只需少数几列唯一值的场景; 请求中的infer_mode可以覆盖
+INFER_MODES = ("dataframe", "pushdown")
+INFER_MODE = "dataframe"
+
+# 参数传递方式: "inline"将参数值拼接到SQL中; "bind"以绑定参数执行, 不同参数值共用同一条SQL,
+# 引号内的值、数值和IN列表会被绑定, 其他参数仍拼接; 请求中的param_mode可以覆盖
+PARAMETER_MODES = ("inline", "bind")
+PARAMETER_MODE = "inline"
+
+# 仪表盘配置的rollups中声明的预聚合表: 启动和配置更新时在后台生成, 基础表变化后重新生成;
+# 聚合查询的过滤、分组列都是聚合表的维度时, 改写为读取聚合表
+ROLLUP_ROUTING = True
+
+# 面板输出缓存: 相同结果、代码和选项值的渲染结果直接返回, 最多保留256MB
+render_cache = RenderCache(max_bytes=256 * 1024 * 1024)
+session_manager.add_invalidation_listener(render_cache.invalidate_result)
+
+# 级联选项索引: 每个(结果, 层级)只构建一次, 最多保留64MB
+cascade_indexes = ByteBudgetLRUCache(max_bytes=64 * 1024 * 1024, sizeof=lambda index: index.nbytes)
+session_manager.add_invalidation_listener(
+    lambda query_hash: cascade_indexes.invalidate_matching(lambda key: key[0] == query_hash))
 
 # Initialize share manager
 share_manager = ShareManager()
 
+# 阻塞操作按类型使用相互独立的线程池, 并发上限互不影响:
+# 数据库查询 / 面板Python代码 / 配置、分享和缓存文件读写
+sql_executor = BoundedExecutor("sql", max_workers=8)
+python_executor = BoundedExecutor("python", max_workers=4)
+io_executor = BoundedExecutor("io", max_workers=16)
+
+# 面板Python代码在预热的子进程中执行: 单次执行超时60秒, 每个进程最多使用4GB内存,
+# 执行200次后替换为新进程; 设为0时在python_executor线程中直接执行
+PANEL_SANDBOX_WORKERS = 4
+panel_sandbox = SandboxPool(
+    workers=PANEL_SANDBOX_WORKERS,
+    timeout=60,
+    memory_limit_bytes=4 * 1024 ** 3,
+    max_tasks_per_worker=200,
+) if PANEL_SANDBOX_WORKERS > 0 else None
+
+# 后台回收cache/和shares/目录: 每10分钟按过期时间和配额清理一次
+cache_collector = CacheCollector(
+    session_manager,
+    share_manager,
+    cache_quota_bytes=20 * 1024 ** 3,
+    share_quota_bytes=5 * 1024 ** 3,
+    interval=600,
+)
+
 # 初始化数据库
 init_db()
 
@@ -36,6 +114,95 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_timings(request, call_next):
+    """记录每个请求各阶段的耗时, 通过Server-Timing响应头返回, 并累计到/api/metrics"""
+    timings = start_request()
+    response = await call_next(request)
+    response.headers["Server-Timing"] = timings.server_timing()
+    # 使用路由模板作为path标签, 避免share_id等路径参数产生大量标签
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    metrics_registry.observe_request(request.method, path, response.status_code, time.perf_counter() - timings.started_at)
+    return response
+
+@app.on_event("startup")
+async def start_cache_collector():
+    cache_collector.start()
+
+@app.on_event("startup")
+async def start_panel_sandbox():
+    if panel_sandbox is not None:
+        panel_sandbox.start()
+
+def collect_rollup_definitions(config_dir: Path) -> List[Dict[str, Any]]:
+    """配置目录下所有仪表盘配置中声明的rollup"""
+    definitions = []
+    for path in sorted(config_dir.rglob("*.json")):
+        try:
+            config = read_json_file(path)
+        except (OSError, ValueError):
+            continue
+        if isinstance(config, dict):
+            definitions.extend(config.get("rollups") or [])
+    return definitions
+
+def schedule_rollup_refresh(definitions: Optional[List[Dict[str, Any]]] = None, force: bool = False):
+    """在SQL线程池中后台生成或刷新聚合表, 不等待完成"""
+    if ROLLUP_ROUTING:
+        asyncio.ensure_future(sql_executor.run(refresh_rollups, definitions, force))
+
+@app.on_event("startup")
+async def build_declared_rollups():
+    if ROLLUP_ROUTING:
+        schedule_rollup_refresh(await io_executor.run(collect_rollup_definitions, Path(__file__).parent.parent / "data"))
+
+@app.on_event("shutdown")
+async def stop_panel_sandbox():
+    if panel_sandbox is not None:
+        panel_sandbox.stop()
+
+@app.on_event("shutdown")
+async def stop_cache_collector():
+    cache_collector.stop()
+
+@app.on_event("shutdown")
+async def close_database_connections():
+    close_connections()
+
+@app.on_event("shutdown")
+async def shutdown_executors():
+    for executor in (sql_executor, python_executor, io_executor):
+        executor.shutdown()
+
+def read_json_file(path: Path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json_file(path: Path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def dumps_response(payload: Dict[str, Any]) -> str:
+    """序列化响应内容, RawJSON字段(已序列化的图表)原样拼接, 不再解析和重新编码"""
+    with timed("encode") as stage:
+        body = _dumps_response(payload)
+        stage.bytes = len(body)
+    return body
+
+def _dumps_response(payload: Dict[str, Any]) -> str:
+    raw_fields = {key: value for key, value in payload.items() if isinstance(value, RawJSON)}
+    body = json.dumps(jsonable_encoder({key: value for key, value in payload.items() if key not in raw_fields}),
+                      ensure_ascii=False)
+    if not raw_fields:
+        return body
+    parts = [body[:-1]] if len(body) > 2 else ["{"]
+    for i, (key, value) in enumerate(raw_fields.items()):
+        separator = "" if i == 0 and len(body) <= 2 else ", "
+        parts.append(f"{separator}{json.dumps(key)}: {value}")
+    parts.append("}")
+    return "".join(parts)
+
 @app.get("/")
 async def root():
     return {"message": "数据可视化API已启动!"}
@@ -53,8 +220,7 @@ async def get_dashboard_config(filepath: str = "dashboard_config.json"):
                 "message": f"配置文件不存在: {filepath}"
             }
         
-        with open(config_path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
+        config = await io_executor.run(read_json_file, config_path)
         
         return {
             "status": "success",
@@ -92,6 +258,71 @@ async def parse_sql_query(request: dict):
         }
 
 
+def collect_visualization_options(dashboard_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """收集所有可视化区域的选项"""
+    visualization_options = []
+    for vis in dashboard_config.get("visualization", []):
+        if "options" in vis and isinstance(vis["options"], list):
+            visualization_options.extend(vis["options"])
+    return visualization_options
+
+
+def inferred_option_choices(inferred_options: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """提取需要从数据列推断的选项的choices和默认值"""
+    choices = {}
+    for option in inferred_options:
+        if option.get("infer") == "column" and "infer_column" in option and "choices" in option:
+            option_name = option.get("name")
+            if option_name:
+                choices[option_name] = {
+                    "choices": option.get("choices", []),
+                    "default": option.get("default"),
+                    "truncated": option.get("truncated", False)
+                }
+    return choices
+
+
+async def query_distinct_choices(processed_sql: str, columns: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    在数据库中计算各列的唯一值, 多取一个值用于判断是否超过上限
+
+    DuckDB以GROUPING SETS一次扫描计算所有列; MySQL不支持GROUPING SETS, 每列一个SELECT DISTINCT子查询并发执行。
+    查询结果中不存在的列与dataframe模式一样跳过。
+    """
+    if not columns:
+        return {}
+    if get_dialect() == "duckdb":
+        results = await sql_executor.run(query_grouped_distinct_values, processed_sql, columns, INFER_MAX_CHOICES + 1)
+    else:
+        values = await asyncio.gather(*(
+            sql_executor.run(query_distinct_values, processed_sql, column, INFER_MAX_CHOICES + 1)
+            for column in columns
+        ), return_exceptions=True)
+        results = {}
+        for column, column_values in zip(columns, values):
+            if isinstance(column_values, Exception):
+                print(f"Unable to infer options for column {column}: {str(column_values)}")
+                continue
+            results[column] = column_values
+    return {column: distinct_entry(values, INFER_MAX_CHOICES) for column, values in results.items()}
+
+
+# 尚未完成的pushdown唯一值查询, 按结果的query_hash记录, /api/infer_options等待其完成
+pending_distinct_choices: Dict[str, "asyncio.Future"] = {}
+
+
+async def save_distinct_choices(distinct_future: "asyncio.Future", query_hash: str, version: Optional[int]):
+    """等待后台的唯一值查询完成, 保存到结果的唯一值索引, 之后的/api/infer_options和复用该结果时直接读取"""
+    try:
+        distinct = await distinct_future
+        await io_executor.run(session_manager.save_distinct_values, query_hash, distinct, version)
+    except Exception as e:
+        print(f"Unable to infer options for {query_hash}: {str(e)}")
+    finally:
+        if pending_distinct_choices.get(query_hash) is asyncio.current_task():
+            del pending_distinct_choices[query_hash]
+
+
 @app.post("/api/query")
 async def execute_sql_query(request: dict):
     """Execute SQL query and cache the results"""
@@ -100,57 +331,151 @@ async def execute_sql_query(request: dict):
         session_id = request.get("session_id", "")
         param_values = request.get("param_values", {})
         dashboard_config = request.get("dashboard_config", {})
+        # 强制重新执行查询, 不复用其他会话的结果
+        refresh = request.get("refresh", False)
+        infer_mode = request.get("infer_mode", INFER_MODE)
+        param_mode = request.get("param_mode", PARAMETER_MODE)
 
         
         if not sql_query or not session_id:
             raise HTTPException(status_code=400, detail="SQL query and session ID are required")
+        if infer_mode not in INFER_MODES:
+            raise ValueError(f"Unsupported infer_mode: {infer_mode}, expected one of {list(INFER_MODES)}")
+        if param_mode not in PARAMETER_MODES:
+            raise ValueError(f"Unsupported param_mode: {param_mode}, expected one of {list(PARAMETER_MODES)}")
         
         # 替换SQL查询中的参数占位符
-        processed_sql = replace_parameters_in_sql(sql_query, param_values, dashboard_config.get("parameters", {}))
+        # 拼接参数值的SQL用于返回给前端以及查询结果的缓存键, bind模式下实际执行带绑定参数的SQL
+        with timed("parse_sql"):
+            processed_sql = replace_parameters_in_sql(sql_query, param_values, dashboard_config.get("parameters", {}))
+            if param_mode == "bind":
+                executed_sql, bind_params = bind_parameters_in_sql(
+                    sql_query, param_values, dashboard_config.get("parameters", {}), dialect=get_dialect())
+            else:
+                executed_sql, bind_params = processed_sql, None
+        # 可以由预聚合表回答的查询改为读取聚合表; 聚合表需要重新生成时本次查询基础表, 同时在后台刷新
+        rollup_table = None
+        if ROLLUP_ROUTING and dashboard_config.get("rollups"):
+            with timed("route_rollup"):
+                routed_sql, rollup_table, rollup_stale = await sql_executor.run(
+                    route_to_rollup, executed_sql, dashboard_config["rollups"])
+            if routed_sql:
+                executed_sql = routed_sql
+            if rollup_stale:
+                schedule_rollup_refresh()
+        data_source = get_data_source()
+        # 查询读取的表的版本指纹: 表变化后重新执行, 表未变化时在RESULT_REUSE_VERSIONED_MAX_AGE内复用已有结果
+        source_fingerprint = await sql_executor.run(get_source_fingerprint, processed_sql)
 
-        # Execute query and get DataFrame
-        df = execute_query(processed_sql)
-        
         # 获取可视化配置
+        visualization_options = collect_visualization_options(dashboard_config)
+        infer_columns = get_infer_columns(visualization_options)
 
-        visualization_options = []
-        if "visualization" in dashboard_config:
-            # 收集所有可视化区域的选项
-            for vis in dashboard_config["visualization"]:
-                if "options" in vis and isinstance(vis["options"], list):
-                    visualization_options.extend(vis["options"])
-        
-        
-        # 从DataFrame中推断选项
-        inferred_options = infer_options_from_dataframe(visualization_options, df)
-        
+        # pushdown模式: 唯一值查询与主查询同时在数据库中执行, 不等待其完成;
+        # 可以复用已有结果时直接使用缓存的唯一值
+        distinct_future = None
+        if infer_mode == "pushdown" and infer_columns:
+            reusable = not refresh and await io_executor.run(
+                session_manager.find_query_result, processed_sql, data_source, RESULT_REUSE_MAX_AGE, source_fingerprint,
+                RESULT_REUSE_VERSIONED_MAX_AGE)
+            if not reusable:
+                distinct_future = asyncio.ensure_future(query_distinct_choices(processed_sql, infer_columns))
+        # 唯一值由数据库计算时, 不在读取结果时推断
+        pandas_options = visualization_options if distinct_future is None else []
 
+        def infer_options(query_hash, df=None):
+            # 唯一值按(结果, 列)缓存, 相同结果的重复推断不需要重新计算
+            with timed("infer_options"):
+                distinct = session_manager.get_distinct_values(query_hash, get_infer_columns(pandas_options),
+                                                               INFER_MAX_CHOICES, df)
+                return apply_distinct_values(visualization_options, distinct)
+
+        def run_bound(execute, *args, **kwargs):
+            # 绑定参数的SQL无法执行时(例如数据库不接受参数的位置), 改为执行拼接参数值的SQL
+            try:
+                return execute(executed_sql, *args, params=bind_params, **kwargs)
+            except Exception as e:
+                if not bind_params:
+                    raise
+                print(f"Bound query failed, retrying with inline parameters: {str(e)}")
+                with timed("bind_fallback"):
+                    return execute(processed_sql, *args, params=None, **kwargs)
+
+        def execute_checked(sql, params=None):
+            df = execute_query(sql, params)
+            # MySQL的执行错误以error列返回, 绑定参数时同样需要回退
+            if params and list(df.columns) == ["error"]:
+                raise RuntimeError(df["error"].iloc[0])
+            return df
+
+        def run_query():
+            # 其他会话已执行过相同的SQL时直接引用已有结果
+            query_hash = None if refresh else session_manager.find_query_result(
+                processed_sql, data_source, max_age=RESULT_REUSE_MAX_AGE, source_fingerprint=source_fingerprint,
+                fingerprint_max_age=RESULT_REUSE_VERSIONED_MAX_AGE)
+            if query_hash:
+                session_manager.add_ref(session_id, query_hash, processed_sql, dashboard_config)
+                # 引用后确认结果仍然存在, 期间被回收时重新执行查询
+                if session_manager.result_store.exists(query_hash):
+                    session_manager.result_store.touch(query_hash)
+                else:
+                    query_hash = None
+
+            if query_hash:
+                # 只读取需要推断的列, 唯一值已缓存时不读取数据
+                inferred_options = infer_options(query_hash)
+            elif STREAM_QUERY_RESULTS:
+                # 流式执行: 结果分批写入缓存, 同时增量推断选项, 内存占用只与批大小有关
+                inference = IncrementalOptionInference(pandas_options, INFER_MAX_CHOICES)
+                query_hash = session_manager.save_query_stream(
+                    session_id, processed_sql, run_bound(stream_query, batch_size=STREAM_BATCH_SIZE),
+                    dashboard_config, data_source, on_batch=inference.update, source_fingerprint=source_fingerprint
+                )
+                if inference.rows:
+                    session_manager.save_distinct_values(query_hash, inference.distinct_values())
+                inferred_options = inference.result()
+            else:
+                # Execute query and get DataFrame
+                df = run_bound(execute_checked)
+
+                # Cache the result and get query hash
+                query_hash = session_manager.save_query_dataframe(session_id, processed_sql, df, dashboard_config, data_source,
+                                                                  source_fingerprint=source_fingerprint)
+
+                # 从DataFrame中推断选项
+                inferred_options = infer_options(query_hash, df)
+            return query_hash, inferred_options
+
+        # 查询在独立的SQL线程池中执行, 不阻塞事件循环
+        try:
+            query_hash, inferred_options = await sql_executor.run(run_query)
+        except Exception:
+            if distinct_future is not None:
+                distinct_future.cancel()
+            raise
+
+        # 唯一值查询已完成时一起返回; 否则不阻塞响应, 完成后保存到结果的唯一值索引,
+        # 前端以options_pending判断是否需要以query_hash调用/api/infer_options
+        options_pending = False
+        if distinct_future is not None:
+            version = session_manager.get_result_version(query_hash)
+            if distinct_future.done() and distinct_future.exception() is None:
+                distinct = distinct_future.result()
+                await io_executor.run(session_manager.save_distinct_values, query_hash, distinct, version)
+                inferred_options = apply_distinct_values(visualization_options, distinct)
+            else:
+                options_pending = True
+                pending_distinct_choices[query_hash] = asyncio.ensure_future(
+                    save_distinct_choices(distinct_future, query_hash, version))
         
-        # 提取需要从DataFrame中推断的选项
-        inferred_option_choices = {}
-        for option in inferred_options:
-            if option.get("infer") == "column" and "infer_column" in option and "choices" in option:
-                option_name = option.get("name")
-                if option_name:
-                    inferred_option_choices[option_name] = {
-                        "choices": option.get("choices", []),
-                        "default": option.get("default")
-                    }
-        
-        # Convert DataFrame to dict for caching
-        result = {
-            "data": df.to_json(orient='records'),
-            "dashboard_config": dashboard_config
-        }
-        
-        # Cache the result and get query hash
-        query_hash = session_manager.save_query_result(session_id, sql_query, result)
         return {
             "status": "success",
             "message": "Query executed successfully",
             "query_hash": query_hash,
             "processed_sql": processed_sql,
-            "inferred_options": inferred_option_choices
+            "rollup": rollup_table,
+            "inferred_options": inferred_option_choices(inferred_options),
+            "options_pending": options_pending
         }
     except Exception as e:
         return {
@@ -158,6 +483,166 @@ async def execute_sql_query(request: dict):
             "message": str(e)
         }
 
+
+@app.post("/api/infer_options")
+async def infer_options_in_database(request: dict):
+    """Infer option choices with DISTINCT queries, without running the full query
+
+    Called alongside /api/query so dropdowns populate before the result finishes.
+    With the query_hash of a stored result (e.g. when /api/query returned
+    options_pending) the choices come from that result's distinct value index.
+    """
+    try:
+        sql_query = request.get("sql_query", "")
+        param_values = request.get("param_values", {})
+        dashboard_config = request.get("dashboard_config", {})
+        query_hash = request.get("query_hash")
+
+        if not sql_query:
+            raise HTTPException(status_code=400, detail="SQL query is required")
+
+        with timed("parse_sql"):
+            processed_sql = replace_parameters_in_sql(sql_query, param_values, dashboard_config.get("parameters", {}))
+        visualization_options = collect_visualization_options(dashboard_config)
+        infer_columns = get_infer_columns(visualization_options)
+
+        if query_hash and await io_executor.run(session_manager.result_store.exists, query_hash):
+            # 等待/api/query在后台的唯一值查询, 使返回的choices与pushdown模式一致; 其他列从结果中读取计算
+            if query_hash in pending_distinct_choices:
+                await asyncio.shield(pending_distinct_choices[query_hash])
+            distinct = await io_executor.run(session_manager.get_distinct_values, query_hash, infer_columns,
+                                             INFER_MAX_CHOICES)
+        else:
+            distinct = await query_distinct_choices(processed_sql, infer_columns)
+        return {
+            "status": "success",
+            "processed_sql": processed_sql,
+            "inferred_options": inferred_option_choices(apply_distinct_values(visualization_options, distinct))
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+# 图表降采样的默认目标点数, 约为图表宽度的像素数
+DOWNSAMPLE_TARGET_POINTS = 2000
+
+def parse_downsample_option(value) -> Optional[Dict[str, Any]]:
+    """请求中的downsample参数: false/None关闭, true使用默认设置, 字典可指定target_points和method"""
+    if not value:
+        return None
+    options = {"target_points": DOWNSAMPLE_TARGET_POINTS, "method": "lttb"}
+    if isinstance(value, dict):
+        options.update({key: value[key] for key in ("target_points", "method") if key in value})
+    return options
+
+def result_loader(session_id: str, query_hash: str, columns: Optional[List[str]] = None) -> Callable[[], Awaitable[pd.DataFrame]]:
+    """按需读取缓存的查询结果: 只有面板在API进程中执行时才读取, 多个面板共用一次读取"""
+    loading = None
+
+    async def read() -> pd.DataFrame:
+        with timed("load_result"):
+            df = await io_executor.run(session_manager.get_query_dataframe, session_id, query_hash, columns=columns)
+        if df is None:
+            raise HTTPException(status_code=404, detail="Cached result not found")
+        return df
+
+    def load() -> Awaitable[pd.DataFrame]:
+        nonlocal loading
+        if loading is None:
+            loading = asyncio.ensure_future(read())
+        return loading
+
+    return load
+
+async def render_panel(query_hash: str, result_version: int, load_df: Callable[[], Awaitable[pd.DataFrame]],
+                       python_code: Optional[str],
+                       option_config: List[Dict[str, Any]], option_values: Dict[str, Any],
+                       columns: Optional[List[str]] = None, typed_arrays: bool = False,
+                       page_size: Optional[int] = None, page_encoding: str = "records",
+                       downsample: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """执行一个面板的Python代码, 返回/api/visualize的响应内容
+
+    load_df读取查询结果, 见result_loader; 命中渲染缓存或在沙箱进程中执行时不调用。
+    图表以RawJSON返回, 由dumps_response直接写入响应;
+    指定page_size时表格结果保存在服务端, 只返回第一页, 其余通过/api/result_page读取;
+    指定downsample时点数过多的scatter/line轨迹降采样到目标点数
+    """
+    # 处理选项值
+    processed_options = process_visualization_options(option_config, option_values, None)
+
+    # 相同的结果、代码和选项值直接返回缓存的输出
+    render_options = {"typed_arrays": typed_arrays, "downsample": downsample}
+    if page_size:
+        render_options.update(page_size=page_size, page_encoding=page_encoding)
+    render_key = render_cache.make_key(query_hash, result_version, python_code, processed_options, columns, **render_options)
+    result = render_cache.get(render_key)
+    # 分页表格的服务端结果按最近访问时间回收: 命中时刷新访问时间, 已被回收时重新执行
+    if result is not None and "page" in result and not await io_executor.run(
+            session_manager.panel_store.touch, result["page"]["result_handle"]):
+        result = None
+    if result is None:
+        paging = None
+        if page_size:
+            # 结果句柄由输入决定, 相同的面板输入复用同一份服务端结果
+            paging = {
+                "store_dir": str(session_manager.panel_store.store.store_dir.resolve()),
+                "handle": hashlib.md5(repr(render_key).encode()).hexdigest(),
+                "page_size": page_size,
+                "encoding": page_encoding,
+            }
+
+        # Process visualization, 用户代码优先在沙箱进程中执行, 进程直接读取缓存文件
+        data_ref = None
+        if panel_sandbox is not None and panel_sandbox.running:
+            data_ref = session_manager.get_result_ref(query_hash, columns)
+        # 包含等待空闲线程/进程的时间
+        with timed("panel"):
+            if data_ref is not None:
+                result = await python_executor.run(panel_sandbox.run, data_ref, python_code, processed_options,
+                                                   raw_json=True, typed_arrays=typed_arrays, paging=paging,
+                                                   downsample=downsample)
+            else:
+                df = await load_df()
+                if columns is not None:
+                    df = df[[c for c in columns if c in df.columns]]
+                result = await python_executor.run(
+                    process_analysis_request,
+                    df=df,
+                    code=python_code,
+                    options=processed_options,
+                    raw_json=True,
+                    typed_arrays=typed_arrays,
+                    paging=paging,
+                    downsample=downsample
+                )
+        render_cache.put(render_key, result)
+
+    # Get print output
+    print_output = result.get("print_output", "")
+    if result.get("result_type") == "error":
+        return {
+            "status": "error",
+            "message": result.get("error_message", "Unknown error"),
+            "print_output": print_output
+        }
+
+    response = {
+        "status": "success",
+        "result_type": result["result_type"],
+        "data": result["data"],
+        "plot_data": result["plot_data"],
+        "print_output": print_output
+    }
+    if "page" in result:
+        # 分页表格: 结果句柄、总行数、列结构
+        response["page"] = result["page"]
+    if "downsampled" in result:
+        # 被降采样的轨迹及其原始点数
+        response["downsampled"] = result["downsampled"]
+    return response
+
 @app.post("/api/visualize")
 async def visualize_data(request: dict):
     print_output = ""
@@ -168,44 +653,30 @@ async def visualize_data(request: dict):
         python_code = request.get("python_code")
         option_values = request.get("option_values", {})
         option_config = request.get("option_config", {})
+        # 可选: 面板只用到的列, 其余列不会从缓存文件中读取
+        columns = request.get("columns")
+        # 可选: 数值数组以base64 typed array编码, 需要plotly.js>=2.28
+        typed_arrays = request.get("typed_arrays", False)
+        # 可选: 表格结果分页返回, 以及表格的编码方式 records / columns
+        page_size = request.get("page_size")
+        page_encoding = request.get("page_encoding", "records")
+        # 可选: 轨迹点数超过目标点数时降采样, true或{"target_points": 2000, "method": "lttb"/"minmax"}
+        downsample = parse_downsample_option(request.get("downsample"))
         
         if not session_id or not query_hash:
             raise HTTPException(status_code=400, detail="Session ID and query hash are required")
         
-        # Get cached query result
-        cached_result = session_manager.get_query_result(session_id, query_hash)
-        if not cached_result:
-            raise HTTPException(status_code=404, detail="Cached result not found")
-        
-        # Convert cached data back to DataFrame
-        df = pd.DataFrame(json.loads(cached_result["data"]))
-        
-        # 处理选项值
-        processed_options = process_visualization_options(option_config, option_values, df)
-        
-        # Process visualization
-        result = process_analysis_request(
-            df=df,
-            code=python_code,
-            options=processed_options
-        )
+        # 在读取数据前取得结果版本号, 读取期间结果被替换时不会缓存旧数据
+        result_version = session_manager.get_result_version(query_hash)
 
-        # Get print output
-        print_output = result.get("print_output", "")
-        if result.get("result_type") == "error":
-            return {
-                "status": "error",
-                "message": result.get("error_message", "Unknown error"),
-                "print_output": print_output
-            }
+        # 只确认会话引用了该结果并记录访问; 数据在面板需要在API进程中执行时才读取, 沙箱进程直接读取缓存文件
+        if not await io_executor.run(session_manager.touch_query_result, session_id, query_hash):
+            raise HTTPException(status_code=404, detail="Cached result not found")
         
-        return {
-            "status": "success",
-            "result_type": result["result_type"],
-            "data": result["data"],
-            "plot_data": result["plot_data"],
-            "print_output": print_output
-        }
+        response = await render_panel(query_hash, result_version, result_loader(session_id, query_hash, columns),
+                                      python_code, option_config, option_values,
+                                      columns, typed_arrays, page_size, page_encoding, downsample)
+        return Response(dumps_response(response), media_type="application/json")
     except Exception as e:
         # 尝试从错误消息中提取print输出
         error_str = str(e)
@@ -230,6 +701,266 @@ async def visualize_data(request: dict):
             "error_detail": error_detail
         }
 
+@app.post("/api/cascade_options")
+async def get_cascade_options_for_result(request: dict):
+    """层级参数(如省份->城市->区县)的级联选项, 索引按(结果, 层级)缓存"""
+    try:
+        session_id = request.get("session_id", "")
+        query_hash = request.get("query_hash", "")
+        hierarchy = request.get("hierarchy", [])
+        param_values = request.get("param_values", {})
+
+        if not session_id or not query_hash or not hierarchy:
+            raise HTTPException(status_code=400, detail="Session ID, query hash and hierarchy are required")
+
+        result_version = session_manager.get_result_version(query_hash)
+        key = (query_hash, result_version, tuple(hierarchy))
+        index = cascade_indexes.get(key)
+        if index is None:
+            # 只读取层级列
+            with timed("load_result"):
+                df = await io_executor.run(session_manager.get_query_dataframe, session_id, query_hash, columns=hierarchy)
+            if df is None:
+                raise HTTPException(status_code=404, detail="Cached result not found")
+            missing = [level for level in hierarchy if level not in df.columns]
+            if missing:
+                raise ValueError(f"Unknown hierarchy columns: {missing}")
+            with timed("cascade_index"):
+                index = await python_executor.run(CascadeIndex, df, hierarchy)
+            cascade_indexes.put(key, index)
+
+        return Response(dumps_response({
+            "status": "success",
+            "options": index.options(param_values)
+        }), media_type="application/json")
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+@app.post("/api/result_page")
+async def get_result_page(request: dict):
+    """分页读取保存在服务端的面板表格结果, 支持服务端排序和过滤
+
+    format为arrow时返回Arrow IPC stream, 总行数在X-Total-Rows响应头中
+    """
+    # 句柄在访问文件系统之前校验(只含十六进制字符), 其他输入(例如包含../)直接返回400
+    result_handle = request.get("result_handle", "")
+    if not is_valid_handle(result_handle):
+        raise HTTPException(status_code=400, detail="Invalid result handle")
+    try:
+        offset = int(request.get("offset", 0))
+        limit = int(request.get("limit", 1000))
+        sort_by = request.get("sort_by")
+        ascending = request.get("ascending", True)
+        filters = request.get("filters")
+        output_format = request.get("format", "records")
+
+        df = await io_executor.run(session_manager.panel_store.load, result_handle)
+        if df is None:
+            raise HTTPException(status_code=404, detail="Result not found, please run the panel again")
+
+        page, total_rows = await python_executor.run(query_page, df, offset, limit, sort_by, ascending, filters)
+
+        if output_format == "arrow":
+            import pyarrow as pa
+
+            sink = pa.BufferOutputStream()
+            table = pa.Table.from_pandas(page, preserve_index=False)
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+            return Response(sink.getvalue().to_pybytes(), media_type="application/vnd.apache.arrow.stream",
+                            headers={"X-Total-Rows": str(total_rows)})
+
+        return Response(dumps_response({
+            "status": "success",
+            "result_handle": result_handle,
+            "offset": offset,
+            "total_rows": total_rows,
+            "encoding": output_format,
+            "data": encode_rows(page, output_format)
+        }), media_type="application/json")
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"读取结果失败: {str(e)}"
+        }
+
+@app.post("/api/visualize_batch")
+async def visualize_batch(request: dict):
+    """并发执行仪表盘的所有面板, 数据只读取一次, 按完成顺序逐行返回(NDJSON)每个面板的结果"""
+    try:
+        session_id = request.get("session_id", "")
+        query_hash = request.get("query_hash", "")
+        # 仪表盘配置中的visualization列表, 每项包含code和options
+        visualization = request.get("visualization", [])
+        # 每个面板的选项值, 与visualization按下标对应; 也可以是所有面板共用的字典
+        option_values = request.get("option_values", [])
+        typed_arrays = request.get("typed_arrays", False)
+        page_size = request.get("page_size")
+        page_encoding = request.get("page_encoding", "records")
+        downsample = parse_downsample_option(request.get("downsample"))
+
+        if not session_id or not query_hash:
+            raise HTTPException(status_code=400, detail="Session ID and query hash are required")
+
+        result_version = session_manager.get_result_version(query_hash)
+        if not await io_executor.run(session_manager.touch_query_result, session_id, query_hash):
+            raise HTTPException(status_code=404, detail="Cached result not found")
+        # 在API进程中执行的面板共用一次读取
+        load_df = result_loader(session_id, query_hash)
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"分析处理失败: {str(e)}",
+            "print_output": "",
+            "error_detail": traceback.format_exc()
+        }
+
+    def panel_option_values(index: int) -> Dict[str, Any]:
+        if isinstance(option_values, dict):
+            return option_values
+        if index < len(option_values):
+            return option_values[index] or {}
+        return {}
+
+    async def run_panel(index: int, panel: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            response = await render_panel(
+                query_hash, result_version, load_df,
+                panel.get("code") or None,
+                panel.get("options", []),
+                panel_option_values(index),
+                panel.get("columns"),
+                typed_arrays,
+                page_size,
+                page_encoding,
+                downsample,
+            )
+        except Exception as e:
+            response = {
+                "status": "error",
+                "message": f"分析处理失败: {str(e)}",
+                "print_output": "",
+                "error_detail": traceback.format_exc()
+            }
+        return {"index": index, **response}
+
+    async def stream_results():
+        tasks = [asyncio.ensure_future(run_panel(index, panel)) for index, panel in enumerate(visualization)]
+        try:
+            # 先完成的面板先返回, 首个图表不需要等待最慢的面板
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                yield dumps_response(result) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """获取查询结果内存缓存、面板输出缓存和级联选项索引的命中、未命中和淘汰次数"""
+    return {
+        "status": "success",
+        "memory_cache": session_manager.memory_cache_stats(),
+        "render_cache": render_cache.stats(),
+        "cascade_indexes": cascade_indexes.stats()
+    }
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Prometheus文本格式的请求、各阶段耗时与数据量直方图, 以及线程池和缓存的状态"""
+    executors = (sql_executor, python_executor, io_executor)
+    text = metrics_registry.render_prometheus()
+    text += render_samples("dashboard_executor_active", "Tasks running in each executor",
+                           {(("executor", e.name),): e.stats()["active"] for e in executors})
+    text += render_samples("dashboard_executor_queued", "Tasks waiting for a worker in each executor",
+                           {(("executor", e.name),): e.stats()["queued"] for e in executors})
+    cache_stats = {"memory": session_manager.memory_cache_stats(), "render": render_cache.stats(),
+                   "cascade": cascade_indexes.stats()}
+    for field in ("hits", "misses", "evictions"):
+        text += render_samples(f"dashboard_cache_{field}_total", f"Cache {field}",
+                               {(("cache", name),): stats[field] for name, stats in cache_stats.items() if field in stats},
+                               metric_type="counter")
+    for field in ("bytes", "entries"):
+        text += render_samples(f"dashboard_cache_{field}", f"Cache {field}",
+                               {(("cache", name),): stats[field] for name, stats in cache_stats.items() if field in stats})
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+@app.get("/api/admin/gc")
+async def get_gc_stats():
+    """获取缓存回收的配置、累计回收量和最近一次的回收报告"""
+    return {
+        "status": "success",
+        "gc": cache_collector.stats()
+    }
+
+@app.post("/api/admin/gc")
+async def run_gc():
+    """立即执行一次缓存回收"""
+    try:
+        return {
+            "status": "success",
+            "report": await io_executor.run(cache_collector.collect)
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+@app.post("/api/admin/table_changed")
+async def notify_table_changed(request: dict):
+    """数据加载程序写入表后调用, 读取该表的缓存结果不再被复用"""
+    try:
+        table_name = request.get("table", "")
+        if not table_name:
+            raise HTTPException(status_code=400, detail="Table name is required")
+        version = await sql_executor.run(mark_table_changed, table_name)
+        # 基于该表的聚合表在后台重新生成
+        schedule_rollup_refresh()
+        return {
+            "status": "success",
+            "table": table_name,
+            "version": version
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+@app.get("/api/admin/rollups")
+async def get_rollups():
+    """获取已声明的聚合表、行数、生成时间、是否与基础表一致, 以及查询改写的次数"""
+    try:
+        return {
+            "status": "success",
+            "rollups": await sql_executor.run(get_rollup_stats)
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
+@app.post("/api/admin/rollups/refresh")
+async def refresh_declared_rollups(request: dict):
+    """立即重新生成基础表已变化的聚合表, force为true时重新生成全部"""
+    try:
+        return {
+            "status": "success",
+            "rebuilt": await sql_executor.run(refresh_rollups, None, bool(request.get("force", False)))
+        }
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": str(e)
+        }
+
 @app.post("/api/share")
 async def share_dashboard(request: dict):
     """Save dashboard state for sharing"""
@@ -244,17 +975,18 @@ async def share_dashboard(request: dict):
         session_id = request.get("session_id")
         query_hash = request.get("dashboard_state", {}).get("query_hash")
         
-        # Get DataFrame data if query hash and session ID are provided
-        dataframe_data = None
-        if query_hash and session_id:
-            cached_result = session_manager.get_query_result(session_id, query_hash)
-            if cached_result and "data" in cached_result:
-                dataframe_data = cached_result["data"]
+        def save_share():
+            # Get DataFrame data if query hash and session ID are provided
+            dataframe_data = None
+            if query_hash and session_id:
+                cached_df = session_manager.get_query_dataframe(session_id, query_hash)
+                if cached_df is not None:
+                    dataframe_data = cached_df.to_json(orient='records')
 
-        print(dashboard_state)
+            # Save dashboard state and get share ID
+            return share_manager.save_dashboard_state(dashboard_state, dataframe_data)
 
-        # Save dashboard state and get share ID
-        share_id = share_manager.save_dashboard_state(dashboard_state, dataframe_data)
+        share_id = await io_executor.run(save_share)
         
         return {
             "status": "success",
@@ -272,7 +1004,7 @@ async def get_shared_dashboard(share_id: str):
     """Get shared dashboard state"""
     try:
         # Get dashboard state from share ID
-        dashboard_state = share_manager.get_dashboard_state(share_id)
+        dashboard_state = await io_executor.run(share_manager.get_dashboard_state, share_id)
         
         if not dashboard_state:
             raise HTTPException(status_code=404, detail="Shared dashboard not found")
@@ -281,14 +1013,17 @@ async def get_shared_dashboard(share_id: str):
         inferred_options = dashboard_state.get("inferred_options", {})
         param_values, all_option_values = dashboard_state.get("param_values", {}), dashboard_state.get("all_option_values", {})
         
-        # Convert DataFrame to dict for caching
-        result = {
-            "data": dashboard_state.get("dataframe_data"),
-            "dashboard_config": dashboard_state.get("dashboard_config")
-        }
-        
-        # Cache the result and get query hash
-        query_hash = session_manager.save_query_result(share_id, sql_query, result)
+        def cache_shared_data():
+            # 分享中保存的数据转换为DataFrame后缓存
+            df = share_manager.get_dataframe_from_state(dashboard_state)
+            if df is None:
+                df = pd.DataFrame()
+            
+            # Cache the result and get query hash
+            # 分享的数据是快照, 不与实时查询结果共用
+            return session_manager.save_query_dataframe(share_id, sql_query, df, dashboard_state.get("dashboard_config"), data_source=f"share:{share_id}")
+
+        query_hash = await io_executor.run(cache_shared_data)
         return {
             "status": "success",
             "message": "Shared dashboard retrieved successfully",
@@ -324,8 +1059,9 @@ async def update_dashboard_config(request: dict):
         updated_config = request.get("config", {})
 
         # 保存更新后的配置
-        with open(config_path, 'w', encoding='utf-8') as f:
-            json.dump(updated_config, f, ensure_ascii=False, indent=2)
+        await io_executor.run(write_json_file, config_path, updated_config)
+        if isinstance(updated_config, dict) and updated_config.get("rollups"):
+            schedule_rollup_refresh(updated_config["rollups"])
         return {
             "status": "success",
             "message": "配置更新成功",
@@ -1,52 +1,161 @@
 import duckdb
+import itertools
 import os
+import threading
+from functools import lru_cache
 from pathlib import Path
+from typing import Any, Dict, List
+
+from src.utils.metrics import timed
+from src.database.table_versions import ensure_version_table, bump_table_version, query_fingerprint
+from src.database.rollups import RollupManager
 
 # 数据库文件路径
 DB_PATH = Path(__file__).parent.parent.parent / "data" / "dashboard.duckdb"
 
+# MySQL连接地址
+MYSQL_URL = ""
+
+# MySQL连接池配置, 每个连接地址共用一个engine
+MYSQL_POOL_SETTINGS = {
+    "pool_size": 5,
+    "max_overflow": 10,
+    "pool_pre_ping": True,   # 取出连接时检测是否已被服务端断开
+    "pool_recycle": 3600,    # 超过1小时的连接重新建立
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+# DuckDB配置, 例如 {"threads": 8, "memory_limit": "8GB"}, 为空时使用DuckDB默认值
+DUCKDB_SETTINGS = {}
+
 # 确保数据目录存在
 os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
 
+
+class DuckDBConnectionManager:
+    """每个进程只打开一次DuckDB数据库, 每个请求使用独立的cursor
+
+    数据库实例常驻, buffer pool、catalog缓存和已加载的扩展在请求之间保留。
+    """
+
+    def __init__(self, db_path, settings=None):
+        self.db_path = db_path
+        self.settings = settings if settings is not None else DUCKDB_SETTINGS
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def get_database(self):
+        """返回进程内共用的数据库连接, 首次调用时打开"""
+        with self._lock:
+            if self._conn is None:
+                self._conn = duckdb.connect(str(self.db_path), config=dict(self.settings))
+            return self._conn
+
+    def cursor(self):
+        """返回新的cursor, 调用方负责close; 多个线程可以各自使用自己的cursor"""
+        database = self.get_database()
+        with self._lock:
+            return database.cursor()
+
+    def configure(self, **settings):
+        """修改threads/memory_limit等配置, 对已打开的数据库立即生效"""
+        self.settings = {**self.settings, **settings}
+        with self._lock:
+            if self._conn is not None:
+                for name, value in settings.items():
+                    self._conn.execute(f"SET {name} = '{value}'")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+duckdb_manager = DuckDBConnectionManager(DB_PATH)
+
+# 仪表盘配置中声明的预聚合表, 只用于DuckDB数据源
+rollup_manager = RollupManager()
+
 def get_connection():
     import socket
     if socket.gethostname() == "Jiahaos-MacBook-Pro.local":
-        # 开发环境, 获取DuckDB连接
-        return duckdb.connect(str(DB_PATH))
+        # 开发环境, 获取DuckDB cursor, 调用方close只关闭cursor
+        return duckdb_manager.cursor()
     else:
         pass
     
     
 
 def execute_duckdb_query(query: str, params=None):
-    """执行SQL查询并返回结果"""
+    """执行SQL查询并返回结果, params为$name形式绑定参数的值"""
     conn = get_connection()
     try:
         
-        result = conn.execute(query).fetchdf()
+        result = conn.execute(query, params).fetchdf() if params else conn.execute(query).fetchdf()
         return result
     except Exception as e:
         raise e
     finally:
         conn.close()
 
-def pd_read_sql(url, query, prepare_stmt=None):
-    from sqlalchemy import create_engine, text
+def get_engine(url, prepare_stmt=None):
+    """按连接地址复用SQLAlchemy engine, prepare_stmt只在连接池新建连接时执行一次"""
+    from sqlalchemy import create_engine, event
+
+    key = (url, prepare_stmt)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = create_engine(url, **MYSQL_POOL_SETTINGS)
+            if prepare_stmt is not None:
+                @event.listens_for(engine, "connect")
+                def run_prepare_stmt(dbapi_connection, connection_record):
+                    cursor = dbapi_connection.cursor()
+                    try:
+                        cursor.execute(prepare_stmt)
+                    finally:
+                        cursor.close()
+            _engines[key] = engine
+    return engine
+
+def configure_mysql_pool(**settings):
+    """修改连接池配置, 已有的engine会被关闭并在下次查询时按新配置重建"""
+    MYSQL_POOL_SETTINGS.update(settings)
+    dispose_engines()
+
+def dispose_engines():
+    """关闭所有连接池"""
+    with _engines_lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+
+def close_connections():
+    """应用退出时关闭MySQL连接池和DuckDB数据库"""
+    dispose_engines()
+    duckdb_manager.close()
+
+@lru_cache(maxsize=256)
+def _text_clause(query: str):
+    """SQL对应的TextClause, 每条SQL只解析一次, 编译结果由engine的编译缓存复用"""
+    from sqlalchemy import text
+    return text(query)
+
+def pd_read_sql(url, query, prepare_stmt=None, params=None):
     import pandas as pd
-    engine = create_engine(url)
-    # with语句， 避免忘记close connection
+    engine = get_engine(url, prepare_stmt)
+    # with语句， 避免忘记close connection (连接归还连接池)
     with engine.connect() as con:
-        if prepare_stmt is not None:
-            con.exec_driver_sql(prepare_stmt)
-
         # query = text(query).execution_options(no_parameters=True)
-        query = text(query)
-        df = pd.read_sql_query(query, con=con)
+        df = pd.read_sql_query(_text_clause(query), con=con, params=params or None)
     return df
 
-def execute_mysql_query(query, url, prepare_stmt=None):
+def execute_mysql_query(query, url, prepare_stmt=None, params=None):
     import pandas as pd
-    engine = lambda query: pd_read_sql(url, query, prepare_stmt=prepare_stmt)
+    engine = lambda query: pd_read_sql(url, query, prepare_stmt=prepare_stmt, params=params)
 
     try:
         # print("type:", type(query))
@@ -56,13 +165,222 @@ def execute_mysql_query(query, url, prepare_stmt=None):
     return df
 
 def execute_query(query: str, params=None):
+    """执行查询, params为绑定参数的值, 占位符形式见get_dialect()"""
+    with timed("db"):
+        if get_dialect() == "duckdb":
+            return execute_duckdb_query(query,params)
+        else:
+            return execute_mysql_query(query, MYSQL_URL, prepare_stmt='set query_mem_limit = 68719476736', params=params)
+
+def get_dialect() -> str:
+    """execute_query使用的数据库: "duckdb"(绑定参数为$name) 或 "mysql"(绑定参数为:name)"""
+    import socket
+    if socket.gethostname() == "Jiahaos-MacBook-Pro.local":
+        return "duckdb"
+    return "mysql"
+
+def get_source_fingerprint(query: str):
+    """查询读取的所有表的版本指纹, 表未变化时指纹不变; 无法跟踪时(MySQL、表函数等)返回None"""
+    if get_dialect() != "duckdb":
+        return None
+    conn = get_connection()
+    try:
+        return query_fingerprint(conn, query)
+    except Exception as e:
+        print(f"Unable to fingerprint source tables: {str(e)}")
+        return None
+    finally:
+        conn.close()
+
+def mark_table_changed(table_name: str) -> int:
+    """加载程序写入数据后调用, 读取该表的缓存结果不再复用; 返回表的新版本号"""
+    conn = get_connection()
+    try:
+        return bump_table_version(conn, table_name)
+    finally:
+        conn.close()
+
+def route_to_rollup(query: str, definitions=None):
+    """注册配置中声明的rollup, 查询可以由聚合表回答时改写为读取聚合表
+
+    返回(改写后的SQL或None, 聚合表名或None, 是否有匹配的聚合表需要重新生成)
+    """
+    if get_dialect() != "duckdb":
+        return None, None, False
+    rollup_manager.register(definitions)
+    conn = get_connection()
+    try:
+        return rollup_manager.route(conn, query)
+    except Exception as e:
+        print(f"Unable to route query to rollup: {str(e)}")
+        return None, None, False
+    finally:
+        conn.close()
+
+def refresh_rollups(definitions=None, force: bool = False):
+    """注册rollup并重新生成基础表已变化(force时为全部)的聚合表, 返回重新生成的表名"""
+    if get_dialect() != "duckdb":
+        return []
+    rollup_manager.register(definitions)
+    conn = get_connection()
+    try:
+        return rollup_manager.refresh(conn, force)
+    finally:
+        conn.close()
+
+def get_rollup_stats():
+    conn = get_connection() if get_dialect() == "duckdb" else None
+    try:
+        return rollup_manager.stats(conn)
+    finally:
+        if conn is not None:
+            conn.close()
+
+def get_data_source() -> str:
+    """返回execute_query实际使用的数据源标识, 相同SQL在不同数据源上的结果不能共用"""
     import socket
+    import hashlib
     if socket.gethostname() == "Jiahaos-MacBook-Pro.local":
-        return execute_duckdb_query(query,params)
+        return f"duckdb:{DB_PATH}"
     else:
-        url = ""
-        return execute_mysql_query(query,url, prepare_stmt='set query_mem_limit = 68719476736')
+        # 连接地址中包含密码, 只使用其哈希值
+        return "mysql:" + hashlib.md5(MYSQL_URL.encode()).hexdigest()
+
+
+def distinct_values_sql(query: str, column: str, limit: int, dialect: str = "duckdb") -> str:
+    """在查询结果上取某一列唯一值的SQL, 按值排序以保证每次返回相同的结果"""
+    quote = "`" if dialect == "mysql" else '"'
+    identifier = quote + column.replace(quote, quote * 2) + quote
+    # 原查询作为子查询, 去掉末尾的分号
+    subquery = query.strip().rstrip(";").strip()
+    return (f"SELECT DISTINCT {identifier} FROM ({subquery}) AS distinct_source "
+            f"WHERE {identifier} IS NOT NULL ORDER BY 1 LIMIT {int(limit)}")
+
+def grouped_distinct_values_sql(query: str, columns: List[str], limit: int) -> str:
+    """
+    DuckDB中以GROUPING SETS一次扫描计算查询结果若干列的唯一值, 每列按值排序取前limit个;
+    结果的每行只有一列不为NULL, distinct_set为该列在columns中的序号
+    """
+    identifiers = ['"' + column.replace('"', '""') + '"' for column in columns]
+    selected = ", ".join(identifiers)
+    subquery = query.strip().rstrip(";").strip()
+    grouping_sets = ", ".join(f"({identifier})" for identifier in identifiers)
+    # 每个分组只有分组列有值, 分组列本身为NULL的行去掉
+    distinct_set = "CASE " + " ".join(f"WHEN {identifier} IS NOT NULL THEN {index}"
+                                      for index, identifier in enumerate(identifiers)) + " END"
+    return (f"SELECT {selected}, distinct_set FROM ("
+            f"SELECT {selected}, {distinct_set} AS distinct_set, "
+            f"row_number() OVER (PARTITION BY {distinct_set} ORDER BY {selected}) AS distinct_rank "
+            f"FROM (SELECT {selected} FROM ({subquery}) AS distinct_source GROUP BY GROUPING SETS ({grouping_sets})) AS distinct_groups "
+            f"WHERE {' OR '.join(f'{identifier} IS NOT NULL' for identifier in identifiers)}"
+            f") AS distinct_ranked WHERE distinct_rank <= {int(limit)} ORDER BY distinct_set, {selected}")
+
+def query_grouped_distinct_values(query: str, columns: List[str], limit: int) -> Dict[str, Any]:
+    """DuckDB中一次计算查询结果若干列的唯一值(每列最多limit个), 查询结果中不存在的列跳过"""
+    subquery = query.strip().rstrip(";").strip()
+    # DESCRIBE只绑定查询, 不执行
+    described = execute_query(f"DESCRIBE SELECT * FROM ({subquery}) AS distinct_source")
+    available = set(described["column_name"])
+    present = [column for column in dict.fromkeys(columns) if column in available]
+    if not present:
+        return {}
+    df = execute_query(grouped_distinct_values_sql(query, present, limit))
+    return {column: df.loc[df["distinct_set"] == index, column].array for index, column in enumerate(present)}
 
+def query_distinct_values(query: str, column: str, limit: int):
+    """在数据库中计算查询结果某一列的唯一值(最多limit个), 不读取完整结果"""
+    df = execute_query(distinct_values_sql(query, column, limit, get_dialect()))
+    # execute_mysql_query把错误信息作为结果返回
+    if "error" in df.columns and column != "error":
+        raise RuntimeError(df["error"].iloc[0])
+    return df.iloc[:, 0].array
+
+
+def _decimal_as_double(schema):
+    """DECIMAL列转换为double, 与fetchdf()返回的数据类型保持一致"""
+    import pyarrow as pa
+    return pa.schema([
+        pa.field(field.name, pa.float64()) if pa.types.is_decimal(field.type) else field
+        for field in schema
+    ])
+
+def stream_duckdb_query(query: str, batch_size: int = 100000, params=None):
+    """流式执行SQL查询, 返回按批读取的pyarrow.RecordBatchReader"""
+    import pyarrow as pa
+    conn = get_connection()
+    try:
+        reader = (conn.execute(query, params) if params else conn.execute(query)).fetch_record_batch(batch_size)
+    except Exception:
+        conn.close()
+        raise
+    schema = _decimal_as_double(reader.schema)
+
+    def batches():
+        # 读取完毕后才关闭连接
+        try:
+            for batch in reader:
+                if batch.schema != schema:
+                    # 经由字符串转换, 避免decimal直接转double产生的精度误差
+                    batch = pa.RecordBatch.from_arrays([
+                        column.cast(pa.string()).cast(field.type) if column.type != field.type else column
+                        for column, field in zip(batch.columns, schema)
+                    ], schema=schema)
+                yield batch
+        finally:
+            conn.close()
+
+    return pa.RecordBatchReader.from_batches(schema, batches())
+
+# 确定MySQL流式结果的类型时最多缓存的批数, 之后仍全为NULL的列按字符串处理
+STREAM_SCHEMA_PROBE_BATCHES = 10
+
+def _merge_null_fields(schema, other):
+    """schema中类型为null(目前全为NULL)的列使用other中的类型"""
+    import pyarrow as pa
+    if schema is None:
+        return other
+    return pa.schema([
+        other.field(index) if pa.types.is_null(field.type) else field
+        for index, field in enumerate(schema)
+    ])
+
+def stream_mysql_query(query: str, url, prepare_stmt=None, batch_size: int = 100000, params=None):
+    """流式执行MySQL查询(服务端游标), 返回按批读取的pyarrow.RecordBatchReader"""
+    import pandas as pd
+    import pyarrow as pa
+
+    def chunks():
+        engine = get_engine(url, prepare_stmt)
+        with engine.connect().execution_options(stream_results=True) as con:
+            for chunk in pd.read_sql_query(_text_clause(query), con=con, params=params or None, chunksize=batch_size):
+                yield pa.Table.from_pandas(chunk, preserve_index=False)
+
+    chunk_iter = chunks()
+    # 每批的类型由pandas推断, 某一批中全为NULL的列类型为null:
+    # 继续读取直到每列都有非空值, 以合并后的类型作为整个结果的schema
+    buffered, schema = [], None
+    for table in chunk_iter:
+        buffered.append(table)
+        schema = _merge_null_fields(schema, table.schema)
+        if len(buffered) >= STREAM_SCHEMA_PROBE_BATCHES or not any(pa.types.is_null(field.type) for field in schema):
+            break
+    if schema is None:
+        return pa.RecordBatchReader.from_batches(pa.schema([]), iter([]))
+    schema = pa.schema([field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in schema])
+
+    def batches():
+        for table in itertools.chain(buffered, chunk_iter):
+            # 各批推断的类型不同时(例如含NULL的整数列为float)转换为统一的类型
+            yield from table.cast(schema).to_batches()
+
+    return pa.RecordBatchReader.from_batches(schema, batches())
+
+def stream_query(query: str, batch_size: int = 100000, params=None):
+    """流式版本的execute_query, 结果不会一次性全部读入内存"""
+    if get_dialect() == "duckdb":
+        return stream_duckdb_query(query, batch_size, params)
+    else:
+        return stream_mysql_query(query, MYSQL_URL, prepare_stmt='set query_mem_limit = 68719476736', batch_size=batch_size, params=params)
 
 def init_db():
     """初始化数据库，创建示例表和数据"""
@@ -81,6 +399,9 @@ def init_db():
         )
         """)
         
+        # 表版本的变更计数, 读取这些表的缓存结果按版本复用
+        ensure_version_table(conn)
+
         # 检查表是否为空，如果为空则插入示例数据
         count = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
         if count == 0:
@@ -103,6 +424,7 @@ def init_db():
                 (14, '平板电脑', '电子产品', 3499.99, 10, '2023-05-10', '西南'),
                 (15, '键盘', '配件', 249.99, 25, '2023-05-20', '西北')
             """)
+            bump_table_version(conn, "sales")
         print("数据库初始化完成")
     except Exception as e:
         print(f"数据库初始化错误: {e}")
@@ -0,0 +1,382 @@
+# coding=utf-8
+"""
+DuckDB数据源的预聚合表(rollup)
+
+仪表盘配置的rollups中声明基础表、维度列和度量列的聚合方式, 例如:
+    {"table": "sales", "dimensions": ["region", "category", "sale_date"],
+     "measures": {"quantity": ["sum"], "price": ["sum", "avg", "min", "max"]}}
+服务端按维度分组生成物化的聚合表, 基础表的版本指纹变化后重新生成。
+
+查询的聚合只涉及维度列和已声明的度量时, 改写为读取聚合表:
+过滤和分组的列都是维度, 每组聚合表的行已经按维度汇总, 对其再聚合得到相同的结果
+(sum -> sum(sum_x), count -> sum(count_x), avg -> sum(sum_x) / sum(count_x), min/max不变)。
+SQL只由DuckDB解析(json_serialize_sql)和生成(json_deserialize_sql), 无法确定等价的查询不改写。
+"""
+import copy
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.database.table_versions import table_fingerprint, bump_table_version
+
+ROLLUP_AGGREGATES = ("sum", "count", "min", "max", "avg")
+STATE_TABLE = "_rollups"
+
+# 聚合表中的行数列, count(*)改写为其合计
+COUNT_STAR_COLUMN = "count_star"
+
+# 可以改写的聚合函数, count(*)解析为count_star
+_AGGREGATE_FUNCTIONS = {"sum", "count", "count_star", "min", "max", "avg"}
+# 出现时不改写: 子查询、窗口函数、*、lambda
+_UNSUPPORTED_CLASSES = {"SUBQUERY", "WINDOW", "STAR", "LAMBDA", "LAMBDA_REF", "POSITIONAL_REFERENCE"}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class Rollup:
+    """A declared aggregate table: base table grouped by dimensions, with per-column measures"""
+
+    def __init__(self, table: str, dimensions: List[str], measures: Dict[str, List[str]], name: Optional[str] = None):
+        if not table or not isinstance(table, str):
+            raise ValueError("Rollup table is required")
+        self.table = table
+        self.dimensions = list(dimensions or [])
+        # avg由sum和count计算
+        self.measures: Dict[str, List[str]] = {}
+        for column, aggregates in (measures or {}).items():
+            aggregates = [aggregates] if isinstance(aggregates, str) else list(aggregates)
+            unsupported = [agg for agg in aggregates if agg not in ROLLUP_AGGREGATES]
+            if unsupported:
+                raise ValueError(f"Unsupported rollup aggregate: {unsupported}, expected one of {list(ROLLUP_AGGREGATES)}")
+            if "avg" in aggregates:
+                aggregates = [agg for agg in aggregates if agg != "avg"] + ["sum", "count"]
+            self.measures[column] = sorted(set(aggregates))
+
+        definition = json.dumps({"table": table, "dimensions": self.dimensions, "measures": self.measures}, sort_keys=True)
+        self.key = hashlib.md5(definition.encode()).hexdigest()
+        self.table_name = f"_rollup_{name}" if name else f"_rollup_{table}_{self.key[:10]}"
+
+        columns = [column.lower() for column in self.dimensions + self.measure_columns()]
+        if len(set(columns)) != len(columns):
+            raise ValueError(f"Rollup columns are not unique: {columns}")
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "Rollup":
+        return cls(config.get("table"), config.get("dimensions", []), config.get("measures", {}), config.get("name"))
+
+    def measure_columns(self) -> List[str]:
+        return [COUNT_STAR_COLUMN] + [self.measure_column(agg, column)
+                                      for column, aggregates in self.measures.items() for agg in aggregates]
+
+    @staticmethod
+    def measure_column(aggregate: str, column: str) -> str:
+        return f"{aggregate}_{column}"
+
+    def has_measure(self, aggregate: str, column: str) -> bool:
+        for name, aggregates in self.measures.items():
+            if name.lower() == column.lower():
+                return aggregate in aggregates
+        return False
+
+    def is_dimension(self, column: str) -> bool:
+        return column.lower() in {dimension.lower() for dimension in self.dimensions}
+
+    def build_sql(self) -> str:
+        dimensions = [_quote(dimension) for dimension in self.dimensions]
+        measures = [f"count(*) AS {_quote(COUNT_STAR_COLUMN)}"] + [
+            f"{agg}({_quote(column)}) AS {_quote(self.measure_column(agg, column))}"
+            for column, aggregates in self.measures.items() for agg in aggregates
+        ]
+        sql = f"CREATE OR REPLACE TABLE {_quote(self.table_name)} AS SELECT {', '.join(dimensions + measures)} FROM {_quote(self.table)}"
+        if dimensions:
+            sql += f" GROUP BY {', '.join(dimensions)}"
+        return sql
+
+
+class _NotRoutable(Exception):
+    pass
+
+
+def _parse(conn, sql: str) -> Optional[Dict[str, Any]]:
+    """只解析不绑定, 返回语法树, 不是单条语句或解析失败时返回None"""
+    tree = json.loads(conn.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+    if tree.get("error") or len(tree.get("statements", [])) != 1:
+        return None
+    return tree
+
+
+def _parse_expression(conn, sql: str) -> Dict[str, Any]:
+    return _parse(conn, f"SELECT {sql}")["statements"][0]["node"]["select_list"][0]
+
+
+def _expression_name(conn, tree: Dict[str, Any], expression: Dict[str, Any]) -> str:
+    """DuckDB为没有别名的表达式生成的列名, 即表达式的SQL文本"""
+    named = copy.deepcopy(tree)
+    node = named["statements"][0]["node"]
+    node.update({"select_list": [expression], "where_clause": None, "group_expressions": [], "group_sets": [],
+                 "having": None, "modifiers": [], "aggregate_handling": "STANDARD_HANDLING",
+                 "from_table": {"type": "EMPTY"}})
+    sql = conn.execute("SELECT json_deserialize_sql(?::JSON)", [json.dumps(named)]).fetchone()[0]
+    return sql[len("SELECT "):]
+
+
+class _QueryRewriter:
+    """Rewrites one parsed SELECT against one rollup, raising _NotRoutable when it cannot"""
+
+    def __init__(self, conn, rollup: Rollup, table_aliases: List[str]):
+        self.conn = conn
+        self.rollup = rollup
+        self.table_aliases = {alias.lower() for alias in table_aliases if alias}
+        self.aggregates = 0
+
+    def column_name(self, node: Dict[str, Any]) -> str:
+        names = node.get("column_names", [])
+        if len(names) == 2 and names[0].lower() in self.table_aliases:
+            return names[1]
+        if len(names) != 1:
+            raise _NotRoutable(f"column reference {names}")
+        return names[0]
+
+    def rewrite(self, node, aliases=frozenset()):
+        """aliases为可以引用的select别名(HAVING和ORDER BY中)"""
+        if isinstance(node, list):
+            return [self.rewrite(value, aliases) for value in node]
+        if not isinstance(node, dict):
+            return node
+        node_class = node.get("class")
+        if node_class in _UNSUPPORTED_CLASSES or node.get("type") == "SELECT_NODE":
+            raise _NotRoutable(node_class or node.get("type"))
+        if node_class == "COLUMN_REF":
+            name = self.column_name(node)
+            if not self.rollup.is_dimension(name) and name.lower() not in aliases:
+                raise _NotRoutable(f"column {name} is not a dimension")
+            return {**node, "column_names": [name]}
+        if (node_class == "FUNCTION" and not node.get("is_operator")
+                and node.get("function_name", "").lower() in _AGGREGATE_FUNCTIONS):
+            self.aggregates += 1
+            return self.rewrite_aggregate(node)
+        return {key: self.rewrite(value, aliases) for key, value in node.items()}
+
+    def rewrite_aggregate(self, node: Dict[str, Any]) -> Dict[str, Any]:
+        function = node["function_name"].lower()
+        if node.get("filter") is not None or node.get("order_bys", {}).get("orders"):
+            raise _NotRoutable("aggregate with FILTER or ORDER BY")
+        if function == "count_star":
+            template = f"CAST(coalesce(sum({_quote(COUNT_STAR_COLUMN)}), 0) AS BIGINT)"
+        else:
+            children = node.get("children", [])
+            if len(children) != 1 or children[0].get("class") != "COLUMN_REF":
+                raise _NotRoutable("aggregate argument is not a column")
+            column = self.column_name(children[0])
+            # 维度列在聚合表中保留原值, DISTINCT聚合和min/max可以直接计算
+            if self.rollup.is_dimension(column) and (node.get("distinct") or function in ("min", "max")):
+                return {**node, "children": [{**children[0], "column_names": [column]}]}
+            if node.get("distinct"):
+                raise _NotRoutable("DISTINCT aggregate over a measure")
+            template = self.measure_template(function, column)
+        return {**_parse_expression(self.conn, template), "alias": node.get("alias", "")}
+
+    def measure_template(self, function: str, column: str) -> str:
+        rollup = self.rollup
+        required = ["sum", "count"] if function == "avg" else [function]
+        if not all(rollup.has_measure(agg, column) for agg in required):
+            raise _NotRoutable(f"no {function} measure for {column}")
+        if function == "avg":
+            return (f"CAST(sum({_quote(rollup.measure_column('sum', column))}) AS DOUBLE)"
+                    f" / sum({_quote(rollup.measure_column('count', column))})")
+        if function == "count":
+            return f"CAST(coalesce(sum({_quote(rollup.measure_column('count', column))}), 0) AS BIGINT)"
+        # sum的合计仍是sum, min/max的最值仍是min/max
+        return f"{function}({_quote(rollup.measure_column(function, column))})"
+
+
+def rewrite_query(conn, sql: str, rollup: Rollup) -> Optional[str]:
+    """SQL for the same result read from the rollup table, or None when the query is not eligible"""
+    tree = _parse(conn, sql)
+    if tree is None:
+        return None
+    node = tree["statements"][0]["node"]
+    from_table = node.get("from_table") or {}
+    if (node.get("type") != "SELECT_NODE" or node.get("cte_map", {}).get("map")
+            or node.get("aggregate_handling") not in ("STANDARD_HANDLING", "FORCE_AGGREGATES")
+            or node.get("sample") is not None or node.get("qualify") is not None
+            or from_table.get("type") != "BASE_TABLE" or from_table.get("sample") is not None
+            or from_table.get("at_clause") is not None or from_table.get("column_name_alias")
+            or from_table.get("catalog_name") or from_table.get("schema_name", "") not in ("", "main")
+            or from_table.get("table_name", "").lower() != rollup.table.lower()):
+        return None
+
+    rewriter = _QueryRewriter(conn, rollup, [from_table.get("table_name"), from_table.get("alias")])
+    aliases = frozenset(item.get("alias", "").lower() for item in node["select_list"] if item.get("alias"))
+    try:
+        select_list = []
+        for item in node["select_list"]:
+            rewritten = rewriter.rewrite(item)
+            # 改写后的表达式保持原来的列名, 列引用的列名不含表名
+            if rewritten != item and not item.get("alias") and item.get("class") != "COLUMN_REF":
+                rewritten["alias"] = _expression_name(conn, tree, item)
+            select_list.append(rewritten)
+        where_clause = rewriter.rewrite(node.get("where_clause"))
+        group_expressions = rewriter.rewrite(node.get("group_expressions", []))
+        having = rewriter.rewrite(node.get("having"), aliases)
+        modifiers = rewriter.rewrite(node.get("modifiers", []), aliases)
+    except _NotRoutable:
+        return None
+    # 不聚合的明细查询需要基础表的每一行
+    if not rewriter.aggregates and not group_expressions and node["aggregate_handling"] != "FORCE_AGGREGATES":
+        return None
+
+    node.update({"select_list": select_list, "where_clause": where_clause, "group_expressions": group_expressions,
+                 "having": having, "modifiers": modifiers,
+                 "from_table": {**from_table, "schema_name": "", "table_name": rollup.table_name}})
+    return conn.execute("SELECT json_deserialize_sql(?::JSON)", [json.dumps(tree)]).fetchone()[0]
+
+
+class RollupManager:
+    """Registry of declared rollups: builds them, tracks their freshness and routes queries to them
+
+    A rollup is fresh while its base table's fingerprint matches the one recorded when it
+    was built; build state is kept in the _rollups table so it survives restarts.
+    """
+
+    def __init__(self):
+        self._rollups: Dict[str, Rollup] = {}
+        self._state: Optional[Dict[str, Dict[str, Any]]] = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self.counters = {"routed": 0, "stale": 0, "builds": 0, "build_errors": 0}
+
+    def register(self, definitions: List[Dict[str, Any]]) -> List[Rollup]:
+        """Register rollups declared in a dashboard config; invalid declarations are skipped"""
+        rollups = []
+        for definition in definitions or []:
+            try:
+                rollup = Rollup.from_config(definition)
+            except (ValueError, AttributeError, TypeError) as e:
+                print(f"Invalid rollup definition {definition}: {str(e)}")
+                continue
+            with self._lock:
+                self._rollups[rollup.table_name] = rollup
+            rollups.append(rollup)
+        return rollups
+
+    def _load_state(self, conn) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            if self._state is None:
+                conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                    table_name VARCHAR PRIMARY KEY,
+                    definition VARCHAR,
+                    source_fingerprint VARCHAR,
+                    row_count BIGINT,
+                    built_at TIMESTAMP
+                )
+                """)
+                rows = conn.execute(f"SELECT table_name, definition, source_fingerprint, row_count, built_at "
+                                    f"FROM {STATE_TABLE}").fetchall()
+                self._state = {row[0]: {"definition": row[1], "source_fingerprint": row[2], "rows": row[3],
+                                        "built_at": str(row[4])} for row in rows}
+            return self._state
+
+    def is_fresh(self, conn, rollup: Rollup, fingerprint: Optional[str] = None) -> bool:
+        state = self._load_state(conn).get(rollup.table_name)
+        if state is None or state["definition"] != rollup.key:
+            return False
+        fingerprint = fingerprint or table_fingerprint(conn, [rollup.table])
+        return fingerprint is not None and state["source_fingerprint"] == fingerprint
+
+    def build(self, conn, rollup: Rollup) -> int:
+        """(Re)build one rollup table from its base table; returns its row count"""
+        state = self._load_state(conn)
+        # 先记录基础表的指纹, 生成期间基础表发生变化时下次检查会重新生成
+        fingerprint = table_fingerprint(conn, [rollup.table])
+        conn.execute(rollup.build_sql())
+        rows = conn.execute(f"SELECT count(*) FROM {_quote(rollup.table_name)}").fetchone()[0]
+        conn.execute(f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, ?, ?, ?, now())",
+                     [rollup.table_name, rollup.key, fingerprint, rows])
+        # 直接读取聚合表的缓存结果不再复用
+        bump_table_version(conn, rollup.table_name)
+        with self._lock:
+            state[rollup.table_name] = {"definition": rollup.key, "source_fingerprint": fingerprint, "rows": rows,
+                                        "built_at": str(conn.execute("SELECT now()").fetchone()[0])}
+            self.counters["builds"] += 1
+        return rows
+
+    def refresh(self, conn, force: bool = False) -> List[str]:
+        """Rebuild rollups whose base table changed (all of them when force); returns the rebuilt tables
+
+        Only one refresh runs at a time, concurrent calls return immediately.
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return []
+        try:
+            with self._lock:
+                rollups = list(self._rollups.values())
+            rebuilt = []
+            for rollup in rollups:
+                if not force and self.is_fresh(conn, rollup):
+                    continue
+                try:
+                    self.build(conn, rollup)
+                    rebuilt.append(rollup.table_name)
+                except Exception as e:
+                    with self._lock:
+                        self.counters["build_errors"] += 1
+                    print(f"Unable to build rollup {rollup.table_name}: {str(e)}")
+            return rebuilt
+        finally:
+            self._refresh_lock.release()
+
+    def route(self, conn, sql: str) -> Tuple[Optional[str], Optional[str], bool]:
+        """Rewrite a query to the smallest fresh rollup that can answer it
+
+        Returns (rewritten SQL or None, rollup table or None, whether a matching rollup is stale).
+        """
+        tree = _parse(conn, sql)
+        from_table = (tree["statements"][0]["node"].get("from_table") or {}) if tree else {}
+        if from_table.get("type") != "BASE_TABLE":
+            return None, None, False
+        table = from_table.get("table_name", "").lower()
+        with self._lock:
+            candidates = [rollup for rollup in self._rollups.values() if rollup.table.lower() == table]
+        if not candidates:
+            return None, None, False
+
+        state = self._load_state(conn)
+        fingerprint = table_fingerprint(conn, [candidates[0].table])
+        stale = False
+        # 优先使用行数最少的聚合表
+        for rollup in sorted(candidates, key=lambda r: (state.get(r.table_name) or {}).get("rows") or 0):
+            if not self.is_fresh(conn, rollup, fingerprint):
+                stale = True
+                continue
+            rewritten = rewrite_query(conn, sql, rollup)
+            if rewritten is not None:
+                with self._lock:
+                    self.counters["routed"] += 1
+                return rewritten, rollup.table_name, False
+        if stale:
+            with self._lock:
+                self.counters["stale"] += 1
+        return None, None, stale
+
+    def stats(self, conn=None) -> Dict[str, Any]:
+        with self._lock:
+            rollups = list(self._rollups.values())
+            state = dict(self._state or {})
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "rollups": [{
+                "table_name": rollup.table_name,
+                "table": rollup.table,
+                "dimensions": rollup.dimensions,
+                "measures": rollup.measures,
+                "rows": (state.get(rollup.table_name) or {}).get("rows"),
+                "built_at": (state.get(rollup.table_name) or {}).get("built_at"),
+                "fresh": self.is_fresh(conn, rollup) if conn is not None else None,
+            } for rollup in rollups],
+        }
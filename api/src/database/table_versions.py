@@ -0,0 +1,139 @@
+# coding=utf-8
+"""
+DuckDB数据源的表版本
+
+每张表的指纹由两部分组成:
+- 加载程序写入数据后调用bump_table_version递增的变更计数(保存在_table_versions表中)
+- DuckDB目录中的行数估计和建表语句, 用于发现没有递增计数的插入、删除和表结构变化;
+  行数不变的原地UPDATE不会改变指纹
+
+查询结果记录其读取的所有表(视图展开为其依赖的表)的指纹, 任何一张表的指纹变化后不再复用;
+指纹不变时复用时间仍有上限(见SessionManager.find_query_result), 以免一直复用未报告的修改之前的结果。
+"""
+import hashlib
+import re
+from typing import List, Optional, Set
+
+VERSION_TABLE = "_table_versions"
+
+_VIEW_PREFIX = re.compile(r'^\s*CREATE\s+(?:OR\s+REPLACE\s+)?(?:TEMP(?:ORARY)?\s+)?VIEW\s+.+?\s+AS\s+', re.IGNORECASE | re.DOTALL)
+
+
+def ensure_version_table(conn):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+        table_name VARCHAR PRIMARY KEY,
+        version BIGINT,
+        updated_at TIMESTAMP
+    )
+    """)
+
+
+def bump_table_version(conn, table_name: str) -> int:
+    """Record a change to a table, call after loading or modifying its data; returns the new version"""
+    ensure_version_table(conn)
+    conn.execute(f"""
+    INSERT INTO {VERSION_TABLE} VALUES (?, 1, now())
+    ON CONFLICT (table_name) DO UPDATE SET version = {VERSION_TABLE}.version + 1, updated_at = now()
+    """, [table_name])
+    return conn.execute(f"SELECT version FROM {VERSION_TABLE} WHERE table_name = ?", [table_name]).fetchone()[0]
+
+
+# 解析为列引用的时间关键字
+_TIME_KEYWORDS = {"current_date", "current_time", "current_timestamp", "localtime", "localtimestamp"}
+# 使用抽样(USING SAMPLE/TABLESAMPLE)的查询, 与易变函数一样每次结果可能不同
+_SAMPLE = "tablesample"
+_volatile_functions: Optional[Set[str]] = None
+
+
+def _get_volatile_functions(conn) -> Set[str]:
+    """结果不只由参数决定的内置函数(now()、current_date、random()等), 只查询一次"""
+    global _volatile_functions
+    if _volatile_functions is None:
+        rows = conn.execute("SELECT DISTINCT function_name FROM duckdb_functions() "
+                            "WHERE stability IN ('VOLATILE', 'CONSISTENT_WITHIN_QUERY')").fetchall()
+        _volatile_functions = {row[0].lower() for row in rows} | _TIME_KEYWORDS | {_SAMPLE}
+    return _volatile_functions
+
+
+def _scan_names(node, tables: Set[str], functions: Set[str], calls: Optional[Set[str]] = None):
+    """收集语法树中的表名和表函数名, 以及调用的函数名和单独的列名(时间关键字解析为列引用), 抽样记为_SAMPLE"""
+    if isinstance(node, dict):
+        if calls is not None and node.get("sample") is not None:
+            calls.add(_SAMPLE)
+        if node.get("type") == "BASE_TABLE":
+            tables.add(node.get("table_name"))
+        elif node.get("type") == "TABLE_FUNCTION":
+            functions.add(str(node.get("function", {}).get("function_name")))
+        elif calls is not None and node.get("class") == "FUNCTION":
+            calls.add(str(node.get("function_name")).lower())
+        elif calls is not None and node.get("class") == "COLUMN_REF" and len(node.get("column_names", [])) == 1:
+            calls.add(str(node["column_names"][0]).lower())
+        for value in node.values():
+            _scan_names(value, tables, functions, calls)
+    elif isinstance(node, list):
+        for value in node:
+            _scan_names(value, tables, functions, calls)
+
+
+def referenced_tables(conn, sql: str) -> Optional[List[str]]:
+    """Base tables a query reads, with views expanded
+
+    None when they cannot be determined, or when the result also depends on
+    something else: volatile functions such as now(), current_date or random(),
+    or sampling (USING SAMPLE / TABLESAMPLE).
+    """
+    import json
+
+    volatile = _get_volatile_functions(conn)
+    existing = {row[0] for row in conn.execute("SELECT table_name FROM duckdb_tables()").fetchall()}
+    views = dict(conn.execute("SELECT view_name, sql FROM duckdb_views() WHERE NOT internal").fetchall())
+    tables: Set[str] = set()
+    pending, seen_views = [sql], set()
+    while pending:
+        # 只解析不绑定, 返回语法树
+        tree = json.loads(conn.execute("SELECT json_serialize_sql(?)", [pending.pop()]).fetchone()[0])
+        names, functions, calls = set(), set(), set()
+        _scan_names(tree, names, functions, calls)
+        # 解析失败或读取文件等表函数时无法跟踪数据来源;
+        # 调用时间、随机数等函数或抽样时表不变结果也会变化
+        if tree.get("error") or functions or calls & volatile:
+            return None
+        for name in names:
+            if name in views:
+                if name not in seen_views:
+                    seen_views.add(name)
+                    pending.append(_VIEW_PREFIX.sub("", views[name], count=1))
+            elif name in existing:
+                # 既不是表也不是视图的名称是CTE
+                tables.add(name)
+    return sorted(tables)
+
+
+def table_fingerprint(conn, tables: List[str]) -> Optional[str]:
+    """Fingerprint of the current state of some tables, None if one of them does not exist"""
+    if not tables:
+        return None
+    placeholders = ", ".join("?" for _ in tables)
+    catalog = conn.execute(f"""
+    SELECT table_name, estimated_size, column_count, sql FROM duckdb_tables()
+    WHERE table_name IN ({placeholders}) ORDER BY table_name, schema_name
+    """, tables).fetchall()
+    if {row[0] for row in catalog} != set(tables):
+        return None
+
+    versions = {}
+    if conn.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = ?", [VERSION_TABLE]).fetchone()[0]:
+        versions = dict(conn.execute(f"SELECT table_name, version FROM {VERSION_TABLE} WHERE table_name IN ({placeholders})",
+                                     tables).fetchall())
+
+    state = [(name, versions.get(name, 0), size, columns, sql) for name, size, columns, sql in catalog]
+    return hashlib.md5(repr(state).encode()).hexdigest()
+
+
+def query_fingerprint(conn, sql: str) -> Optional[str]:
+    """Fingerprint of every table a query reads, None when it cannot be tracked"""
+    tables = referenced_tables(conn, sql)
+    if tables is None:
+        return None
+    return table_fingerprint(conn, tables)
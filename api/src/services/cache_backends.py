@@ -0,0 +1,195 @@
+# coding=utf-8
+import json
+from abc import ABC, abstractmethod
+from typing import Dict, Any, List, Optional
+from pathlib import Path
+import pandas as pd
+
+
+class JsonCacheBackend:
+    """Original cache format: one JSON file wrapping the records-JSON data and the metadata"""
+    name = "json"
+    suffix = ".json"
+
+    def data_path(self, stem: Path) -> Path:
+        return stem.with_name(stem.name + self.suffix)
+
+    def paths(self, stem: Path) -> List[Path]:
+        """All files belonging to one cache entry"""
+        return [self.data_path(stem)]
+
+    def exists(self, stem: Path) -> bool:
+        return self.data_path(stem).exists()
+
+    def save(self, stem: Path, df: pd.DataFrame, meta: Dict[str, Any]):
+        payload = dict(meta)
+        payload["data"] = df.to_json(orient='records')
+        with open(self.data_path(stem), 'w') as f:
+            json.dump(payload, f)
+
+    def save_batches(self, stem: Path, reader, meta: Dict[str, Any]) -> int:
+        """Write a pyarrow.RecordBatchReader, returns the number of rows"""
+        df = reader.read_all().to_pandas(date_as_object=False)
+        self.save(stem, df, dict(meta, rows=len(df)))
+        return len(df)
+
+    def load(self, stem: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        with open(self.data_path(stem)) as f:
+            payload = json.load(f)
+        df = pd.DataFrame(json.loads(payload["data"]))
+        if columns is not None:
+            df = df[[c for c in columns if c in df.columns]]
+        return df
+
+    def load_meta(self, stem: Path) -> Dict[str, Any]:
+        with open(self.data_path(stem)) as f:
+            payload = json.load(f)
+        payload.pop("data", None)
+        return payload
+
+
+class _ColumnarCacheBackend(JsonCacheBackend, ABC):
+    """Columnar formats keep the DataFrame in a binary file and the metadata in a JSON sidecar"""
+    meta_suffix = ".meta.json"
+
+    def meta_path(self, stem: Path) -> Path:
+        return stem.with_name(stem.name + self.meta_suffix)
+
+    def paths(self, stem: Path) -> List[Path]:
+        return [self.data_path(stem), self.meta_path(stem)]
+
+    def exists(self, stem: Path) -> bool:
+        return self.data_path(stem).exists() and self.meta_path(stem).exists()
+
+    def save(self, stem: Path, df: pd.DataFrame, meta: Dict[str, Any]):
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        self.write_table(self.data_path(stem), table)
+        # sidecar最后写入, 存在sidecar即代表数据文件完整
+        with open(self.meta_path(stem), 'w') as f:
+            json.dump(meta, f)
+
+    def save_batches(self, stem: Path, reader, meta: Dict[str, Any]) -> int:
+        """Write batches one by one, so memory stays bounded by the batch size"""
+        rows = self.write_batches(self.data_path(stem), reader)
+        with open(self.meta_path(stem), 'w') as f:
+            json.dump(dict(meta, rows=rows), f)
+        return rows
+
+    def load(self, stem: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return self.read_table(self.data_path(stem), columns).to_pandas(date_as_object=False)
+
+    def load_meta(self, stem: Path) -> Dict[str, Any]:
+        with open(self.meta_path(stem)) as f:
+            return json.load(f)
+
+    @abstractmethod
+    def write_table(self, path: Path, table):
+        """Write a pyarrow.Table to the data file"""
+
+    @abstractmethod
+    def write_batches(self, path: Path, reader) -> int:
+        """Write a pyarrow.RecordBatchReader to the data file, returns the number of rows"""
+
+    @abstractmethod
+    def read_table(self, path: Path, columns: Optional[List[str]] = None):
+        """Read the data file (optionally only some columns) as a pyarrow.Table"""
+
+
+class ArrowCacheBackend(_ColumnarCacheBackend):
+    """Arrow IPC file format (uncompressed, so it can be memory-mapped)
+
+    Files are memory-mapped on read: worker processes share the page cache, only the
+    requested columns are paged in, and numeric columns without nulls are handed to
+    pandas as zero-copy read-only views of the mapping.
+    """
+    name = "arrow"
+    suffix = ".arrow"
+
+    def __init__(self, memory_map: bool = True):
+        self.memory_map = memory_map
+
+    def write_table(self, path: Path, table):
+        import pyarrow as pa
+
+        with pa.OSFile(str(path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+
+    def write_batches(self, path: Path, reader) -> int:
+        import pyarrow as pa
+
+        rows = 0
+        with pa.OSFile(str(path), 'wb') as sink:
+            with pa.ipc.new_file(sink, reader.schema) as writer:
+                for batch in reader:
+                    writer.write_batch(batch)
+                    rows += batch.num_rows
+        return rows
+
+    def read_table(self, path: Path, columns: Optional[List[str]] = None):
+        import pyarrow as pa
+
+        if self.memory_map:
+            # 不关闭映射, 表中的buffer引用映射区域, 随表一起释放
+            source = pa.memory_map(str(path), 'r')
+            table = pa.ipc.open_file(source).read_all()
+        else:
+            with pa.OSFile(str(path), 'rb') as source:
+                table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select([c for c in columns if c in table.column_names])
+        return table
+
+    def load(self, stem: Path, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        import pyarrow as pa
+
+        table = self.read_table(self.data_path(stem), columns)
+        # split_blocks避免合并成二维block时的整体复制; 字符串列保持Arrow存储
+        string_dtypes = {
+            pa.string(): pd.StringDtype("pyarrow"),
+            pa.large_string(): pd.StringDtype("pyarrow"),
+        }
+        return table.to_pandas(split_blocks=True, date_as_object=False, types_mapper=string_dtypes.get)
+
+
+class ParquetCacheBackend(_ColumnarCacheBackend):
+    """Parquet format, smaller on disk at the cost of decoding"""
+    name = "parquet"
+    suffix = ".parquet"
+
+    def write_table(self, path: Path, table):
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, str(path))
+
+    def write_batches(self, path: Path, reader) -> int:
+        import pyarrow.parquet as pq
+
+        rows = 0
+        with pq.ParquetWriter(str(path), reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+                rows += batch.num_rows
+        return rows
+
+    def read_table(self, path: Path, columns: Optional[List[str]] = None):
+        import pyarrow.parquet as pq
+
+        if columns is not None:
+            columns = [c for c in columns if c in pq.read_schema(str(path)).names]
+        return pq.read_table(str(path), columns=columns)
+
+
+CACHE_BACKENDS = {
+    backend.name: backend
+    for backend in (JsonCacheBackend(), ArrowCacheBackend(), ParquetCacheBackend())
+}
+
+
+def get_cache_backend(cache_format: str) -> JsonCacheBackend:
+    """Look up a cache backend by format name"""
+    if cache_format not in CACHE_BACKENDS:
+        raise ValueError(f"Unsupported cache format: {cache_format}, expected one of {list(CACHE_BACKENDS)}")
+    return CACHE_BACKENDS[cache_format]
@@ -0,0 +1,186 @@
+# coding=utf-8
+import threading
+import time
+import traceback
+from typing import Dict, Any, Optional
+
+from src.services.session_manager import SessionManager
+from src.services.share_manager import ShareManager
+
+# 各类缓存文件的默认过期时间(秒), 按最近访问时间计算
+DEFAULT_TTLS = {
+    "ref": 24 * 3600,          # 会话对查询结果的引用
+    "object": 7 * 24 * 3600,   # 查询结果本身
+    "share": 30 * 24 * 3600,   # 分享的仪表盘
+    "panel": 24 * 3600,        # 分页读取的面板表格结果
+}
+
+class CacheCollector:
+    """Background garbage collector for the cache/ and shares/ directories
+
+    Enforces per-artifact TTLs based on last access, then a byte quota per
+    directory by evicting the least recently accessed files first.
+    """
+
+    def __init__(self, session_manager: SessionManager, share_manager: ShareManager,
+                 cache_quota_bytes: int, share_quota_bytes: int,
+                 ttls: Optional[Dict[str, float]] = None, interval: float = 600):
+        self.session_manager = session_manager
+        self.share_manager = share_manager
+        self.quotas = {"cache": cache_quota_bytes, "shares": share_quota_bytes}
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+        self.interval = interval
+
+        self._run_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.last_report: Optional[Dict[str, Any]] = None
+        self.totals = {"runs": 0, "files": 0, "bytes": 0}
+
+    def start(self):
+        """Start collecting in a daemon thread every `interval` seconds"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-collector", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"Cache collection failed: {str(e)}\n{traceback.format_exc()}")
+
+    def collect(self) -> Dict[str, Any]:
+        """Run one collection pass and return what was reclaimed"""
+        with self._run_lock:
+            started_at = time.time()
+            report = {
+                "started_at": started_at,
+                "cache": {"files": 0, "bytes": 0},
+                "shares": {"files": 0, "bytes": 0},
+                "by_reason": {},
+            }
+            self._collect_cache(report, started_at)
+            self._collect_shares(report, started_at)
+            report["duration"] = time.time() - started_at
+
+            self.last_report = report
+            self.totals["runs"] += 1
+            for directory in ("cache", "shares"):
+                self.totals["files"] += report[directory]["files"]
+                self.totals["bytes"] += report[directory]["bytes"]
+            return report
+
+    def _record(self, report: Dict[str, Any], directory: str, reason: str, files: int, nbytes: int):
+        report[directory]["files"] += files
+        report[directory]["bytes"] += nbytes
+        by_reason = report["by_reason"].setdefault(reason, {"files": 0, "bytes": 0})
+        by_reason["files"] += files
+        by_reason["bytes"] += nbytes
+
+    def _evict_object(self, report: Dict[str, Any], query_hash: str, reason: str):
+        store = self.session_manager.result_store
+        files = sum(1 for path in store.paths(query_hash) if path.exists()) + self.session_manager.get_refcount(query_hash)
+        nbytes = store.size(query_hash)
+        self.session_manager.evict_query_result(query_hash)
+        self._record(report, "cache", reason, files, nbytes)
+
+    def _evict_panel(self, report: Dict[str, Any], handle: str, reason: str):
+        panel_store = self.session_manager.panel_store.store
+        files = sum(1 for path in panel_store.paths(handle) if path.exists())
+        nbytes = panel_store.size(handle)
+        panel_store.delete(handle)
+        self._record(report, "cache", reason, files, nbytes)
+
+    def _collect_cache(self, report: Dict[str, Any], now: float):
+        manager = self.session_manager
+        store = manager.result_store
+
+        # 1. 过期的会话引用, 最后一个引用释放时结果一并删除
+        for ref_path in manager.list_refs():
+            try:
+                if now - ref_path.stat().st_mtime <= self.ttls["ref"]:
+                    continue
+            except FileNotFoundError:
+                continue
+            query_hash, session_id = ref_path.parent.name, ref_path.stem
+            object_bytes = store.size(query_hash)
+            manager.release_ref(session_id, query_hash)
+            released_bytes = object_bytes if not store.exists(query_hash) else 0
+            self._record(report, "cache", "ref_ttl", 1, released_bytes)
+
+        # 2. 长时间未访问的结果, 以及没有任何引用的孤立结果
+        for query_hash in store.list_hashes():
+            idle = now - store.last_access(query_hash)
+            if idle > self.ttls["object"]:
+                self._evict_object(report, query_hash, "object_ttl")
+            elif manager.get_refcount(query_hash) == 0 and idle > self.ttls["ref"]:
+                self._evict_object(report, query_hash, "orphan")
+
+        # 3. 长时间未分页读取的面板表格结果
+        panel_store = manager.panel_store.store
+        for handle in panel_store.list_hashes():
+            if now - panel_store.last_access(handle) > self.ttls["panel"]:
+                self._evict_panel(report, handle, "panel_ttl")
+
+        # 4. 旧版本直接保存在cache/下的会话缓存文件
+        for path in manager.cache_dir.iterdir():
+            if path.is_file() and now - path.stat().st_mtime > self.ttls["ref"]:
+                nbytes = path.stat().st_size
+                path.unlink(missing_ok=True)
+                self._record(report, "cache", "legacy", 1, nbytes)
+
+        # 5. 超出配额时, 查询结果和面板表格结果一起按最近访问时间淘汰
+        entries = [(store.last_access(query_hash), store.size(query_hash), "object", query_hash)
+                   for query_hash in store.list_hashes()]
+        entries += [(panel_store.last_access(handle), panel_store.size(handle), "panel", handle)
+                    for handle in panel_store.list_hashes()]
+        total = sum(size for _, size, _, _ in entries)
+        for _, size, kind, key in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.quotas["cache"]:
+                break
+            if kind == "object":
+                self._evict_object(report, key, "cache_quota")
+            else:
+                self._evict_panel(report, key, "cache_quota")
+            total -= size
+
+    def _collect_shares(self, report: Dict[str, Any], now: float):
+        share_files = []
+        for path in self.share_manager.share_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttls["share"]:
+                path.unlink(missing_ok=True)
+                self._record(report, "shares", "share_ttl", 1, stat.st_size)
+            else:
+                share_files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in share_files)
+        for _, size, path in sorted(share_files, key=lambda item: item[0]):
+            if total <= self.quotas["shares"]:
+                break
+            path.unlink(missing_ok=True)
+            self._record(report, "shares", "share_quota", 1, size)
+            total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        """Configuration, cumulative totals and the last collection report"""
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "interval": self.interval,
+            "quotas": self.quotas,
+            "ttls": self.ttls,
+            "totals": self.totals,
+            "last_report": self.last_report,
+        }
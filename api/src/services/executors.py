@@ -0,0 +1,52 @@
+# coding=utf-8
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class BoundedExecutor:
+    """Thread pool with its own concurrency limit for one kind of blocking work
+
+    Used by the async endpoints so a slow query, panel or file operation only
+    occupies its own pool instead of blocking the event loop.
+    """
+
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-worker")
+        self._lock = threading.Lock()
+        self.active = 0
+        self.queued = 0
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) in the pool and await its result
+
+        The caller's contextvars are propagated, like asyncio.to_thread.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, self._call, fn, *args, **kwargs)
+        with self._lock:
+            self.queued += 1
+        return await loop.run_in_executor(self._executor, call)
+
+    def _call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"max_workers": self.max_workers, "active": self.active, "queued": self.queued}
+
+    def shutdown(self, wait: bool = False):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,85 @@
+# coding=utf-8
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+import pandas as pd
+
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    """Approximate memory footprint of a DataFrame, including object column contents"""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+class ByteBudgetLRUCache:
+    """Process-local LRU cache evicting by total byte size rather than entry count"""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = dataframe_nbytes):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value and mark it as recently used, or None on a miss"""
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any):
+        """Insert a value, evicting least recently used entries until it fits"""
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            # 单个值超过总预算时不缓存
+            if size > self.max_bytes:
+                return
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+            self._entries[key] = value
+            self._sizes[key] = size
+            self.current_bytes += size
+
+    def invalidate(self, key: Hashable):
+        """Drop a single entry if present"""
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_matching(self, predicate: Callable[[Hashable], bool]):
+        """Drop every entry whose key satisfies the predicate"""
+        with self._lock:
+            for key in [k for k in self._entries if predicate(k)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.current_bytes = 0
+
+    def _remove(self, key: Hashable):
+        if key in self._entries:
+            del self._entries[key]
+            self.current_bytes -= self._sizes.pop(key)
+
+    def stats(self) -> Dict[str, int]:
+        """Counters used to size the budget"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -1,4 +1,5 @@
 # coding: utf-8
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Any, Optional
 
@@ -86,13 +87,19 @@ def process_visualization_options(options: List[Dict[str, Any]], option_values:
     return processed_options
 
 
-def infer_options_from_dataframe(options: List[Dict[str, Any]], df: pd.DataFrame) -> List[Dict[str, Any]]:
+# 推断的choices最多保留的唯一值数量, 超过时只保留前面的值并标记truncated
+MAX_INFERRED_CHOICES = 1000
+
+
+def infer_options_from_dataframe(options: List[Dict[str, Any]], df: pd.DataFrame,
+                                 max_choices: int = MAX_INFERRED_CHOICES) -> List[Dict[str, Any]]:
     """
     从DataFrame中推断选项的choices
     
     Args:
         options: 可视化配置中定义的选项列表
         df: 数据DataFrame，用于从列中推断选项
+        max_choices: 每列最多保留的唯一值数量
         
     Returns:
         更新了choices的选项列表
@@ -100,6 +107,111 @@ def infer_options_from_dataframe(options: List[Dict[str, Any]], df: pd.DataFrame
     if df is None or df.empty:
         return options
     
+    return apply_distinct_values(options, distinct_column_values(df, get_infer_columns(options), max_choices))
+
+
+def distinct_column_values(df: pd.DataFrame, columns: List[str],
+                           max_choices: int = MAX_INFERRED_CHOICES) -> Dict[str, Dict[str, Any]]:
+    """
+    计算各列的唯一值(按首次出现的顺序, 转换为字符串), DataFrame中不存在的列会被跳过
+    
+    Returns:
+        {列名: {"values": 字符串列表, "truncated": 是否超过max_choices, "max_choices": max_choices}}
+    """
+    distinct = {}
+    for column_name in columns:
+        if column_name in df.columns:
+            # 先去重再去掉缺失值, 不需要复制整列
+            unique_values = df[column_name].unique()
+            distinct[column_name] = distinct_entry(unique_values[~pd.isna(unique_values)], max_choices)
+    return distinct
+
+
+def distinct_entry(unique_values, max_choices: int) -> Dict[str, Any]:
+    """由一列的唯一值(不含缺失值)生成distinct_column_values中的一项"""
+    truncated = len(unique_values) > max_choices
+    if truncated:
+        unique_values = unique_values[:max_choices]
+    return {"values": _to_strings(unique_values), "truncated": truncated, "max_choices": max_choices}
+
+
+def _to_strings(values) -> List[str]:
+    """批量转换为字符串, 结果与逐个调用str()相同"""
+    if len(values) == 0:
+        return []
+    if isinstance(values, pd.api.extensions.ExtensionArray) and pd.api.types.is_string_dtype(values.dtype):
+        return values.tolist()
+    if isinstance(values, np.ndarray) and values.dtype.kind in "iub":
+        return values.astype(str).tolist()
+    # object数组的astype(str)在numpy内部逐个调用str(), 日期等类型也与str()的结果一致
+    return np.asarray(values, dtype=object).astype(str).tolist()
+
+
+def slice_distinct_values(entry: Dict[str, Any], max_choices: int) -> Optional[Dict[str, Any]]:
+    """从已缓存的唯一值中取出不超过max_choices个, 缓存的值不足以确定结果时返回None"""
+    if len(entry["values"]) > max_choices:
+        return {"values": entry["values"][:max_choices], "truncated": True, "max_choices": max_choices}
+    if entry["truncated"] and entry["max_choices"] < max_choices:
+        return None
+    return {**entry, "max_choices": max_choices}
+
+
+class IncrementalOptionInference:
+    """
+    分批推断选项的choices, 结果与infer_options_from_dataframe一致
+    
+    流式执行查询时每读取一批数据调用一次update, 内存占用只与唯一值的数量有关
+    """
+    
+    def __init__(self, options: List[Dict[str, Any]], max_choices: int = MAX_INFERRED_CHOICES):
+        self.options = options
+        self.max_choices = max_choices
+        self.rows = 0
+        self.present_columns = set()
+        # dict保持唯一值首次出现的顺序, 与Series.unique()相同
+        self.unique_values: Dict[str, Dict[Any, None]] = {column: {} for column in get_infer_columns(options)}
+    
+    def update(self, batch):
+        """处理一批数据 (pyarrow.RecordBatch)"""
+        self.rows += batch.num_rows
+        for column_name, seen in self.unique_values.items():
+            index = batch.schema.get_field_index(column_name)
+            if index < 0:
+                continue
+            self.present_columns.add(column_name)
+            # 已超过上限的列不再需要新的值
+            if len(seen) > self.max_choices:
+                continue
+            values = batch.column(index).to_pandas(date_as_object=False).dropna().unique().tolist()
+            for value in values:
+                seen.setdefault(value, None)
+                if len(seen) > self.max_choices:
+                    break
+    
+    def distinct_values(self) -> Dict[str, Dict[str, Any]]:
+        """各列的唯一值, 格式与distinct_column_values相同"""
+        return {column: distinct_entry(list(seen), self.max_choices)
+                for column, seen in self.unique_values.items() if column in self.present_columns}
+    
+    def result(self) -> List[Dict[str, Any]]:
+        """返回更新了choices的选项列表"""
+        if self.rows == 0:
+            return self.options
+        return apply_distinct_values(self.options, self.distinct_values())
+
+
+def get_infer_columns(options: List[Dict[str, Any]]) -> List[str]:
+    """需要从数据列推断choices的列名"""
+    columns = []
+    for option in options:
+        if option.get("infer") == "column" and "infer_column" in option:
+            if option["infer_column"] not in columns:
+                columns.append(option["infer_column"])
+    return columns
+
+
+def apply_distinct_values(options: List[Dict[str, Any]], distinct: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """根据每列的唯一值(distinct_column_values的结果)更新选项的choices和默认值"""
     updated_options = []
     
     for option in options:
@@ -107,27 +219,23 @@ def infer_options_from_dataframe(options: List[Dict[str, Any]], df: pd.DataFrame
         option_copy = option.copy()
         
         # 检查是否需要从DataFrame列中推断选项
-        if option.get("infer") == "column" and "infer_column" in option:
-            column_name = option.get("infer_column")
-            # 检查列是否存在于DataFrame中
-            if column_name in df.columns:
-                # 获取列中的唯一值
-                unique_values = df[column_name].dropna().unique().tolist()
-                print("unique_values", unique_values)
-                # 转换为字符串列表
-                unique_values = [str(val) for val in unique_values]
-                
-                # 更新选项的choices
-                option_copy["choices"] = unique_values
-                
-                # 如果是单选且没有默认值，设置第一个值为默认值
-                if not option.get("multiple", False) and "default" not in option and unique_values:
-                    option_copy["default"] = unique_values[0]
-                # 如果是多选且没有默认值，设置为空列表
-                elif option.get("multiple", False) and "default" not in option:
-                    option_copy["default"] = []
+        if option.get("infer") == "column" and option.get("infer_column") in distinct:
+            entry = distinct[option["infer_column"]]
+            unique_values = list(entry["values"])
+            
+            # 更新选项的choices
+            option_copy["choices"] = unique_values
+            # 唯一值过多时choices不完整, 前端需要提示或改为输入
+            if entry["truncated"]:
+                option_copy["truncated"] = True
+            
+            # 如果是单选且没有默认值，设置第一个值为默认值
+            if not option.get("multiple", False) and "default" not in option and unique_values:
+                option_copy["default"] = unique_values[0]
+            # 如果是多选且没有默认值，设置为空列表
+            elif option.get("multiple", False) and "default" not in option:
+                option_copy["default"] = []
         
-        print(updated_options)
         updated_options.append(option_copy)
     
     return updated_options
@@ -1,9 +1,16 @@
 # coding: utf-8
 import json
+import re
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Union
-from datetime import datetime
+from typing import Dict, List, Any, Optional, Union, Tuple
+from datetime import datetime, timedelta
 
+# SQL模板中的占位符 ${...}
+_PLACEHOLDER = re.compile(r'\$\{([^{}]*)\}')
+# 日期表达式占位符的内容, 例如 yyyy-MM-dd, yyyyMMdd+1d, yyyy-MM-dd-1d
+_DATE_EXPRESSION = re.compile(r'[yMd-]+[+-]?\d*[d]?')
+_DATE_PARTS = re.compile(r'\$\{([yMd-]+)([+-]\d+[d])?\}')
 
 
 def process_parameter_value(param: Dict[str, Any], value: Any) -> Any:
@@ -44,7 +51,6 @@ def process_parameter_value(param: Dict[str, Any], value: Any) -> Any:
         # 将Java风格的日期格式转换为Python风格
         py_format = date_format.replace("yyyy", "%Y").replace("MM", "%m").replace("dd", "%d")
         
-        print(value)
         try:
             # 解析ISO格式日期字符串并转换为北京时间
             from datetime import datetime
@@ -86,7 +92,7 @@ def process_parameter_value(param: Dict[str, Any], value: Any) -> Any:
     return value
 
 
-def _parse_date_parameter(pattern: str) -> str:
+def _parse_date_parameter(pattern: str, now: Optional[datetime] = None) -> str:
     """解析日期参数格式并计算结果
     
     支持的格式：
@@ -95,16 +101,13 @@ def _parse_date_parameter(pattern: str) -> str:
     - ${yyyy-MM-dd-1d} - 昨天
     - 其他类似格式
     """
-    import re
-    from datetime import datetime, timedelta
-
     # 匹配日期格式和偏移量，支持更灵活的格式
-    match = re.match(r'\$\{([yMd-]+)([+-]\d+[d])?\}', pattern)
+    match = _DATE_PARTS.match(pattern)
     if not match:
         return pattern
 
     date_format, offset = match.groups()
-    current_date = datetime.now()
+    current_date = now or datetime.now()
 
     # 处理日期偏移
     if offset:
@@ -117,35 +120,236 @@ def _parse_date_parameter(pattern: str) -> str:
     return current_date.strftime(py_format)
 
 
+class SqlTemplate:
+    """
+    解析后的SQL模板: 文本片段与占位符交替排列, literals比names多一个元素
+    
+    渲染只遍历一次片段, 参数值和日期表达式同时解析; 替换进去的值不会再被当作占位符解析。
+    """
+    
+    def __init__(self, sql: str):
+        self.literals: List[str] = []
+        self.names: List[str] = []
+        position = 0
+        for match in _PLACEHOLDER.finditer(sql):
+            self.literals.append(sql[position:match.start()])
+            self.names.append(match.group(1))
+            position = match.end()
+        self.literals.append(sql[position:])
+        self.placeholders = set(self.names)
+        # 可以作为日期表达式解析的占位符
+        self.date_names = {name for name in self.placeholders if _DATE_EXPRESSION.fullmatch(name)}
+        # 每个占位符在模板中的位置能否绑定, 只与模板文本有关
+        self.bind_contexts = _bind_contexts(self.literals)
+    
+    def _configured(self, param_values: Dict[str, Any], parameters: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """模板中用到且有值的参数配置, 同名参数以第一个为准"""
+        configured = {}
+        for param in parameters:
+            param_name = param.get("name")
+            if param_name and param_name in param_values and param_name not in configured and param_name in self.placeholders:
+                configured[param_name] = param
+        return configured
+    
+    def render(self, param_values: Dict[str, Any], parameters: List[Dict[str, Any]]) -> str:
+        """替换占位符: 参数优先于日期表达式, 两者都不是的占位符保持原样"""
+        return self.bind(param_values, parameters, dialect=None)[0]
+    
+    def bind(self, param_values: Dict[str, Any], parameters: List[Dict[str, Any]],
+             dialect: Optional[str] = "duckdb") -> Tuple[str, Dict[str, Any]]:
+        """
+        生成带绑定参数的SQL, 返回(SQL, 参数值字典); dialect为None时所有值都拼接到SQL中
+        
+        只绑定值位置(比较运算符、LIKE、BETWEEN、LIMIT/OFFSET之后或IN列表中)上的占位符:
+        单独占满引号的绑定为字符串(去掉两侧的引号), 引号外且不与标识符相连的数值绑定为数字,
+        单独占满IN (...)的multi_select/multi_input值展开为IN列表的绑定参数。其他参数(例如作为SQL片段
+        使用、ORDER BY的序号、INTERVAL的数量, 或配置了"bind": false)和日期表达式仍拼接到SQL中。
+        绑定参数的形式: duckdb为$name, mysql为SQLAlchemy的:name。
+        """
+        if not self.names:
+            return self.literals[0], {}
+        
+        configured = self._configured(param_values, parameters)
+        now = datetime.now()
+        rendered: Dict[str, str] = {}
+        binds: Dict[str, Any] = {}
+        parts = [self.literals[0]]
+        for index, name in enumerate(self.names):
+            after = self.literals[index + 1]
+            param = configured.get(name)
+            bound = None
+            if dialect is not None and param is not None and param.get("bind", True):
+                context = self.bind_contexts[index]
+                # DuckDB中双引号是标识符, 只有MySQL的双引号是字符串
+                if context == '"' and dialect != "mysql":
+                    context = None
+                bound = _bind_value(param, param_values.get(name), context)
+            
+            if bound is not None:
+                value, quoted = bound
+                if quoted:
+                    parts[-1] = parts[-1][:-1]
+                    after = after[1:]
+                parts.append(_bind_marker(f"p{index}", value, dialect, binds))
+            elif param is not None:
+                if name not in rendered:
+                    rendered[name] = str(process_parameter_value(param, param_values.get(name)))
+                parts.append(rendered[name])
+            elif name in self.date_names:
+                if name not in rendered:
+                    rendered[name] = _parse_date_parameter(f"${{{name}}}", now)
+                parts.append(rendered[name])
+            else:
+                parts.append(f"${{{name}}}")
+            parts.append(after)
+        return "".join(parts), binds
+
+
+_QUOTES = ("'", '"')
+_NUMBER = re.compile(r'-?\d+(\.\d+)?')
+
+
+def _as_number(value: Any) -> Optional[Union[int, float]]:
+    """数值或数值字符串转换为int/float, 其他值返回None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str) and _NUMBER.fullmatch(value.strip()):
+        return float(value) if "." in value else int(value)
+    return None
+
+
+def _is_word_boundary(char: str) -> bool:
+    """占位符旁边的字符不属于标识符、数字、其他$参数或字符串"""
+    return not (char.isalnum() or char in ("_", "$") or char in _QUOTES)
+
+
+# 可以绑定参数的值位置: 比较运算符、LIKE、BETWEEN ... AND、LIMIT/OFFSET之后, 或IN列表中;
+# ORDER BY/GROUP BY的序号、INTERVAL的数量等位置DuckDB不接受参数, 仍然拼接
+_VALUE_BEFORE = re.compile(r'(?:[=<>]|\b(?:LIKE|ILIKE|LIMIT|OFFSET|BETWEEN)|\bBETWEEN\s+\S+\s+AND'
+                           r'|\bIN\s*\((?:[^()]*,)?)\s*$', re.IGNORECASE)
+_VALUE_AFTER = re.compile(r'^\s*(?:[=<>]|!=)')
+# 单独占满IN (...)的占位符, 列表值只在这里展开
+_IN_LIST_BEFORE = re.compile(r'\bIN\s*\(\s*$', re.IGNORECASE)
+_IN_LIST_AFTER = re.compile(r'^\s*\)')
+
+
+def _value_position(before: str, after: str) -> Optional[str]:
+    """占位符前后的SQL文本(占位符已替换为?)对应的位置: "in_list"、"value"或None"""
+    if _IN_LIST_BEFORE.search(before) and _IN_LIST_AFTER.match(after):
+        return "in_list"
+    if _VALUE_BEFORE.search(before) or _VALUE_AFTER.match(after):
+        return "value"
+    return None
+
+
+def _bind_contexts(literals: List[str]) -> List[Optional[str]]:
+    """
+    每个占位符的位置: 引号字符为值位置上单独占满一个引号(例如= '${x}'), "value"/"in_list"为引号外
+    值位置上的独立值, None为字符串或标识符的一部分(例如'${year}-01-01'、'%${kw}%'、sales_${year})
+    或不接受参数的位置(例如ORDER BY ${n}、INTERVAL ${days} DAY), 只能拼接
+    """
+    contexts = []
+    # 当前所在字符串的引号, None表示不在字符串内; ''转义按两次切换处理
+    state = None
+    last = len(literals) - 2
+    # 占位符替换为?后的模板文本, 用于判断前后的SQL语法
+    text = "?".join(literals)
+    offset = 0
+    for index, before in enumerate(literals[:-1]):
+        for char in before:
+            if state is None and char in _QUOTES:
+                state = char
+            elif char == state:
+                state = None
+        offset += len(before)
+        after = literals[index + 1]
+        # 与其他占位符直接相邻时无法确定边界
+        adjacent_before = index > 0 and len(before) < (2 if state else 1)
+        adjacent_after = index < last and len(after) < (2 if state else 1)
+        if adjacent_before or adjacent_after:
+            contexts.append(None)
+        elif state is not None:
+            # 引号紧挨着占位符, 且不是''转义
+            quoted = (before[-1] == state and before[-2:-1] != state
+                      and after[:1] == state and after[1:2] != state)
+            position = quoted and _value_position(text[:offset - 1], text[offset + 2:])
+            contexts.append(state if position else None)
+        else:
+            bare = _is_word_boundary(before[-1:] or " ") and _is_word_boundary(after[:1] or " ")
+            contexts.append(bare and _value_position(text[:offset], text[offset + 1:]) or None)
+        offset += 1
+    return contexts
+
+
+def _bind_value(param: Dict[str, Any], value: Any, context: Optional[str]) -> Optional[Tuple[Any, bool]]:
+    """
+    判断一个占位符能否作为绑定参数, 返回(绑定的值, 是否去掉两侧引号), 不能绑定时返回None
+    """
+    if context is None:
+        return None
+    param_type = param.get("type", "")
+    quoted = context in _QUOTES
+    
+    if param_type in ("multi_select", "multi_input"):
+        # 只有以逗号分隔、单独占满IN (...)的列表可以展开
+        if context != "in_list" or param.get("sep", ",").strip() != "," or not isinstance(value, list):
+            return None
+        if param.get("wrapper", ""):
+            return [str(v) for v in value], False
+        numbers = [_as_number(v) for v in value]
+        if any(number is None for number in numbers):
+            return None
+        return numbers, False
+    
+    processed = process_parameter_value(param, value)
+    if quoted:
+        return str(processed), True
+    number = _as_number(processed)
+    if number is None:
+        return None
+    return number, False
+
+
+def _next_power_of_two(n: int) -> int:
+    return 1 << max(n - 1, 0).bit_length()
+
+
+def _bind_marker(bind_name: str, value: Any, dialect: str, binds: Dict[str, Any]) -> str:
+    """记录绑定参数的值, 返回SQL中的占位符"""
+    prefix = ":" if dialect == "mysql" else "$"
+    if not isinstance(value, list):
+        binds[bind_name] = value
+        return f"{prefix}{bind_name}"
+    # 列表只来自单独占满IN (...)的占位符: 长度补齐到2的幂(重复最后一个值, 不改变IN的结果),
+    # 不同长度的列表共用少数几种SQL; 空列表绑定为NULL, 不匹配任何行
+    padded = value + value[-1:] * (_next_power_of_two(len(value)) - len(value)) if value else [None]
+    markers = []
+    for position, item in enumerate(padded):
+        binds[f"{bind_name}_{position}"] = item
+        markers.append(f"{prefix}{bind_name}_{position}")
+    return ", ".join(markers)
+
+
+@lru_cache(maxsize=256)
+def compile_sql_template(sql: str) -> SqlTemplate:
+    """解析SQL模板, 相同的模板文本只解析一次"""
+    return SqlTemplate(sql)
+
 
 def replace_parameters_in_sql(sql: str, param_values: Dict[str, Any], parameters: List[Dict[str, Any]]) -> str:
     """替换SQL中的参数占位符"""
     if not sql or not param_values:
         return sql
     
-        print(type(parameters), parameters)
+    return compile_sql_template(sql).render(param_values, parameters)
 
-   # 处理每个参数值并替换SQL中的占位符
-    for param in parameters:
-        param_name = param.get("name")
-        if not param_name or param_name not in param_values:
-            continue
-        
-        print(param_name, 2)
-        
-        # 获取参数值并根据类型处理
-        raw_value = param_values.get(param_name)
-        processed_value = process_parameter_value(param, raw_value)
-        
-        # 替换SQL中的参数占位符 ${param_name}
-        placeholder = f"${{{param_name}}}"
-        sql = sql.replace(placeholder, str(processed_value))
-    
-    # 处理日期格式参数
-    import re
-    date_patterns = re.finditer(r'\$\{[yMd-]+[+-]?\d*[d]?\}', sql)
-    for match in date_patterns:
-        pattern = match.group()
-        sql = sql.replace(pattern, _parse_date_parameter(pattern))
-    
-    return sql
+
+def bind_parameters_in_sql(sql: str, param_values: Dict[str, Any], parameters: List[Dict[str, Any]],
+                           dialect: str = "duckdb") -> Tuple[str, Dict[str, Any]]:
+    """replace_parameters_in_sql的绑定参数版本, 返回(SQL, 参数值字典), 供execute_query/stream_query执行"""
+    if not sql or not param_values:
+        return sql, {}
+    
+    return compile_sql_template(sql).bind(param_values, parameters, dialect)
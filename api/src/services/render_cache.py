@@ -0,0 +1,67 @@
+# coding=utf-8
+import hashlib
+import json
+from typing import Dict, Any, Optional, List
+
+from src.services.memory_cache import ByteBudgetLRUCache
+
+
+# 估计长列表的大小时抽样的元素个数
+SIZE_SAMPLE_ITEMS = 64
+
+
+def output_nbytes(value: Any) -> int:
+    """Approximate size of a formatted panel output without serializing it again
+
+    Strings (including RawJSON figures) and bytes count their length, long lists
+    are estimated from their first SIZE_SAMPLE_ITEMS items.
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(output_nbytes(key) + output_nbytes(item) + 2 for key, item in value.items()) + 2
+    if isinstance(value, (list, tuple)):
+        if len(value) <= SIZE_SAMPLE_ITEMS:
+            return sum(output_nbytes(item) + 1 for item in value) + 2
+        sample = sum(output_nbytes(item) + 1 for item in value[:SIZE_SAMPLE_ITEMS])
+        return sample * len(value) // SIZE_SAMPLE_ITEMS + 2
+    # 数值、布尔值、None、日期等
+    return 8
+
+
+class RenderCache:
+    """Memoized /api/visualize outputs
+
+    Panel code is deterministic given the query result, the code and the processed
+    option values, so the formatted output is cached under a hash of those inputs.
+    Keys include the result version, and entries of a result are dropped as soon as
+    the result is replaced or deleted.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.cache = ByteBudgetLRUCache(max_bytes, sizeof=output_nbytes)
+
+    @staticmethod
+    def make_key(query_hash: str, version: int, code: Optional[str], options: Optional[Dict[str, Any]],
+                 columns: Optional[List[str]] = None, **render_options) -> tuple:
+        """render_options: 影响输出格式的其他参数, 如typed_arrays和分页设置"""
+        inputs = json.dumps({"code": code or "", "options": options or {}, "columns": columns,
+                             "render_options": render_options},
+                            sort_keys=True, default=str, ensure_ascii=False)
+        return (query_hash, version, hashlib.md5(inputs.encode('utf-8')).hexdigest())
+
+    def get(self, key: tuple) -> Optional[Dict[str, Any]]:
+        return self.cache.get(key)
+
+    def put(self, key: tuple, output: Dict[str, Any]):
+        # 执行失败(包括超时)的结果不缓存
+        if output.get("result_type") == "error":
+            return
+        self.cache.put(key, output)
+
+    def invalidate_result(self, query_hash: str):
+        """Drop every cached output rendered from a query result"""
+        self.cache.invalidate_matching(lambda key: key[0] == query_hash)
+
+    def stats(self) -> Dict[str, int]:
+        return self.cache.stats()
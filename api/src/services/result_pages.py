@@ -0,0 +1,128 @@
+# coding=utf-8
+import re
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple, Union
+import pandas as pd
+
+from src.services.cache_backends import get_cache_backend
+from src.services.result_store import ResultStore
+
+# 表格结果的编码方式: records为按行的字典列表(兼容旧版本), columns为按列的数组, 列名只出现一次
+PAGE_ENCODINGS = ("records", "columns")
+
+FILTER_OPERATORS = ("==", "!=", ">", ">=", "<", "<=", "in", "not in", "contains")
+
+# 结果句柄是面板输入的md5, 只含十六进制字符; 客户端传入的句柄因此不会指向存储目录之外的文件
+_HANDLE = re.compile(r'[0-9a-f]+')
+
+
+def is_valid_handle(handle: Any) -> bool:
+    """Whether a client supplied result handle is well-formed"""
+    return isinstance(handle, str) and _HANDLE.fullmatch(handle) is not None
+
+
+def dataframe_schema(df: pd.DataFrame) -> List[Dict[str, str]]:
+    """Column names and dtypes of a DataFrame"""
+    return [{"name": str(name), "dtype": str(dtype)} for name, dtype in df.dtypes.items()]
+
+
+def encode_rows(df: pd.DataFrame, encoding: str = "records") -> Union[List[Dict[str, Any]], Dict[str, List[Any]]]:
+    """Encode rows for a JSON response"""
+    if encoding == "records":
+        return df.to_dict(orient="records")
+    if encoding == "columns":
+        return {str(name): df[name].tolist() for name in df.columns}
+    raise ValueError(f"Unsupported page encoding: {encoding}, expected one of {list(PAGE_ENCODINGS)}")
+
+
+def apply_filters(df: pd.DataFrame, filters: Optional[List[Dict[str, Any]]]) -> pd.DataFrame:
+    """Apply [{"column", "op", "value"}] filters, all of them must match"""
+    if not filters:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for condition in filters:
+        column, op, value = condition["column"], condition.get("op", "=="), condition.get("value")
+        if column not in df.columns:
+            raise ValueError(f"Unknown filter column: {column}")
+        series = df[column]
+        if op == "==":
+            mask &= series == value
+        elif op == "!=":
+            mask &= series != value
+        elif op == ">":
+            mask &= series > value
+        elif op == ">=":
+            mask &= series >= value
+        elif op == "<":
+            mask &= series < value
+        elif op == "<=":
+            mask &= series <= value
+        elif op == "in":
+            mask &= series.isin(value if isinstance(value, list) else [value])
+        elif op == "not in":
+            mask &= ~series.isin(value if isinstance(value, list) else [value])
+        elif op == "contains":
+            mask &= series.astype(str).str.contains(str(value), regex=False, na=False)
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}, expected one of {list(FILTER_OPERATORS)}")
+    return df[mask.fillna(False).astype(bool)]
+
+
+def query_page(df: pd.DataFrame, offset: int = 0, limit: int = 1000,
+               sort_by: Optional[Union[str, List[str]]] = None, ascending: Union[bool, List[bool]] = True,
+               filters: Optional[List[Dict[str, Any]]] = None) -> Tuple[pd.DataFrame, int]:
+    """Filter, sort and slice a DataFrame, returns the page and the number of matching rows"""
+    df = apply_filters(df, filters)
+    if sort_by:
+        df = df.sort_values(sort_by, ascending=ascending, kind="stable")
+    return df.iloc[offset:offset + limit], len(df)
+
+
+class PanelResultStore:
+    """Server-side storage of DataFrame panel results, served page by page
+
+    Results are written as memory-mappable Arrow files under a result handle, so
+    the worker that ran the panel and the API process serving pages share them.
+    """
+
+    def __init__(self, store_dir: Path, cache_format: str = "arrow"):
+        self.store = ResultStore(Path(store_dir), get_cache_backend(cache_format))
+
+    def save(self, handle: str, df: pd.DataFrame, page_size: int, encoding: str = "records") -> Dict[str, Any]:
+        """Store a result and return its schema, row count and first page"""
+        self.store.put(handle, df)
+        return {
+            "result_handle": handle,
+            "total_rows": len(df),
+            "schema": dataframe_schema(df),
+            "page_size": page_size,
+            "encoding": encoding,
+            "data": encode_rows(df.iloc[:page_size], encoding),
+        }
+
+    def load(self, handle: str) -> Optional[pd.DataFrame]:
+        if not is_valid_handle(handle):
+            raise ValueError(f"Invalid result handle: {handle!r}")
+        self.store.touch(handle)
+        return self.store.load(handle)
+
+    def touch(self, handle: str) -> bool:
+        """Record an access to a handle, False when it has already been collected"""
+        if not is_valid_handle(handle):
+            raise ValueError(f"Invalid result handle: {handle!r}")
+        if not self.store.exists(handle):
+            return False
+        self.store.touch(handle)
+        return True
+
+    def list_handles(self) -> List[str]:
+        return self.store.list_hashes()
+
+    def delete(self, handle: str):
+        self.store.delete(handle)
+
+
+def save_panel_result(df: pd.DataFrame, store_dir: str, handle: str, page_size: int,
+                      encoding: str = "records", cache_format: str = "arrow") -> Dict[str, Any]:
+    """Store a panel's DataFrame result, called from the process that executed the panel"""
+    return PanelResultStore(Path(store_dir), cache_format).save(handle, df, page_size, encoding)
@@ -0,0 +1,168 @@
+# coding=utf-8
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, Any, Optional, List, Callable
+from pathlib import Path
+import pandas as pd
+
+from src.services.cache_backends import CACHE_BACKENDS, JsonCacheBackend
+from src.utils.metrics import timed
+
+class ResultStore:
+    """Content-addressed store of query results shared by all sessions
+
+    Each result is stored once under the hash of the executed SQL and its data source.
+    """
+    # 各列唯一值的索引, 与结果一起保存和删除
+    distinct_suffix = ".distinct.json"
+
+    def __init__(self, store_dir: Path, backend: JsonCacheBackend):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self.backend = backend
+
+    @staticmethod
+    def content_hash(processed_sql: str, data_source: str = "") -> str:
+        """Hash of the SQL actually executed plus the data source it ran against"""
+        return hashlib.md5(f"{data_source}\n{processed_sql}".encode()).hexdigest()
+
+    def get_stem(self, content_hash: str) -> Path:
+        return self.store_dir / content_hash
+
+    def _find_backend(self, content_hash: str) -> Optional[JsonCacheBackend]:
+        """Find the backend an object was written with, preferring the configured one"""
+        stem = self.get_stem(content_hash)
+        backends = [self.backend] + [b for b in CACHE_BACKENDS.values() if b is not self.backend]
+        for backend in backends:
+            if backend.exists(stem):
+                return backend
+        return None
+
+    def exists(self, content_hash: str) -> bool:
+        return self._find_backend(content_hash) is not None
+
+    def paths(self, content_hash: str) -> List[Path]:
+        """All files belonging to one object, in any format"""
+        stem = self.get_stem(content_hash)
+        # 列式格式共用同一个sidecar文件, 需要去重
+        paths = dict.fromkeys(path for backend in CACHE_BACKENDS.values() for path in backend.paths(stem))
+        return list(paths) + [self.distinct_path(content_hash)]
+
+    def distinct_path(self, content_hash: str) -> Path:
+        stem = self.get_stem(content_hash)
+        return stem.with_name(stem.name + self.distinct_suffix)
+
+    def load_distinct(self, content_hash: str) -> Dict[str, Any]:
+        """Per-column distinct values stored alongside an object"""
+        meta = self.load_meta(content_hash)
+        try:
+            with open(self.distinct_path(content_hash)) as f:
+                index = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        # 索引属于被替换前的结果时忽略
+        if meta is None or index.get("created_at") != meta.get("created_at"):
+            return {}
+        return index.get("columns", {})
+
+    def save_distinct(self, content_hash: str, distinct: Dict[str, Any]):
+        """Merge per-column distinct values into the index of an existing object"""
+        meta = self.load_meta(content_hash)
+        if meta is None:
+            return
+        path = self.distinct_path(content_hash)
+        index = {"created_at": meta.get("created_at"), "columns": {**self.load_distinct(content_hash), **distinct}}
+        # 先写临时文件再替换, 读取方不会读到写了一半的文件
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def put(self, content_hash: str, df: pd.DataFrame, meta: Optional[Dict[str, Any]] = None):
+        """Store (or replace) the object for a content hash"""
+        stem = self.get_stem(content_hash)
+        meta = dict(meta or {})
+        meta.setdefault("created_at", time.time())
+        meta["rows"] = len(df)
+
+        self.delete(content_hash)
+        with timed("cache_write") as stage:
+            try:
+                self.backend.save(stem, df, meta)
+            except (TypeError, ValueError):
+                # 混合类型的object列无法转换为Arrow, 退回JSON格式; 次数见/api/metrics中的cache_json_fallback
+                self.delete(content_hash)
+                with timed("cache_json_fallback"):
+                    CACHE_BACKENDS["json"].save(stem, df, meta)
+            stage.bytes = self.size(content_hash)
+
+    def put_batches(self, content_hash: str, reader, meta: Optional[Dict[str, Any]] = None,
+                    on_batch: Optional[Callable[[Any], None]] = None) -> int:
+        """Store (or replace) an object from a pyarrow.RecordBatchReader without materializing it
+
+        on_batch is called with every batch before it is written.
+
+        Unlike put there is no JSON fallback: the batches are Arrow already, so the
+        DataFrame-to-Arrow conversion that can fail in put never happens, and a
+        stream that failed half way cannot be replayed; write errors propagate.
+        """
+        import pyarrow as pa
+
+        meta = dict(meta or {})
+        meta.setdefault("created_at", time.time())
+
+        def tap():
+            for batch in reader:
+                if on_batch is not None:
+                    on_batch(batch)
+                yield batch
+
+        self.delete(content_hash)
+        try:
+            # 耗时包含从数据库游标读取数据的时间
+            with timed("cache_write_stream") as stage:
+                rows = self.backend.save_batches(self.get_stem(content_hash), pa.RecordBatchReader.from_batches(reader.schema, tap()), meta)
+                stage.bytes = self.size(content_hash)
+            return rows
+        except Exception:
+            # 不保留写了一半的文件
+            self.delete(content_hash)
+            raise
+
+    def load(self, content_hash: str, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        backend = self._find_backend(content_hash)
+        if backend is None:
+            return None
+        with timed("cache_read"):
+            return backend.load(self.get_stem(content_hash), columns)
+
+    def load_meta(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        backend = self._find_backend(content_hash)
+        if backend is None:
+            return None
+        return backend.load_meta(self.get_stem(content_hash))
+
+    def touch(self, content_hash: str):
+        """Record an access, used by the garbage collector for last-access eviction"""
+        for path in self.paths(content_hash):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+
+    def last_access(self, content_hash: str) -> float:
+        return max((path.stat().st_mtime for path in self.paths(content_hash) if path.exists()), default=0.0)
+
+    def size(self, content_hash: str) -> int:
+        return sum(path.stat().st_size for path in self.paths(content_hash) if path.exists())
+
+    def list_hashes(self) -> List[str]:
+        """All stored content hashes"""
+        return sorted({path.name.split(".", 1)[0] for path in self.store_dir.iterdir() if path.is_file()})
+
+    def delete(self, content_hash: str):
+        for path in self.paths(content_hash):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,214 @@
+# coding=utf-8
+import queue
+import threading
+import traceback
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from src.services.visualization import format_visualization_oupput
+from src.utils.metrics import start_request, record_stage
+
+
+def _limit_memory(memory_limit_bytes: Optional[int]):
+    """限制工作进程的内存 (尽力而为, 依赖平台支持)
+
+    使用RLIMIT_DATA而不是RLIMIT_AS: 前者只统计堆和匿名映射,
+    只读内存映射的缓存文件不计入限制。
+    """
+    if not memory_limit_bytes:
+        return
+    try:
+        import resource
+        limit = getattr(resource, "RLIMIT_DATA", None) or resource.RLIMIT_AS
+        resource.setrlimit(limit, (memory_limit_bytes, memory_limit_bytes))
+    except (ImportError, ValueError, OSError) as e:
+        print(f"Unable to limit sandbox worker memory: {str(e)}")
+
+
+def _load_dataframe(data_ref: Dict[str, Any]):
+    """根据缓存文件引用读取DataFrame, Arrow格式为内存映射, 不需要在进程间传输数据"""
+    from src.services.cache_backends import get_cache_backend
+    from src.services.result_store import ResultStore
+
+    store = ResultStore(Path(data_ref["store_dir"]), get_cache_backend(data_ref["cache_format"]))
+    return store.load(data_ref["query_hash"], data_ref.get("columns"))
+
+
+def _worker_main(conn, memory_limit_bytes: Optional[int]):
+    """工作进程入口: 预先导入常用包, 然后循环执行面板代码"""
+    from src.services.visualization import process_analysis_request, get_base_namespace
+
+    # 预热: 导入pandas/numpy/plotly并构建基础命名空间
+    get_base_namespace()
+    _limit_memory(memory_limit_bytes)
+    conn.send("ready")
+
+    while True:
+        try:
+            task = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+        if task is None:
+            break
+        # 记录工作进程中各阶段的耗时, 随结果返回给API进程
+        timings = start_request()
+        try:
+            df = _load_dataframe(task["data_ref"])
+            if df is None:
+                result = format_visualization_oupput(error_msg="Cached result not found")
+            else:
+                result = process_analysis_request(df, task["code"], task["options"], **task["render_options"])
+        except BaseException as e:
+            result = format_visualization_oupput(error_msg=f"Sandbox worker error: {str(e)}\n{traceback.format_exc()}")
+        result["stages"] = timings.stages
+        conn.send(result)
+
+
+class _Worker:
+    def __init__(self, context, memory_limit_bytes: Optional[int]):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit_bytes),
+                                       name="panel-sandbox", daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+        self.tasks = 0
+
+    def wait_ready(self, timeout: float):
+        """等待预热完成, 预热时间不计入代码执行的超时"""
+        if self.ready:
+            return
+        if not self.conn.poll(timeout):
+            raise EOFError("Sandbox worker did not start in time")
+        self.conn.recv()
+        self.ready = True
+
+    def stop(self, timeout: float = 1):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError, BrokenPipeError):
+            pass
+        self.process.join(timeout)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+# 工作进程启动并导入常用包的最长等待时间(秒)
+WORKER_STARTUP_TIMEOUT = 120
+
+
+class SandboxPool:
+    """Pool of pre-warmed worker processes that execute panel Python code
+
+    Keeps CPU-heavy panel code off the API process's GIL and contains runaway
+    code: every run has a wall-clock timeout, workers have a memory limit and
+    are recycled after max_tasks_per_worker runs. DataFrames are not pickled;
+    workers get a reference to the cached result file and memory-map it.
+    """
+
+    def __init__(self, workers: int = 4, timeout: float = 60, memory_limit_bytes: Optional[int] = None,
+                 max_tasks_per_worker: int = 200, start_method: str = "spawn"):
+        self.size = workers
+        self.timeout = timeout
+        self.memory_limit_bytes = memory_limit_bytes
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.start_method = start_method
+
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = False
+        self.counters = {"runs": 0, "timeouts": 0, "crashes": 0, "recycled": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        import multiprocessing
+
+        with self._lock:
+            if self._running:
+                return
+            self._context = multiprocessing.get_context(self.start_method)
+            for _ in range(self.size):
+                self._idle.put(self._spawn())
+            self._running = True
+
+    def stop(self):
+        with self._lock:
+            self._running = False
+            while True:
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    break
+                worker.stop()
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._context, self.memory_limit_bytes)
+
+    def _release(self, worker: _Worker):
+        if self._running:
+            self._idle.put(worker)
+        else:
+            worker.stop()
+
+    def _replace(self, worker: _Worker, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+        worker.kill()
+        if self._running:
+            self._idle.put(self._spawn())
+
+    def run(self, data_ref: Dict[str, Any], code: Optional[str], options: Optional[Dict[str, Any]] = None,
+            timeout: Optional[float] = None, **render_options) -> Dict[str, Any]:
+        """Execute panel code in a worker, same return value as process_analysis_request
+
+        render_options are passed on to process_analysis_request.
+        Blocks until a worker is free, call it from a thread pool.
+        """
+        if not self._running:
+            raise RuntimeError("Sandbox pool is not running")
+        timeout = self.timeout if timeout is None else timeout
+
+        worker = self._idle.get()
+        with self._lock:
+            self.counters["runs"] += 1
+        try:
+            worker.wait_ready(WORKER_STARTUP_TIMEOUT)
+            worker.conn.send({"data_ref": data_ref, "code": code, "options": options,
+                              "render_options": render_options})
+            if not worker.conn.poll(timeout):
+                # 超时: 直接结束进程, 由新进程替换
+                self._replace(worker, "timeouts")
+                return format_visualization_oupput(error_msg=f"Python代码执行超时 ({timeout}秒)")
+            result = worker.conn.recv()
+            for stage in result.pop("stages", []):
+                record_stage(stage["stage"], stage["duration"], stage["bytes"])
+        except (EOFError, OSError, BrokenPipeError):
+            # 进程异常退出, 通常是超出内存限制
+            exitcode = worker.process.exitcode
+            self._replace(worker, "crashes")
+            return format_visualization_oupput(error_msg=f"Python代码执行进程异常退出 (exit code {exitcode}), 可能超出内存限制")
+
+        worker.tasks += 1
+        if worker.tasks >= self.max_tasks_per_worker:
+            # 定期回收, 避免用户代码导致的内存泄漏累积
+            with self._lock:
+                self.counters["recycled"] += 1
+            worker.stop()
+            if self._running:
+                self._idle.put(self._spawn())
+        else:
+            self._release(worker)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"running": self._running, "workers": self.size, "idle": self._idle.qsize(),
+                    "timeout": self.timeout, **self.counters}
@@ -1,41 +1,292 @@
 # coding=utf-8
-import hashlib
 import json
-from typing import Dict, Any, Optional
+import os
+import threading
+import time
+from typing import Dict, Any, Optional, List, Callable
 from pathlib import Path
+import pandas as pd
+
+from src.services.cache_backends import get_cache_backend
+from src.services.memory_cache import ByteBudgetLRUCache
+from src.services.result_store import ResultStore
+from src.services.result_pages import PanelResultStore
+from src.services.option_handler import distinct_column_values, slice_distinct_values, MAX_INFERRED_CHOICES
 
 class SessionManager:
-    def __init__(self, cache_dir: str = "cache"):
+    def __init__(self, cache_dir: str = "cache", cache_format: str = "json", memory_budget_bytes: int = 0):
         self.cache_dir = Path(cache_dir)
         self.cache_dir.mkdir(exist_ok=True)
-    
-    def generate_query_hash(self, sql_query: str) -> str:
-        """Generate a unique hash for the SQL query"""
-        return hashlib.md5(sql_query.encode()).hexdigest()
-    
-    def get_cache_path(self, session_id: str, query_hash: str) -> Path:
-        """Get the path for cached query results"""
-        return self.cache_dir / f"{session_id}_{query_hash}.json"
-    
-    def save_query_result(self, session_id: str, sql_query: str, result: Dict[str, Any]) -> str:
-        """Save query result to cache and return the query hash"""
-        query_hash = self.generate_query_hash(sql_query)
-        cache_path = self.get_cache_path(session_id, query_hash)
-        with open(cache_path, 'w') as f:
-            json.dump(result, f)
+        self.backend = get_cache_backend(cache_format)
+        # 查询结果按执行的SQL内容寻址存储, 所有会话共享同一份
+        self.result_store = ResultStore(self.cache_dir / "objects", self.backend)
+        # 会话只保存指向结果的引用: refs/{query_hash}/{session_id}.json
+        self.refs_dir = self.cache_dir / "refs"
+        self.refs_dir.mkdir(exist_ok=True)
+        # 面板返回的表格结果, 按结果句柄分页读取
+        self.panel_store = PanelResultStore(self.cache_dir / "panels", cache_format)
+        # 已解码DataFrame的内存缓存层, 预算为0时关闭
+        self.memory_cache = ByteBudgetLRUCache(memory_budget_bytes) if memory_budget_bytes > 0 else None
+        # 结果每次被替换或删除时版本号加一, 依赖结果的缓存(如面板输出)以版本号区分新旧数据
+        self._versions: Dict[str, int] = {}
+        self._invalidation_listeners: List[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+        # 各结果的列唯一值索引: {query_hash: (版本号, {列名: 唯一值})}, 磁盘上的副本与结果一起保存
+        self._distinct: Dict[str, Any] = {}
+
+    def add_invalidation_listener(self, listener: Callable[[str], None]):
+        """Call listener(query_hash) whenever a stored result is replaced or deleted"""
+        self._invalidation_listeners.append(listener)
+
+    def get_result_version(self, query_hash: str) -> int:
+        """Version of a stored result, increases every time it is replaced or deleted"""
+        return self._versions.get(query_hash, 0)
+
+    def _invalidate(self, query_hash: str):
+        self._versions[query_hash] = self._versions.get(query_hash, 0) + 1
+        if self.memory_cache is not None:
+            self.memory_cache.invalidate(query_hash)
+        self._distinct.pop(query_hash, None)
+        for listener in self._invalidation_listeners:
+            listener(query_hash)
+
+    def generate_query_hash(self, sql_query: str, data_source: str = "") -> str:
+        """Generate a unique hash for the executed SQL query and its data source"""
+        return ResultStore.content_hash(sql_query, data_source)
+
+    def get_ref_path(self, session_id: str, query_hash: str) -> Path:
+        """Get the path of a session's reference to a cached query result"""
+        return self.refs_dir / query_hash / f"{session_id}.json"
+
+    def get_refcount(self, query_hash: str) -> int:
+        """Number of sessions referencing a cached query result"""
+        ref_dir = self.refs_dir / query_hash
+        if not ref_dir.exists():
+            return 0
+        return sum(1 for _ in ref_dir.glob("*.json"))
+
+    def add_ref(self, session_id: str, query_hash: str, sql_query: str = "",
+                dashboard_config: Optional[Dict[str, Any]] = None):
+        """Let a session reference an already stored query result"""
+        ref_path = self.get_ref_path(session_id, query_hash)
+        with self._lock:
+            ref_path.parent.mkdir(exist_ok=True)
+            with open(ref_path, 'w') as f:
+                json.dump({"sql_query": sql_query, "dashboard_config": dashboard_config}, f)
+
+    def list_refs(self) -> List[Path]:
+        """All session reference files"""
+        return list(self.refs_dir.glob("*/*.json"))
+
+    def release_ref(self, session_id: str, query_hash: str):
+        """Drop a session's reference and delete the result once nobody references it"""
+        ref_path = self.get_ref_path(session_id, query_hash)
+        with self._lock:
+            ref_path.unlink(missing_ok=True)
+            if self.get_refcount(query_hash) > 0:
+                return
+            if ref_path.parent.exists():
+                ref_path.parent.rmdir()
+            self.result_store.delete(query_hash)
+            self._invalidate(query_hash)
+
+    def evict_query_result(self, query_hash: str):
+        """Delete a cached query result together with every session reference to it"""
+        with self._lock:
+            ref_dir = self.refs_dir / query_hash
+            if ref_dir.exists():
+                for ref_path in ref_dir.glob("*.json"):
+                    ref_path.unlink(missing_ok=True)
+                ref_dir.rmdir()
+            self.result_store.delete(query_hash)
+            self._invalidate(query_hash)
+
+    def find_query_result(self, sql_query: str, data_source: str = "", max_age: Optional[float] = None,
+                          source_fingerprint: Optional[str] = None,
+                          fingerprint_max_age: Optional[float] = None) -> Optional[str]:
+        """Return the hash of an already stored result for the SQL if it is fresh enough
+
+        When both the stored result and the caller have a fingerprint of the source
+        tables, a different fingerprint makes the result stale immediately, and a
+        matching one keeps it fresh for fingerprint_max_age (max_age when not given):
+        the fingerprint does not notice every write, e.g. an unreported in-place UPDATE.
+        """
+        query_hash = self.generate_query_hash(sql_query, data_source)
+        meta = self.result_store.load_meta(query_hash)
+        if meta is None:
+            return None
+        if source_fingerprint is not None and meta.get("source_fingerprint") is not None:
+            if meta["source_fingerprint"] != source_fingerprint:
+                return None
+            if fingerprint_max_age is not None:
+                max_age = fingerprint_max_age
+        # 按生成时间判断, 指纹相同时也不超过上限
+        if max_age is not None and time.time() - meta.get("created_at", 0) > max_age:
+            return None
         return query_hash
-    
+
+    def save_query_result(self, session_id: str, sql_query: str, result: Dict[str, Any]) -> str:
+        """Save query result in the legacy {"data": <records JSON>, "dashboard_config": ...} shape"""
+        df = pd.DataFrame(json.loads(result["data"])) if result.get("data") else pd.DataFrame()
+        return self.save_query_dataframe(session_id, sql_query, df, result.get("dashboard_config"))
+
     def get_query_result(self, session_id: str, query_hash: str) -> Optional[Dict[str, Any]]:
-        """Retrieve cached query result"""
-        cache_path = self.get_cache_path(session_id, query_hash)
-        
-        if not cache_path.exists():
+        """Retrieve cached query result as {"data": <records JSON>, "dashboard_config": ...}"""
+        df = self.get_query_dataframe(session_id, query_hash)
+        if df is None:
             return None
-        
-        with open(cache_path) as f:
-            return json.load(f)
-    
+        return {
+            "data": df.to_json(orient='records'),
+            "dashboard_config": self.get_query_config(session_id, query_hash)
+        }
+
+    def save_query_dataframe(self, session_id: str, sql_query: str, df: pd.DataFrame,
+                             dashboard_config: Optional[Dict[str, Any]] = None, data_source: str = "",
+                             source_fingerprint: Optional[str] = None) -> str:
+        """Store a query result DataFrame, reference it from the session and return the query hash
+
+        source_fingerprint: version fingerprint of the tables the query read, see find_query_result
+        """
+        query_hash = self.generate_query_hash(sql_query, data_source)
+
+        # 写入前后各失效一次, 写入期间读到的旧数据不会以新版本号被缓存
+        self._invalidate(query_hash)
+        self.result_store.put(query_hash, df, self._result_meta(sql_query, source_fingerprint))
+        self._invalidate(query_hash)
+        if self.memory_cache is not None:
+            self.memory_cache.put(query_hash, df)
+
+        self.add_ref(session_id, query_hash, sql_query, dashboard_config)
+        return query_hash
+
+    def save_query_stream(self, session_id: str, sql_query: str, reader,
+                          dashboard_config: Optional[Dict[str, Any]] = None, data_source: str = "",
+                          on_batch: Optional[Callable[[Any], None]] = None,
+                          source_fingerprint: Optional[str] = None) -> str:
+        """Store a query result streamed as record batches, reference it from the session and return the query hash"""
+        query_hash = self.generate_query_hash(sql_query, data_source)
+
+        self._invalidate(query_hash)
+        self.result_store.put_batches(query_hash, reader, self._result_meta(sql_query, source_fingerprint), on_batch=on_batch)
+        self._invalidate(query_hash)
+
+        self.add_ref(session_id, query_hash, sql_query, dashboard_config)
+        return query_hash
+
+    @staticmethod
+    def _result_meta(sql_query: str, source_fingerprint: Optional[str]) -> Dict[str, Any]:
+        meta = {"sql_query": sql_query}
+        if source_fingerprint is not None:
+            meta["source_fingerprint"] = source_fingerprint
+        return meta
+
+    def touch_query_result(self, session_id: str, query_hash: str) -> bool:
+        """Record an access to a result the session references; False when it has no such reference"""
+        ref_path = self.get_ref_path(session_id, query_hash)
+        # 记录访问时间, 供缓存回收按最近访问淘汰
+        try:
+            os.utime(ref_path)
+        except FileNotFoundError:
+            return False
+        self.result_store.touch(query_hash)
+        return True
+
+    def get_query_dataframe(self, session_id: str, query_hash: str,
+                            columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        """Retrieve a cached query result as a DataFrame, optionally only some columns"""
+        if not self.touch_query_result(session_id, query_hash):
+            return None
+
+        if self.memory_cache is not None:
+            df = self.memory_cache.get(query_hash)
+            if df is not None:
+                return df if columns is None else df[[c for c in columns if c in df.columns]]
+
+        # 只有完整的DataFrame才放入内存缓存
+        if columns is not None:
+            return self.result_store.load(query_hash, columns)
+        df = self.result_store.load(query_hash)
+        if df is not None and self.memory_cache is not None:
+            self.memory_cache.put(query_hash, df)
+        return df
+
+    def get_distinct_values(self, query_hash: str, columns: List[str], max_choices: int = MAX_INFERRED_CHOICES,
+                            df: Optional[pd.DataFrame] = None) -> Dict[str, Dict[str, Any]]:
+        """Distinct values of some columns of a stored result, computed once per (result, column)
+
+        Looked up in memory, then in the index stored next to the result; only
+        missing columns are computed, from df when given, otherwise by loading
+        just those columns. Columns the result does not have, and empty
+        results, are left out.
+        """
+        version = self.get_result_version(query_hash)
+        cached = self._distinct.get(query_hash)
+        if cached is None or cached[0] != version:
+            cached = (version, self.result_store.load_distinct(query_hash))
+            self._distinct[query_hash] = cached
+        index = cached[1]
+
+        distinct, missing = {}, []
+        for column in columns:
+            entry = slice_distinct_values(index[column], max_choices) if column in index else None
+            if entry is None:
+                missing.append(column)
+            else:
+                distinct[column] = entry
+        if not missing:
+            return distinct
+
+        if df is None:
+            df = self.result_store.load(query_hash, missing)
+        # 与infer_options_from_dataframe一致, 空结果不推断choices
+        if df is None or df.empty:
+            return distinct
+        computed = distinct_column_values(df, missing, max_choices)
+        self.save_distinct_values(query_hash, computed, version)
+        distinct.update(computed)
+        return distinct
+
+    def save_distinct_values(self, query_hash: str, distinct: Dict[str, Dict[str, Any]], version: Optional[int] = None):
+        """Store distinct values computed elsewhere (e.g. while streaming the result)"""
+        if not distinct:
+            return
+        version = self.get_result_version(query_hash) if version is None else version
+        with self._lock:
+            # 计算期间结果已被替换时丢弃
+            if self.get_result_version(query_hash) != version:
+                return
+            cached = self._distinct.get(query_hash)
+            index = dict(cached[1]) if cached is not None and cached[0] == version else {}
+            index.update(distinct)
+            self._distinct[query_hash] = (version, index)
+            self.result_store.save_distinct(query_hash, distinct)
+
+    def get_result_ref(self, query_hash: str, columns: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Reference to a stored result that another process can load without pickling the DataFrame"""
+        if not self.result_store.exists(query_hash):
+            return None
+        return {
+            "store_dir": str(self.result_store.store_dir.resolve()),
+            "cache_format": self.backend.name,
+            "query_hash": query_hash,
+            "columns": columns,
+        }
+
+    def memory_cache_stats(self) -> Dict[str, Any]:
+        """Hit, miss and eviction counters of the in-memory tier"""
+        if self.memory_cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.memory_cache.stats()}
+
+    def get_query_config(self, session_id: str, query_hash: str) -> Optional[Dict[str, Any]]:
+        """Retrieve the dashboard config stored in the session's reference"""
+        ref_path = self.get_ref_path(session_id, query_hash)
+        if not ref_path.exists():
+            return None
+        with open(ref_path) as f:
+            return json.load(f).get("dashboard_config")
+
     def cleanup_session(self, session_id: str):
-        """Clean up all cached files for a session"""
-        for cache_file in self.cache_dir.glob(f"{session_id}_*.json"):
-            cache_file.unlink()
\ No newline at end of file
+        """Release all cached query results referenced by a session"""
+        for ref_path in self.refs_dir.glob(f"*/{session_id}.json"):
+            self.release_ref(session_id, ref_path.parent.name)
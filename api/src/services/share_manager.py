@@ -51,6 +51,8 @@ class ShareManager:
         if not share_path.exists():
             return None
         
+        # 记录访问时间, 供缓存回收按最近访问淘汰
+        os.utime(share_path)
         with open(share_path) as f:
             # Return the data in snake_case format
             return json.load(f)
@@ -3,52 +3,194 @@
 from typing import Dict, Any, Optional,  Union
 import traceback
 import io
-from contextlib import redirect_stdout
+import sys
+import threading
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
 import pandas as pd
 import plotly
 import json
 
+from src.utils.metrics import timed
 
+# 缓存中的DataFrame可能是Arrow文件的只读内存映射, 且会被多个请求共用;
+# 面板代码在写时复制下执行, 浅拷贝即可隔离用户代码对数据的修改 (pandas>=3总是开启, 见copy_on_write)
+_COPY_ON_WRITE_BUILTIN = int(pd.__version__.split(".")[0]) >= 3
 
-def process_analysis_request(df: pd.DataFrame, code: Optional[str], options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
-    """使用Python代码处理数据，返回结果、结果类型和print输出"""
+
+class _ThreadLocalStdout(io.TextIOBase):
+    """按线程转发的sys.stdout: 正在执行面板代码的线程写入自己的缓冲区, 其他线程写入原stdout
+
+    redirect_stdout会替换全局的sys.stdout, 多个面板在线程池中并发执行时输出会串到一起。
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, "buffer", None) or self.default
+
+    def write(self, s):
+        return self._target().write(s)
+
+    def flush(self):
+        return self._target().flush()
+
+
+_stdout_lock = threading.Lock()
+
+
+@contextmanager
+def capture_stdout(buffer: io.StringIO):
+    """线程安全地把当前线程的print输出重定向到buffer"""
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadLocalStdout):
+            sys.stdout = _ThreadLocalStdout(sys.stdout)
+        proxy = sys.stdout
+    previous = getattr(proxy.local, "buffer", None)
+    proxy.local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        proxy.local.buffer = previous
+
+
+_copy_on_write_lock = threading.Lock()
+_copy_on_write_users = 0
+_copy_on_write_previous = None
+
+
+@contextmanager
+def copy_on_write():
+    """
+    在pandas<3上开启写时复制, 只在执行面板代码期间生效, 不改变进程中其他代码的语义
+
+    pandas的选项是进程级的, 并发执行的面板共用一次设置: 第一个面板开启, 最后一个面板结束时恢复原值。
+    """
+    global _copy_on_write_users, _copy_on_write_previous
+    if _COPY_ON_WRITE_BUILTIN:
+        yield
+        return
+    with _copy_on_write_lock:
+        if _copy_on_write_users == 0:
+            _copy_on_write_previous = pd.get_option("mode.copy_on_write")
+            pd.set_option("mode.copy_on_write", True)
+        _copy_on_write_users += 1
+    try:
+        yield
+    finally:
+        with _copy_on_write_lock:
+            _copy_on_write_users -= 1
+            if _copy_on_write_users == 0:
+                pd.set_option("mode.copy_on_write", _copy_on_write_previous)
+
+
+# 面板代码执行环境中预先导入的常用包
+ENGINE_CODE = """import pandas as pd\nimport numpy as np\nimport plotly.express as px\nimport plotly.graph_objects as go\nimport json"""
+
+_base_namespace: Optional[Dict[str, Any]] = None
+_base_namespace_lock = threading.Lock()
+
+
+def get_base_namespace() -> Dict[str, Any]:
+    """只执行一次导入语句, 之后每次调用浅拷贝这个命名空间即可"""
+    global _base_namespace
+    if _base_namespace is None:
+        with _base_namespace_lock:
+            if _base_namespace is None:
+                namespace: Dict[str, Any] = {}
+                exec(ENGINE_CODE, namespace)
+                _base_namespace = namespace
+    return _base_namespace
+
+
+# 编译后的代码对象缓存, 键为代码文本的hash; 同一面板只切换选项值时无需重新解析和编译
+CODE_CACHE_SIZE = 256
+_code_cache: "OrderedDict[str, Any]" = OrderedDict()
+_code_cache_lock = threading.Lock()
+
+
+def compile_code(code: str):
+    """编译面板代码, 按代码文本的hash缓存代码对象"""
+    key = hashlib.md5(code.encode('utf-8')).hexdigest()
+    with _code_cache_lock:
+        compiled = _code_cache.get(key)
+        if compiled is not None:
+            _code_cache.move_to_end(key)
+            return compiled
+    # 语法错误直接抛出, 不缓存
+    compiled = compile(code, "<string>", "exec")
+    with _code_cache_lock:
+        _code_cache[key] = compiled
+        _code_cache.move_to_end(key)
+        while len(_code_cache) > CODE_CACHE_SIZE:
+            _code_cache.popitem(last=False)
+    return compiled
+
+
+def process_analysis_request(df: pd.DataFrame, code: Optional[str], options: Optional[Dict[str, Any]] = None,
+                             raw_json: bool = False, typed_arrays: bool = False,
+                             paging: Optional[Dict[str, Any]] = None,
+                             downsample: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """使用Python代码处理数据，返回结果、结果类型和print输出
+
+    raw_json/typed_arrays/paging: 结果的序列化方式, 见format_visualization_oupput
+    downsample: downsample_figure的参数(target_points, method), 对点数过多的轨迹降采样
+    """
     if not code:
-        return format_visualization_oupput(print_output="", result=df)
+        return format_visualization_oupput(print_output="", result=df, paging=paging)
     
     # 捕获print输出
     stdout_buffer = io.StringIO()
     print_output, error_msg  = "", ""
 
     
-    try:        
-        # step1: 设置dataframe
-        global_vars = {"df": df.copy()}
+    try:
+        with copy_on_write():
+            # step1: 设置常用包, 复制预先构建的命名空间
+            global_vars = dict(get_base_namespace())
 
-        # step2: 设置常用包
-        engine_code = """import pandas as pd\nimport numpy as np\nimport plotly.express as px\nimport plotly.graph_objects as go\nimport json"""    
-        exec(engine_code, global_vars)
+            # step2: 设置dataframe, 写时复制下浅拷贝不会复制数据
+            global_vars["df"] = df.copy(deep=False)
         
-        # step3: 是否限制系统函数
-        # global_vars['__builtins__'] = {"print": print}
+            # step3: 是否限制系统函数
+            # global_vars['__builtins__'] = {"print": print}
         
-        # step4: 添加选项值到局部变量
-        if options:
-            for key, value in options.items():
-                global_vars[key] = value
+            # step4: 添加选项值到局部变量
+            if options:
+                for key, value in options.items():
+                    global_vars[key] = value
         
-        # step5: 执行代码, 输出重定向
-        with redirect_stdout(stdout_buffer):
-            exec(code, global_vars)
+            # step5: 执行代码, 输出重定向
+            compiled = compile_code(code)
+            with capture_stdout(stdout_buffer), timed("panel_code"):
+                exec(compiled, global_vars)
 
-        # step6: 获取print输出
-        print_output = stdout_buffer.getvalue()
+            # step6: 获取print输出
+            print_output = stdout_buffer.getvalue()
         
-        # step7: 获取处理后的结果
-        if "result" in global_vars:
-            return format_visualization_oupput(result=global_vars["result"], print_output=print_output)
-        else:
-            error_msg = "Python代码必须将结果存储在名为'result'的变量中"
-            raise ValueError(error_msg)
+            # step7: 获取处理后的结果
+            if "result" in global_vars:
+                result = global_vars["result"]
+                downsampled = []
+                if downsample and isinstance(result, plotly.graph_objs._figure.Figure):
+                    from src.utils.downsample import downsample_figure
+                    with timed("downsample"):
+                        downsampled = downsample_figure(result, **downsample)
+                with timed("serialize") as stage:
+                    output = format_visualization_oupput(result=result, print_output=print_output,
+                                                         raw_json=raw_json, typed_arrays=typed_arrays, paging=paging)
+                    if isinstance(output.get("plot_data"), str):
+                        stage.bytes = len(output["plot_data"])
+                if downsampled:
+                    # 记录被降采样轨迹的原始点数
+                    output["downsampled"] = downsampled
+                return output
+            else:
+                error_msg = "Python代码必须将结果存储在名为'result'的变量中"
+                raise ValueError(error_msg)
             
     except Exception as e:
         # 即使发生错误，也要获取print输出
@@ -57,7 +199,44 @@ def process_analysis_request(df: pd.DataFrame, code: Optional[str], options: Opt
         return format_visualization_oupput(print_output=print_output, error_msg=error_msg)
 
 
-def format_visualization_oupput(result: Optional[Union[pd.DataFrame, Any]]=None, print_output:str = "", error_msg: Optional[str]=None) -> Dict[str, Any]:
+class RawJSON(str):
+    """已经序列化好的JSON文本, 生成响应时原样拼接, 不再解析和重新编码"""
+
+
+def figure_to_json(figure, typed_arrays: bool = False) -> str:
+    """一次性把Plotly图表序列化为JSON文本
+
+    安装了orjson时直接用orjson序列化, 不做plotly为嵌入HTML所做的字符转义;
+    typed_arrays为True时数值数组编码为base64的typed array
+    (需要plotly.js>=2.28, plotly>=6默认即如此编码)。
+    """
+    import plotly.io as pio
+
+    figure_dict = figure.to_dict()
+    if typed_arrays:
+        try:
+            from _plotly_utils.utils import convert_to_base64
+            convert_to_base64(figure_dict)
+        except ImportError:
+            # plotly<6没有typed array编码, 退回普通数组
+            pass
+    try:
+        import orjson
+        return orjson.dumps(figure_dict, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    except (ImportError, TypeError):
+        # orjson不支持的类型交给plotly清洗后再序列化
+        return pio.json.to_json_plotly(figure_dict)
+
+
+def format_visualization_oupput(result: Optional[Union[pd.DataFrame, Any]]=None, print_output:str = "", error_msg: Optional[str]=None,
+                                raw_json: bool = False, typed_arrays: bool = False,
+                                paging: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """格式化执行结果
+
+    raw_json为True时图表以RawJSON文本返回, 只序列化一次, 由调用方直接写入响应;
+    否则返回解析后的字典。
+    paging为save_panel_result的参数时, 表格结果保存在服务端, 只返回结构、行数和第一页。
+    """
     if  error_msg:
         # 如果失败，返回错误信息和print输出
         return {
@@ -69,6 +248,17 @@ def format_visualization_oupput(result: Optional[Union[pd.DataFrame, Any]]=None,
         }
     # 判断结果类型
     if isinstance(result, pd.DataFrame):
+        if paging:
+            from src.services.result_pages import save_panel_result
+
+            page = save_panel_result(result, **paging)
+            return {
+                "result_type": "dataframe",
+                "data": page.pop("data"),
+                "plot_data": None,
+                "print_output": print_output,
+                "page": page
+            }
         return {
             "result_type": "dataframe",
             "data": result.to_dict(orient="records"),
@@ -80,7 +270,7 @@ def format_visualization_oupput(result: Optional[Union[pd.DataFrame, Any]]=None,
         return {
             "result_type": "figure",
             "data": [],
-            "plot_data": json.loads(result.to_json()),
+            "plot_data": RawJSON(figure_to_json(result, typed_arrays)) if raw_json else json.loads(figure_to_json(result, typed_arrays)),
             "print_output": print_output
         }
     elif'plotly.graph_objs' in str(type(result)):
@@ -90,7 +280,7 @@ def format_visualization_oupput(result: Optional[Union[pd.DataFrame, Any]]=None,
         return {
             "result_type": "echarts",
             "data": [],
-            "plot_data": json.loads(result.dump_options()),
+            "plot_data": RawJSON(result.dump_options()) if raw_json else json.loads(result.dump_options()),
             "print_output": print_output
         }
     else:
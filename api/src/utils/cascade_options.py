@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 from typing import List, Dict, Any, Optional
 
@@ -26,4 +27,72 @@ def get_cascade_options(df: pd.DataFrame, hierarchy: List[str], param_values: Di
     for param in hierarchy:
         result[param] = sorted(filtered_df[param].unique().tolist())
     
-    return result 
\ No newline at end of file
+    return result 
+
+
+class CascadeIndex:
+    """
+    层级数据的级联选项索引, 对同一结果和层级只构建一次, 结果与get_cascade_options相同(缺失值除外)。
+    
+    只保存层级列的不重复组合: 每个层级的值编码为排序后的整数编码,
+    每个编码对应包含它的组合下标(倒排表)。查询时对已选择层级的倒排表取交集,
+    再对匹配组合的编码去重, 耗时与匹配的组合数成正比, 与原始数据的行数无关。
+    """
+    
+    def __init__(self, df: pd.DataFrame, hierarchy: List[str]):
+        self.hierarchy = list(hierarchy)
+        combinations = df[self.hierarchy].drop_duplicates()
+        self.size = len(combinations)
+        
+        # 每层: 排序后的唯一值, 值到编码的映射, 每个组合的编码, 每个编码的组合下标
+        self.values: Dict[str, List[Any]] = {}
+        self.value_codes: Dict[str, Dict[Any, int]] = {}
+        self.codes: Dict[str, Any] = {}
+        self.postings: Dict[str, List[Any]] = {}
+        for level in self.hierarchy:
+            codes, uniques = pd.factorize(combinations[level], sort=True)
+            values = uniques.tolist()
+            order = np.argsort(codes, kind="stable")
+            # 缺失值的编码为-1, 不出现在选项中
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            self.values[level] = values
+            self.value_codes[level] = {value: code for code, value in enumerate(values)}
+            self.codes[level] = codes
+            self.postings[level] = [order[bounds[i]:bounds[i + 1]] for i in range(len(values))]
+    
+    @property
+    def nbytes(self) -> int:
+        """索引占用内存的估计值"""
+        return sum(codes.nbytes * 2 + len(self.values[level]) * 64 for level, codes in self.codes.items())
+    
+    def options(self, param_values: Dict[str, Any]) -> Dict[str, List[Any]]:
+        """
+        根据当前参数值返回每个层级的可选值
+        
+        参数:
+            param_values: 将层级列名映射到选定值的字典(未选择则为None), 不属于层级的键被忽略
+        """
+        selections = [(level, param_values[level]) for level in self.hierarchy
+                      if param_values.get(level) is not None]
+        if not selections:
+            return {level: list(self.values[level]) for level in self.hierarchy}
+        
+        postings = []
+        for level, value in selections:
+            code = self.value_codes[level].get(value)
+            if code is None:
+                return {level: [] for level in self.hierarchy}
+            postings.append(self.postings[level][code])
+        
+        # 从最短的倒排表开始取交集
+        postings.sort(key=len)
+        rows = postings[0]
+        for posting in postings[1:]:
+            rows = np.intersect1d(rows, posting, assume_unique=True)
+        
+        result = {}
+        for level in self.hierarchy:
+            codes = np.unique(self.codes[level][rows])
+            values = self.values[level]
+            result[level] = [values[code] for code in codes if code >= 0]
+        return result
@@ -0,0 +1,126 @@
+# coding=utf-8
+"""
+Plotly图表的降采样工具
+
+1500像素宽的图表无法显示上百万个点, 超过目标点数的scatter/line轨迹
+按形状保持的算法降采样后再发送给浏览器:
+- lttb: Largest-Triangle-Three-Buckets, 每个桶保留与相邻桶构成最大三角形的点, 适合折线
+- minmax: 每个桶保留最小值和最大值, 保留所有尖峰
+"""
+from typing import Dict, Any, List, Optional
+import numpy as np
+
+DOWNSAMPLE_METHODS = ("lttb", "minmax")
+
+# 与数据点一一对应, 需要一起降采样的轨迹属性
+POINT_ATTRIBUTES = ("x", "y", "text", "hovertext", "customdata", "ids")
+NESTED_POINT_ATTRIBUTES = {
+    "marker": ("color", "size", "symbol", "opacity"),
+    "error_x": ("array", "arrayminus"),
+    "error_y": ("array", "arrayminus"),
+}
+
+
+def _as_numeric(values) -> Optional[np.ndarray]:
+    """转换为float数组, 日期转换为整数时间戳, 其他类型返回None"""
+    array = np.asarray(values)
+    if array.dtype.kind == "M":
+        return array.astype("datetime64[ns]").view("int64").astype("float64")
+    if array.dtype.kind in "iufb":
+        return array.astype("float64")
+    return None
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, n_out: int) -> np.ndarray:
+    """Largest-Triangle-Three-Buckets降采样, 返回保留的点的下标"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    # 首尾两点固定保留, 中间的点分为n_out-2个桶
+    every = (n - 2) / (n_out - 2)
+    edges = (np.floor(np.arange(n_out - 1) * every) + 1).astype(np.int64)
+    edges[-1] = n - 1
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+
+        xs, ys = x[start:end], y[start:end]
+        area = np.abs((x[a] - avg_x) * (ys - y[a]) - (x[a] - xs) * (avg_y - y[a]))
+        # 缺失值不参与选择
+        area = np.nan_to_num(area, nan=-1.0)
+        a = start + int(np.argmax(area))
+        indices[i + 1] = a
+    return indices
+
+
+def minmax_indices(y: np.ndarray, n_out: int) -> np.ndarray:
+    """每个桶保留最小值和最大值(以及首尾两点), 返回保留的点的下标"""
+    n = len(y)
+    buckets = max(n_out // 2, 1)
+    if n_out >= n:
+        return np.arange(n)
+
+    size = int(np.ceil(n / buckets))
+    padded = np.full(buckets * size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(buckets, size)
+    offsets = np.arange(buckets) * size
+    mins = np.where(np.isnan(padded), np.inf, padded).argmin(axis=1) + offsets
+    maxs = np.where(np.isnan(padded), -np.inf, padded).argmax(axis=1) + offsets
+
+    indices = np.unique(np.concatenate([[0, n - 1], mins, maxs]))
+    return indices[indices < n]
+
+
+def _take(values, indices: np.ndarray):
+    if isinstance(values, (str, bytes)) or np.ndim(values) == 0:
+        return values
+    return np.asarray(values)[indices]
+
+
+def downsample_figure(figure, target_points: int = 2000, method: str = "lttb") -> List[Dict[str, Any]]:
+    """对超过target_points的scatter/scattergl轨迹就地降采样, 返回每条被降采样轨迹的原始点数"""
+    if method not in DOWNSAMPLE_METHODS:
+        raise ValueError(f"Unsupported downsample method: {method}, expected one of {list(DOWNSAMPLE_METHODS)}")
+
+    downsampled = []
+    for trace_index, trace in enumerate(figure.data):
+        if trace.type not in ("scatter", "scattergl") or trace.y is None:
+            continue
+        y = _as_numeric(trace.y)
+        n = len(trace.y)
+        if y is None or n <= target_points:
+            continue
+
+        x = _as_numeric(trace.x) if trace.x is not None else None
+        if method == "lttb":
+            # x不是数值或日期时按点的顺序计算
+            indices = lttb_indices(x if x is not None else np.arange(n, dtype="float64"), y, target_points)
+        else:
+            indices = minmax_indices(y, target_points)
+
+        for name in POINT_ATTRIBUTES:
+            values = trace[name]
+            if values is not None and np.ndim(values) > 0 and len(values) == n:
+                trace[name] = _take(values, indices)
+        for parent, names in NESTED_POINT_ATTRIBUTES.items():
+            for name in names:
+                values = trace[parent][name]
+                if values is not None and np.ndim(values) > 0 and len(values) == n:
+                    trace[parent][name] = _take(values, indices)
+
+        downsampled.append({
+            "trace": trace_index,
+            "name": trace.name,
+            "original_points": n,
+            "points": len(indices),
+            "method": method,
+        })
+    return downsampled
@@ -0,0 +1,173 @@
+# coding=utf-8
+"""
+请求各阶段的耗时和数据量统计
+
+timed()记录一个阶段的耗时(以及可选的字节数): 写入当前请求的计时列表(用于Server-Timing响应头),
+同时累计到进程级的直方图中(由/api/metrics以Prometheus文本格式输出)。
+当前请求通过contextvars传递, BoundedExecutor线程池中执行的代码同样会记录到发起请求上。
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple
+
+# 耗时直方图的分桶(秒)和数据量直方图的分桶(字节)
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+BYTES_BUCKETS = tuple(1024 * 4 ** i for i in range(12))  # 1KB ... 4GB
+
+
+class Histogram:
+    """Cumulative Prometheus-style histogram"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total, result = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            result.append(("+Inf" if bound == float("inf") else f"{bound:g}", total))
+        return result
+
+
+class RequestTimings:
+    """Stages recorded while serving one request"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, duration: float, nbytes: Optional[int] = None):
+        with self._lock:
+            self.stages.append({"stage": stage, "duration": duration, "bytes": nbytes})
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, durations in milliseconds; repeated stages are summed"""
+        totals: Dict[str, List[float]] = {}
+        with self._lock:
+            for item in self.stages:
+                total = totals.setdefault(item["stage"], [0.0, 0])
+                total[0] += item["duration"]
+                if item["bytes"] is not None:
+                    total[1] += item["bytes"]
+        parts = []
+        for stage, (duration, nbytes) in totals.items():
+            part = f"{stage};dur={duration * 1000:.1f}"
+            if nbytes:
+                part += f';desc="{nbytes} bytes"'
+            parts.append(part)
+        parts.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(parts)
+
+
+_current_request: ContextVar[Optional[RequestTimings]] = ContextVar("current_request_timings", default=None)
+
+
+class MetricsRegistry:
+    """Process-wide histograms of stage durations and sizes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations: Dict[str, Histogram] = {}
+        self.sizes: Dict[str, Histogram] = {}
+        self.requests: Dict[Tuple[str, str, int], Histogram] = {}
+
+    def observe_stage(self, stage: str, duration: float, nbytes: Optional[int] = None):
+        with self._lock:
+            self.durations.setdefault(stage, Histogram(DURATION_BUCKETS)).observe(duration)
+            if nbytes is not None:
+                self.sizes.setdefault(stage, Histogram(BYTES_BUCKETS)).observe(nbytes)
+
+    def observe_request(self, method: str, path: str, status: int, duration: float):
+        with self._lock:
+            self.requests.setdefault((method, path, status), Histogram(DURATION_BUCKETS)).observe(duration)
+
+    def render_prometheus(self) -> str:
+        """All histograms in the Prometheus text exposition format"""
+        lines: List[str] = []
+        with self._lock:
+            _render_histograms(lines, "dashboard_stage_duration_seconds", "Duration of request stages",
+                               {(("stage", stage),): h for stage, h in self.durations.items()})
+            _render_histograms(lines, "dashboard_stage_bytes", "Bytes produced or consumed by request stages",
+                               {(("stage", stage),): h for stage, h in self.sizes.items()})
+            _render_histograms(lines, "dashboard_request_duration_seconds", "Duration of HTTP requests",
+                               {(("method", method), ("path", path), ("status", str(status))): h
+                                for (method, path, status), h in self.requests.items()})
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    return ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels)
+
+
+def _render_histograms(lines: List[str], name: str, help_text: str, histograms: Dict[tuple, Histogram]):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, histogram in sorted(histograms.items()):
+        label_text = _format_labels(labels)
+        for bound, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {count}')
+        lines.append(f"{name}_sum{{{label_text}}} {histogram.sum:g}")
+        lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+
+
+def render_samples(name: str, help_text: str, samples: Dict[Tuple[Tuple[str, str], ...], float],
+                   metric_type: str = "gauge") -> str:
+    """Gauges or counters kept elsewhere (executor queues, cache counters) in the Prometheus text format"""
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+    for labels, value in sorted(samples.items()):
+        lines.append(f"{name}{{{_format_labels(labels)}}} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+def start_request() -> RequestTimings:
+    """Start collecting stage timings for the current request context"""
+    timings = RequestTimings()
+    _current_request.set(timings)
+    return timings
+
+
+def current_request() -> Optional[RequestTimings]:
+    return _current_request.get()
+
+
+def record_stage(stage: str, duration: float, nbytes: Optional[int] = None):
+    """Record a stage measured elsewhere"""
+    timings = _current_request.get()
+    if timings is not None:
+        timings.add(stage, duration, nbytes)
+    metrics_registry.observe_stage(stage, duration, nbytes)
+
+
+class _Stage:
+    def __init__(self, nbytes: Optional[int] = None):
+        self.bytes = nbytes
+
+
+@contextmanager
+def timed(stage: str, nbytes: Optional[int] = None):
+    """Time a block as one stage; set .bytes on the yielded object to record a size"""
+    measurement = _Stage(nbytes)
+    started_at = time.perf_counter()
+    try:
+        yield measurement
+    finally:
+        record_stage(stage, time.perf_counter() - started_at, measurement.bytes)
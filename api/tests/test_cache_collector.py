@@ -0,0 +1,91 @@
+import unittest
+import tempfile
+import os
+import time
+from pathlib import Path
+import pandas as pd
+
+from src.services.session_manager import SessionManager
+from src.services.share_manager import ShareManager
+from src.services.cache_collector import CacheCollector
+
+def make_old(path: Path, age: float):
+    """把文件的访问时间改到age秒之前"""
+    old = time.time() - age
+    os.utime(path, (old, old))
+
+class TestCacheCollector(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.session_manager = SessionManager(cache_dir=os.path.join(self.tmp_dir.name, "cache"), cache_format="arrow")
+        self.share_manager = ShareManager(share_dir=os.path.join(self.tmp_dir.name, "shares"))
+        self.df = pd.DataFrame({'quantity': range(1000)})
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_collector(self, cache_quota_bytes=10 ** 9, share_quota_bytes=10 ** 9):
+        return CacheCollector(self.session_manager, self.share_manager, cache_quota_bytes, share_quota_bytes,
+                              ttls={"ref": 100, "object": 1000, "share": 100})
+
+    def test_expired_refs_release_results(self):
+        """测试过期的会话引用被释放, 无引用的结果被删除"""
+        query_hash = self.session_manager.save_query_dataframe("s1", "SELECT 1", self.df)
+        fresh_hash = self.session_manager.save_query_dataframe("s2", "SELECT 2", self.df)
+        make_old(self.session_manager.get_ref_path("s1", query_hash), 200)
+
+        report = self.make_collector().collect()
+
+        self.assertFalse(self.session_manager.result_store.exists(query_hash))
+        self.assertTrue(self.session_manager.result_store.exists(fresh_hash))
+        self.assertGreater(report["by_reason"]["ref_ttl"]["bytes"], 0)
+
+    def test_cache_quota_evicts_least_recently_used(self):
+        """测试超出配额时淘汰最久未访问的结果"""
+        old_hash = self.session_manager.save_query_dataframe("s1", "SELECT 1", self.df)
+        new_hash = self.session_manager.save_query_dataframe("s1", "SELECT 2", self.df)
+        for path in self.session_manager.result_store.paths(old_hash):
+            if path.exists():
+                make_old(path, 50)
+        quota = self.session_manager.result_store.size(new_hash)
+
+        report = self.make_collector(cache_quota_bytes=quota).collect()
+
+        self.assertFalse(self.session_manager.result_store.exists(old_hash))
+        self.assertIsNone(self.session_manager.get_query_dataframe("s1", old_hash))
+        self.assertTrue(self.session_manager.result_store.exists(new_hash))
+        self.assertEqual(report["by_reason"]["cache_quota"]["files"], 3)
+
+    def test_cache_quota_includes_panel_results(self):
+        """测试面板表格结果计入配额, 与查询结果一起按最近访问时间淘汰"""
+        query_hash = self.session_manager.save_query_dataframe("s1", "SELECT 1", self.df)
+        panel_store = self.session_manager.panel_store
+        panel_store.save("old_panel", self.df, page_size=10)
+        panel_store.save("new_panel", self.df, page_size=10)
+        for path in panel_store.store.paths("old_panel"):
+            if path.exists():
+                make_old(path, 50)
+        quota = self.session_manager.result_store.size(query_hash) + panel_store.store.size("new_panel")
+
+        report = self.make_collector(cache_quota_bytes=quota).collect()
+
+        self.assertEqual(panel_store.list_handles(), ["new_panel"])
+        self.assertTrue(self.session_manager.result_store.exists(query_hash))
+        self.assertGreater(report["by_reason"]["cache_quota"]["bytes"], 0)
+
+    def test_expired_shares_are_removed(self):
+        """测试过期的分享被删除"""
+        old_id = self.share_manager.save_dashboard_state({"sql_query": "SELECT 1"})
+        new_id = self.share_manager.save_dashboard_state({"sql_query": "SELECT 2"})
+        make_old(self.share_manager.get_share_path(old_id), 200)
+
+        collector = self.make_collector()
+        collector.collect()
+
+        self.assertIsNone(self.share_manager.get_dashboard_state(old_id))
+        self.assertIsNotNone(self.share_manager.get_dashboard_state(new_id))
+        self.assertEqual(collector.stats()["totals"]["files"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
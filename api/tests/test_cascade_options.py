@@ -2,7 +2,7 @@ import unittest
 import pandas as pd
 
 # 添加父目录到路径以导入模块
-from src.utils.cascade_options import get_cascade_options
+from src.utils.cascade_options import get_cascade_options, CascadeIndex
 
 class TestCascadeOptions(unittest.TestCase):
     
@@ -88,5 +88,22 @@ class TestCascadeOptions(unittest.TestCase):
         }
         self.assertEqual(result, expected)
 
+    def test_index_matches_get_cascade_options(self):
+        """测试级联索引与get_cascade_options结果一致"""
+        index = CascadeIndex(self.df, self.hierarchy)
+        for category in [None, 1, 2, 99]:
+            for subcategory in [None, 11, 21]:
+                for product in [None, 111, 211]:
+                    param_values = {"category": category, "subcategory": subcategory, "product": product}
+                    self.assertEqual(index.options(param_values),
+                                     get_cascade_options(self.df, self.hierarchy, param_values))
+
+    def test_index_skips_missing_values(self):
+        """测试索引中的缺失值不作为选项"""
+        df = pd.DataFrame({"province": ["浙江", "浙江", "江苏"], "city": ["杭州", None, "南京"]})
+        index = CascadeIndex(df, ["province", "city"])
+        self.assertEqual(index.options({"province": "浙江"}), {"province": ["浙江"], "city": ["杭州"]})
+        self.assertEqual(index.options({"city": "南京", "other": "x"}), {"province": ["江苏"], "city": ["南京"]})
+
 if __name__ == '__main__':
     unittest.main() 
@@ -0,0 +1,174 @@
+import unittest
+import tempfile
+import os
+
+import pyarrow as pa
+
+from src.database import db
+
+class TestMySQLEnginePool(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # 使用sqlite代替MySQL测试连接池行为
+        self.url = "sqlite:///" + os.path.join(self.tmp_dir.name, "test.db")
+
+    def tearDown(self):
+        db.dispose_engines()
+        self.tmp_dir.cleanup()
+
+    def test_engine_is_reused(self):
+        """测试相同连接地址复用同一个engine"""
+        self.assertIs(db.get_engine(self.url), db.get_engine(self.url))
+        self.assertIsNot(db.get_engine(self.url), db.get_engine(self.url, prepare_stmt="SELECT 1"))
+
+    def test_prepare_stmt_runs_once_per_connection(self):
+        """测试prepare_stmt在每个连接上只执行一次"""
+        # 重复执行会因临时表已存在而报错
+        prepare_stmt = "CREATE TEMP TABLE prepared AS SELECT 1 AS x"
+        for _ in range(3):
+            df = db.pd_read_sql(self.url, "SELECT x FROM prepared", prepare_stmt=prepare_stmt)
+            self.assertEqual(df["x"].tolist(), [1])
+
+    def test_bind_parameters(self):
+        """测试以绑定参数执行查询"""
+        from sqlalchemy import text
+        with db.get_engine(self.url).begin() as con:
+            con.execute(text("CREATE TABLE t AS SELECT 1 AS x, 'a' AS y UNION ALL SELECT 2, 'b' UNION ALL SELECT 3, 'a'"))
+        sql = "SELECT x FROM t WHERE y = :p0 AND x IN (:p1_0, :p1_1) ORDER BY x"
+        df = db.pd_read_sql(self.url, sql, params={"p0": "a", "p1_0": 1, "p1_1": 3})
+        self.assertEqual(df["x"].tolist(), [1, 3])
+        df = db.pd_read_sql(self.url, sql, params={"p0": "b", "p1_0": 2, "p1_1": 2})
+        self.assertEqual(df["x"].tolist(), [2])
+
+    def test_stream_column_null_in_first_batch(self):
+        """测试流式读取时第一批中全为NULL的列使用之后批次的类型"""
+        from sqlalchemy import text
+        with db.get_engine(self.url).begin() as con:
+            con.execute(text("CREATE TABLE t (x INTEGER, y TEXT, z INTEGER)"))
+            con.execute(text("INSERT INTO t VALUES (1, NULL, 1), (2, NULL, 2), (3, 'a', NULL), (4, 'b', 4), (5, NULL, NULL)"))
+        reader = db.stream_mysql_query("SELECT x, y, z FROM t ORDER BY x", self.url, batch_size=2)
+        table = reader.read_all()
+        self.assertEqual(table.column("y").to_pylist(), [None, None, "a", "b", None])
+        self.assertEqual(table.column("z").to_pylist(), [1, 2, None, 4, None])
+
+        # 所有批次中都为NULL的列按字符串处理
+        table = db.stream_mysql_query("SELECT x, NULL AS n FROM t", self.url, batch_size=2).read_all()
+        self.assertEqual(table.column("n").type, pa.string())
+        self.assertEqual(table.column("n").null_count, 5)
+
+class TestDuckDBConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manager = db.DuckDBConnectionManager(os.path.join(self.tmp_dir.name, "test.duckdb"),
+                                                  settings={"threads": 2, "memory_limit": "256MB"})
+
+    def tearDown(self):
+        self.manager.close()
+        self.tmp_dir.cleanup()
+
+    def test_cursors_share_one_database(self):
+        """测试多个cursor共用同一个数据库实例"""
+        cursor = self.manager.cursor()
+        cursor.execute("CREATE TABLE t AS SELECT 1 AS x")
+        cursor.close()
+
+        cursor = self.manager.cursor()
+        self.assertEqual(cursor.execute("SELECT x FROM t").fetchall(), [(1,)])
+        self.assertEqual(cursor.execute("SELECT current_setting('threads')").fetchone()[0], 2)
+        cursor.close()
+
+    def test_configure_and_reopen(self):
+        """测试修改配置以及关闭后重新打开"""
+        self.manager.configure(threads=3)
+        cursor = self.manager.cursor()
+        self.assertEqual(cursor.execute("SELECT current_setting('threads')").fetchone()[0], 3)
+        cursor.close()
+
+        self.manager.close()
+        cursor = self.manager.cursor()
+        self.assertEqual(cursor.execute("SELECT 42").fetchone()[0], 42)
+        cursor.close()
+
+class TestDistinctValuesSQL(unittest.TestCase):
+
+    def test_distinct_values_sql(self):
+        """测试在查询结果上取唯一值的子查询"""
+        import duckdb
+
+        conn = duckdb.connect()
+        conn.execute("CREATE TABLE sales AS SELECT * FROM (VALUES ('华东', 1), ('华南', 2), (NULL, 3), ('华东', 4)) t(\"my region\", x)")
+        sql = db.distinct_values_sql('SELECT * FROM sales WHERE x > 1;\n', 'my region', 10)
+        self.assertEqual(conn.execute(sql).fetchall(), [('华东',), ('华南',)])
+        sql = db.distinct_values_sql('SELECT * FROM sales', 'my region', 1)
+        self.assertEqual(conn.execute(sql).fetchall(), [('华东',)])
+        conn.close()
+
+        self.assertIn("`a``b`", db.distinct_values_sql("SELECT 1", "a`b", 5, dialect="mysql"))
+
+    def test_grouped_distinct_values_sql(self):
+        """测试以GROUPING SETS一次计算多列的唯一值, 每列分别排序和限制数量, 保留列的类型"""
+        import duckdb
+
+        conn = duckdb.connect()
+        conn.execute("CREATE TABLE sales AS SELECT * FROM (VALUES ('华东', 1, 2.5), ('华南', 2, NULL), (NULL, 3, 1.0), "
+                     "('华东', NULL, 1.0)) t(\"my region\", x, price)")
+        df = conn.execute(db.grouped_distinct_values_sql("SELECT * FROM sales;\n", ["my region", "x", "price"], 2)).fetchdf()
+        self.assertEqual(df.loc[df["distinct_set"] == 0, "my region"].tolist(), ["华东", "华南"])
+        self.assertEqual(df.loc[df["distinct_set"] == 1, "x"].tolist(), [1, 2])
+        self.assertEqual(df.loc[df["distinct_set"] == 2, "price"].tolist(), [1.0, 2.5])
+        self.assertEqual(df["x"].dtype.kind, "i")
+        conn.close()
+
+class TestTableVersions(unittest.TestCase):
+
+    def setUp(self):
+        import duckdb
+        from src.database import table_versions
+
+        self.versions = table_versions
+        self.conn = duckdb.connect()
+        self.conn.execute("CREATE TABLE sales AS SELECT 1 AS id, '华东' AS region")
+        self.conn.execute("CREATE TABLE regions AS SELECT '华东' AS region")
+        self.conn.execute("CREATE VIEW v AS SELECT s.* FROM sales s JOIN regions USING (region)")
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_referenced_tables(self):
+        """测试查询读取的表, 视图展开为其依赖的表, CTE不计入"""
+        sql = "WITH t AS (SELECT 1) SELECT * FROM v, t WHERE id IN (SELECT id FROM sales)"
+        self.assertEqual(self.versions.referenced_tables(self.conn, sql), ["regions", "sales"])
+        self.assertIsNone(self.versions.referenced_tables(self.conn, "SELECT * FROM read_csv('data.csv')"))
+        self.assertIsNone(self.versions.query_fingerprint(self.conn, "SELECT 1"))
+
+    def test_volatile_functions_not_fingerprinted(self):
+        """测试调用当前时间、随机数等函数或抽样的查询(包括通过视图)不按表的版本复用"""
+        for sql in ["SELECT * FROM sales WHERE id > 0 AND current_date > DATE '2023-01-01'",
+                    "SELECT *, now() AS ts FROM sales",
+                    "SELECT * FROM sales ORDER BY random()",
+                    "SELECT * FROM sales USING SAMPLE 1 ROWS",
+                    "SELECT * FROM sales TABLESAMPLE 50%",
+                    "SELECT * FROM (SELECT * FROM sales USING SAMPLE 10% (bernoulli, 42)) s"]:
+            self.assertIsNone(self.versions.query_fingerprint(self.conn, sql), sql)
+        self.conn.execute("CREATE VIEW today_sales AS SELECT * FROM sales WHERE today() > DATE '2023-01-01'")
+        self.assertIsNone(self.versions.query_fingerprint(self.conn, "SELECT * FROM today_sales"))
+        self.assertIsNotNone(self.versions.query_fingerprint(self.conn, "SELECT region, count(*) FROM sales GROUP BY ALL"))
+
+    def test_fingerprint_changes_with_tables(self):
+        """测试表的版本或数据变化时指纹变化, 其他表的变化不影响"""
+        fingerprint = self.versions.query_fingerprint(self.conn, "SELECT * FROM v")
+        sales_fingerprint = self.versions.query_fingerprint(self.conn, "SELECT * FROM sales")
+        self.assertEqual(self.versions.query_fingerprint(self.conn, "SELECT * FROM v"), fingerprint)
+
+        self.assertEqual(self.versions.bump_table_version(self.conn, "regions"), 1)
+        self.assertNotEqual(self.versions.query_fingerprint(self.conn, "SELECT * FROM v"), fingerprint)
+        self.assertEqual(self.versions.query_fingerprint(self.conn, "SELECT * FROM sales"), sales_fingerprint)
+
+        # 没有递增版本号的写入通过目录中的行数发现
+        self.conn.execute("INSERT INTO sales VALUES (2, '华南')")
+        self.assertNotEqual(self.versions.query_fingerprint(self.conn, "SELECT * FROM sales"), sales_fingerprint)
+
+if __name__ == '__main__':
+    unittest.main()
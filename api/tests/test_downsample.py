@@ -0,0 +1,53 @@
+import unittest
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+
+from src.utils.downsample import lttb_indices, minmax_indices, downsample_figure
+
+class TestDownsample(unittest.TestCase):
+
+    def setUp(self):
+        self.x = np.arange(100000, dtype="float64")
+        self.y = np.sin(self.x / 1000)
+        # 单个尖峰必须保留
+        self.y[54321] = 10
+
+    def test_lttb_keeps_endpoints_and_peaks(self):
+        """测试LTTB保留首尾点和尖峰, 点数等于目标点数"""
+        indices = lttb_indices(self.x, self.y, 500)
+
+        self.assertEqual(len(indices), 500)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], len(self.x) - 1)
+        self.assertIn(54321, indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_minmax_keeps_extremes(self):
+        """测试min-max保留每个桶的最大最小值"""
+        indices = minmax_indices(self.y, 500)
+
+        self.assertLessEqual(len(indices), 502)
+        self.assertIn(54321, indices)
+        self.assertEqual(self.y[indices].min(), self.y.min())
+
+    def test_downsample_figure(self):
+        """测试超过目标点数的轨迹被降采样, 记录原始点数, 小轨迹不变"""
+        df = pd.DataFrame({
+            "t": pd.date_range("2023-01-01", periods=len(self.y), freq="min"),
+            "y": self.y,
+        })
+        fig = px.line(df, x="t", y="y")
+        fig.add_trace(go.Scatter(x=[1, 2, 3], y=[1, 2, 3], name="small"))
+
+        downsampled = downsample_figure(fig, target_points=1000)
+
+        self.assertEqual(len(downsampled), 1)
+        self.assertEqual(downsampled[0]["original_points"], len(self.y))
+        self.assertEqual(len(fig.data[0].y), 1000)
+        self.assertEqual(len(fig.data[0].x), 1000)
+        self.assertEqual(len(fig.data[1].y), 3)
+
+if __name__ == '__main__':
+    unittest.main()
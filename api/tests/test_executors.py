@@ -0,0 +1,35 @@
+import unittest
+import asyncio
+import threading
+
+from src.services.executors import BoundedExecutor
+
+class TestBoundedExecutor(unittest.TestCase):
+
+    def test_pools_have_independent_limits(self):
+        """测试一个线程池占满时不影响其他线程池"""
+        sql_executor = BoundedExecutor("sql", max_workers=1)
+        python_executor = BoundedExecutor("python", max_workers=1)
+        release = threading.Event()
+
+        async def scenario():
+            slow_query = asyncio.ensure_future(sql_executor.run(release.wait, 5))
+            await asyncio.sleep(0.05)
+            # SQL线程池已占满, 新的查询需要排队
+            self.assertEqual(sql_executor.stats()["active"], 1)
+            queued_query = asyncio.ensure_future(sql_executor.run(lambda: "query"))
+            await asyncio.sleep(0.05)
+            self.assertEqual(sql_executor.stats()["queued"], 1)
+            # Python线程池不受影响
+            self.assertEqual(await python_executor.run(lambda x: x * 2, 21), 42)
+            release.set()
+            return await slow_query, await queued_query
+
+        try:
+            self.assertEqual(asyncio.run(scenario()), (True, "query"))
+        finally:
+            sql_executor.shutdown()
+            python_executor.shutdown()
+
+if __name__ == '__main__':
+    unittest.main()
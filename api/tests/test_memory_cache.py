@@ -0,0 +1,44 @@
+import unittest
+import pandas as pd
+
+from src.services.memory_cache import ByteBudgetLRUCache, dataframe_nbytes
+
+class TestByteBudgetLRUCache(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'quantity': range(100)})
+        self.size = dataframe_nbytes(self.df)
+
+    def test_hit_and_miss(self):
+        """测试命中和未命中计数"""
+        cache = ByteBudgetLRUCache(max_bytes=self.size * 2)
+        cache.put("a", self.df)
+
+        self.assertIs(cache.get("a"), self.df)
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    def test_evicts_by_bytes(self):
+        """测试按字节预算淘汰最久未使用的条目"""
+        cache = ByteBudgetLRUCache(max_bytes=self.size * 2)
+        cache.put("a", self.df)
+        cache.put("b", self.df.copy())
+        cache.get("a")
+        cache.put("c", self.df.copy())
+
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLessEqual(cache.stats()["bytes"], self.size * 2)
+
+    def test_oversized_value_is_not_cached(self):
+        """测试超过总预算的值不会被缓存"""
+        cache = ByteBudgetLRUCache(max_bytes=self.size - 1)
+        cache.put("a", self.df)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
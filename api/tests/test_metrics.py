@@ -0,0 +1,52 @@
+import unittest
+import asyncio
+
+from src.services.executors import BoundedExecutor
+from src.utils.metrics import MetricsRegistry, start_request, timed, current_request, metrics_registry
+
+class TestMetrics(unittest.TestCase):
+
+    def test_stages_recorded_across_executor_threads(self):
+        """测试线程池中执行的阶段记录到发起请求上, 并生成Server-Timing"""
+        executor = BoundedExecutor("test", max_workers=1)
+
+        def work():
+            with timed("cache_write") as stage:
+                stage.bytes = 2048
+
+        async def handle_request():
+            timings = start_request()
+            with timed("parse_sql"):
+                pass
+            await executor.run(work)
+            return timings
+
+        try:
+            timings = asyncio.run(handle_request())
+        finally:
+            executor.shutdown()
+
+        self.assertEqual([stage["stage"] for stage in timings.stages], ["parse_sql", "cache_write"])
+        header = timings.server_timing()
+        self.assertIn('cache_write;dur=', header)
+        self.assertIn('desc="2048 bytes"', header)
+        self.assertIn('total;dur=', header)
+        self.assertIsNone(current_request())
+        self.assertIn('dashboard_stage_bytes_count{stage="cache_write"}', metrics_registry.render_prometheus())
+
+    def test_prometheus_histogram(self):
+        """测试直方图按累计分桶输出"""
+        registry = MetricsRegistry()
+        for duration in (0.002, 0.02, 3):
+            registry.observe_stage("db", duration)
+        registry.observe_request("GET", "/api/share/{share_id}", 200, 0.01)
+
+        text = registry.render_prometheus()
+        self.assertIn('dashboard_stage_duration_seconds_bucket{stage="db",le="0.005"} 1', text)
+        self.assertIn('dashboard_stage_duration_seconds_bucket{stage="db",le="0.025"} 2', text)
+        self.assertIn('dashboard_stage_duration_seconds_bucket{stage="db",le="+Inf"} 3', text)
+        self.assertIn('dashboard_stage_duration_seconds_count{stage="db"} 3', text)
+        self.assertIn('path="/api/share/{share_id}"', text)
+
+if __name__ == '__main__':
+    unittest.main()
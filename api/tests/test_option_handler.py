@@ -0,0 +1,59 @@
+import unittest
+import pandas as pd
+import pyarrow as pa
+
+from src.services.option_handler import infer_options_from_dataframe, IncrementalOptionInference
+
+class TestInferOptions(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'region': ['华东', '华南', None, '华东', '西北'],
+            'quantity': [10, 25, 50, 10, 30]
+        })
+        self.options = [
+            {"name": "region", "infer": "column", "infer_column": "region", "type": "str"},
+            {"name": "quantity", "infer": "column", "infer_column": "quantity", "multiple": True},
+            {"name": "missing", "infer": "column", "infer_column": "missing"},
+            {"name": "top_n", "type": "int", "default": 5},
+        ]
+
+    def test_infer_from_dataframe(self):
+        """测试从DataFrame列推断choices和默认值"""
+        options = {o["name"]: o for o in infer_options_from_dataframe(self.options, self.df)}
+
+        self.assertEqual(options["region"]["choices"], ['华东', '华南', '西北'])
+        self.assertEqual(options["region"]["default"], '华东')
+        self.assertEqual(options["quantity"]["choices"], ['10', '25', '50', '30'])
+        self.assertEqual(options["quantity"]["default"], [])
+        self.assertNotIn("choices", options["missing"])
+        self.assertEqual(options["top_n"], self.options[3])
+
+    def test_incremental_matches_dataframe(self):
+        """测试分批推断与一次性推断的结果一致"""
+        inference = IncrementalOptionInference(self.options)
+        table = pa.Table.from_pandas(self.df, preserve_index=False)
+        for batch in table.to_batches(max_chunksize=2):
+            inference.update(batch)
+
+        self.assertEqual(inference.result(), infer_options_from_dataframe(self.options, self.df))
+
+    def test_max_choices(self):
+        """测试唯一值超过上限时截断并标记truncated"""
+        options = {o["name"]: o for o in infer_options_from_dataframe(self.options, self.df, max_choices=2)}
+        self.assertEqual(options["region"]["choices"], ['华东', '华南'])
+        self.assertTrue(options["region"]["truncated"])
+        self.assertNotIn("truncated", infer_options_from_dataframe(self.options, self.df)[0])
+
+        inference = IncrementalOptionInference(self.options, max_choices=2)
+        for batch in pa.Table.from_pandas(self.df, preserve_index=False).to_batches(max_chunksize=2):
+            inference.update(batch)
+        self.assertEqual(inference.result(), infer_options_from_dataframe(self.options, self.df, max_choices=2))
+
+    def test_incremental_without_rows(self):
+        """测试没有数据时不修改选项"""
+        inference = IncrementalOptionInference(self.options)
+        self.assertEqual(inference.result(), self.options)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+from datetime import datetime, timedelta
+
+from src.services.parameter_handler import replace_parameters_in_sql, bind_parameters_in_sql, compile_sql_template
+
+class TestReplaceParameters(unittest.TestCase):
+
+    def setUp(self):
+        self.parameters = [
+            {"name": "region", "type": "single_select"},
+            {"name": "categories", "type": "multi_select", "sep": ",", "wrapper": "'"},
+            {"name": "limit", "type": "single_input"},
+        ]
+
+    def test_parameters_and_dates(self):
+        """测试参数和日期表达式在一次渲染中替换"""
+        sql = "SELECT * FROM sales WHERE region = '${region}' AND category IN (${categories}) " \
+              "AND sale_date >= '${yyyy-MM-dd-1d}' AND note = '${unknown}' LIMIT ${limit}"
+        result = replace_parameters_in_sql(sql, {"region": "华东", "categories": ["配件", "家居"], "limit": 10},
+                                           self.parameters)
+
+        yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        self.assertEqual(result, "SELECT * FROM sales WHERE region = '华东' AND category IN ('配件','家居') "
+                                 f"AND sale_date >= '{yesterday}' AND note = '${{unknown}}' LIMIT 10")
+
+    def test_parameter_takes_priority_over_date(self):
+        """测试与日期表达式同名的参数优先"""
+        result = replace_parameters_in_sql("${yyyyMMdd}", {"yyyyMMdd": "20230101"}, [{"name": "yyyyMMdd"}])
+        self.assertEqual(result, "20230101")
+
+    def test_values_are_not_rescanned(self):
+        """测试替换进去的值不会再被当作占位符"""
+        result = replace_parameters_in_sql("${region} ${limit}", {"region": "${limit}", "limit": "${yyyy}"},
+                                           self.parameters)
+        self.assertEqual(result, "${limit} ${yyyy}")
+
+    def test_without_param_values(self):
+        """测试没有参数值时SQL保持不变"""
+        sql = "SELECT '${yyyy-MM-dd}'"
+        self.assertEqual(replace_parameters_in_sql(sql, {}, self.parameters), sql)
+
+    def test_template_is_compiled_once(self):
+        """测试相同的模板只解析一次"""
+        sql = "SELECT ${limit} -- compiled once"
+        self.assertIs(compile_sql_template(sql), compile_sql_template(sql))
+        self.assertEqual(compile_sql_template(sql).names, ["limit"])
+
+    def test_bind_parameters(self):
+        """测试绑定参数模式: 引号内的值、数值和IN列表被绑定, SQL片段仍然拼接"""
+        import duckdb
+
+        parameters = self.parameters + [{"name": "order", "type": "single_input"}]
+        sql = "SELECT * FROM sales WHERE region = '${region}' AND category IN (${categories}) " \
+              "AND quantity >= ${limit} ORDER BY ${order}"
+        values = {"region": "华东", "categories": ["配件", "家居", "电子产品"], "limit": "10", "order": "quantity DESC"}
+
+        bound_sql, params = bind_parameters_in_sql(sql, values, parameters)
+        self.assertEqual(bound_sql, "SELECT * FROM sales WHERE region = $p0 AND category IN ($p1_0, $p1_1, $p1_2, $p1_3) "
+                                    "AND quantity >= $p2 ORDER BY quantity DESC")
+        self.assertEqual(params, {"p0": "华东", "p1_0": "配件", "p1_1": "家居", "p1_2": "电子产品", "p1_3": "电子产品", "p2": 10})
+
+        # 不同的值生成相同的SQL
+        other_sql, _ = bind_parameters_in_sql(sql, dict(values, region="华南", categories=["配件", "家居", "x", "y"]), parameters)
+        self.assertEqual(other_sql, bound_sql)
+
+        conn = duckdb.connect()
+        conn.execute("CREATE TABLE sales AS SELECT * FROM (VALUES ('华东', '配件', 12), ('华东', '家居', 5), ('华南', '配件', 20)) t(region, category, quantity)")
+        self.assertEqual(conn.execute(bound_sql, params).fetchall(), [('华东', '配件', 12)])
+        conn.close()
+
+        mysql_sql, mysql_params = bind_parameters_in_sql(sql, values, parameters, dialect="mysql")
+        self.assertIn("region = :p0 AND category IN (:p1_0, :p1_1, :p1_2, :p1_3)", mysql_sql)
+        self.assertEqual(mysql_params, params)
+
+    def test_bind_only_standalone_values(self):
+        """测试字符串或标识符中的占位符拼接, 与inline模式的结果相同"""
+        import duckdb
+
+        parameters = [{"name": "year", "type": "single_input"}, {"name": "kw", "type": "single_input"},
+                      {"name": "region", "type": "single_select"}]
+        values = {"year": "2023", "kw": "手机", "region": "华东"}
+        for sql in ["SELECT '${year}-01-01' AS d",
+                    "SELECT '%${kw}%' AS pattern",
+                    "SELECT 1 AS sales_${year}",
+                    "SELECT 'it''${region}' AS quoted, '${region}''s' AS suffix",
+                    'SELECT 1 AS "${region}"',
+                    "SELECT ${year}${year} AS joined"]:
+            bound_sql, params = bind_parameters_in_sql(sql, values, parameters)
+            self.assertEqual((bound_sql, params), (replace_parameters_in_sql(sql, values, parameters), {}), sql)
+            duckdb.execute(bound_sql)
+
+        # 同一模板中值位置上的独立值仍然绑定
+        bound_sql, params = bind_parameters_in_sql(
+            "SELECT '${year}-01-01' AS d WHERE '${region}' = r AND ${year} > y", values, parameters)
+        self.assertEqual(bound_sql, "SELECT '2023-01-01' AS d WHERE $p1 = r AND $p2 > y")
+        self.assertEqual(params, {"p1": "华东", "p2": 2023})
+        # MySQL的双引号是字符串
+        self.assertEqual(bind_parameters_in_sql('SELECT 1 WHERE r = "${region}"', values, parameters, dialect="mysql"),
+                         ("SELECT 1 WHERE r = :p0", {"p0": "华东"}))
+
+    def test_bind_only_value_positions(self):
+        """测试数据库不接受参数的位置(ORDER BY、GROUP BY、INTERVAL等)拼接, LIMIT/OFFSET和BETWEEN绑定"""
+        import duckdb
+
+        parameters = [{"name": "n", "type": "single_input"}, {"name": "days", "type": "single_input"}]
+        values = {"n": "1", "days": "7"}
+        for sql in ["SELECT 1 AS a ORDER BY ${n}",
+                    "SELECT 1 AS a GROUP BY ${n}",
+                    "SELECT DATE '2023-01-10' - INTERVAL ${days} DAY",
+                    "SELECT DATE '2023-01-10' - INTERVAL '${days}' DAY",
+                    "SELECT ${n} AS a"]:
+            bound_sql, params = bind_parameters_in_sql(sql, values, parameters)
+            self.assertEqual((bound_sql, params), (replace_parameters_in_sql(sql, values, parameters), {}), sql)
+            duckdb.execute(bound_sql)
+
+        sql = "SELECT * FROM range(10) t(i) WHERE i BETWEEN ${n} AND ${days} LIMIT ${n} OFFSET ${n}"
+        bound_sql, params = bind_parameters_in_sql(sql, values, parameters)
+        self.assertEqual(bound_sql, "SELECT * FROM range(10) t(i) WHERE i BETWEEN $p0 AND $p1 LIMIT $p2 OFFSET $p3")
+        self.assertEqual(duckdb.execute(bound_sql, params).fetchall(), [(2,)])
+
+    def test_list_padded_only_in_in_list(self):
+        """测试只有单独占满IN (...)的列表补齐长度, 其他位置的列表拼接"""
+        import duckdb
+
+        parameters = [{"name": "ids", "type": "multi_input"}]
+        values = {"ids": ["1", "2", "3"]}
+        bound_sql, params = bind_parameters_in_sql("SELECT len([${ids}]) AS n", values, parameters)
+        self.assertEqual((bound_sql, params), ("SELECT len([1,2,3]) AS n", {}))
+        self.assertEqual(duckdb.execute(bound_sql).fetchall(), [(3,)])
+
+        bound_sql, params = bind_parameters_in_sql("SELECT count(*) FROM range(5) t(i) WHERE i IN ( ${ids} )",
+                                                   values, parameters)
+        self.assertEqual(bound_sql, "SELECT count(*) FROM range(5) t(i) WHERE i IN ( $p0_0, $p0_1, $p0_2, $p0_3 )")
+        self.assertEqual(duckdb.execute(bound_sql, params).fetchall(), [(3,)])
+        # IN列表中还有其他值时不展开
+        self.assertEqual(bind_parameters_in_sql("SELECT 1 WHERE 1 IN (0, ${ids})", values, parameters),
+                         ("SELECT 1 WHERE 1 IN (0, 1,2,3)", {}))
+
+if __name__ == '__main__':
+    unittest.main()
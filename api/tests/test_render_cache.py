@@ -0,0 +1,63 @@
+import unittest
+import tempfile
+import pandas as pd
+
+from src.services.session_manager import SessionManager
+from src.services.render_cache import RenderCache
+
+class TestRenderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        self.render_cache = RenderCache(max_bytes=10 ** 6)
+        self.manager.add_invalidation_listener(self.render_cache.invalidate_result)
+        self.df = pd.DataFrame({'quantity': [10, 50, 15]})
+        self.output = {"result_type": "dataframe", "data": [{"quantity": 10}], "plot_data": None, "print_output": ""}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_key_depends_on_code_and_options(self):
+        """测试缓存键区分代码和选项值, 选项顺序不影响"""
+        key = RenderCache.make_key("h", 1, "result = df", {"a": 1, "b": 2})
+
+        self.assertEqual(key, RenderCache.make_key("h", 1, "result = df", {"b": 2, "a": 1}))
+        self.assertNotEqual(key, RenderCache.make_key("h", 1, "result = df", {"a": 2, "b": 2}))
+        self.assertNotEqual(key, RenderCache.make_key("h", 1, "result = df.head()", {"a": 1, "b": 2}))
+
+    def test_replacing_result_invalidates_outputs(self):
+        """测试查询结果被替换后, 之前的面板输出不再命中"""
+        query_hash = self.manager.save_query_dataframe("s1", "SELECT 1", self.df)
+        key = RenderCache.make_key(query_hash, self.manager.get_result_version(query_hash), "result = df", {})
+        self.render_cache.put(key, self.output)
+        self.assertEqual(self.render_cache.get(key), self.output)
+
+        self.manager.save_query_dataframe("s1", "SELECT 1", self.df.head(1))
+
+        self.assertIsNone(self.render_cache.get(key))
+        self.assertNotEqual(self.manager.get_result_version(query_hash), key[1])
+
+    def test_errors_are_not_cached(self):
+        """测试执行失败的输出不缓存"""
+        key = RenderCache.make_key("h", 0, "x = 1", {})
+        self.render_cache.put(key, {"result_type": "error", "error_message": "timeout"})
+
+        self.assertIsNone(self.render_cache.get(key))
+
+    def test_output_size_estimate(self):
+        """测试输出大小按字符串长度和列表抽样估计, 与JSON长度接近"""
+        import json
+        from src.services.render_cache import output_nbytes
+        from src.services.visualization import RawJSON
+
+        figure = RawJSON(json.dumps({"data": [{"y": list(range(10000))}]}))
+        self.assertEqual(output_nbytes({"result_type": "figure", "data": figure}) - len(figure),
+                         output_nbytes({"result_type": "figure", "data": ""}))
+
+        records = [{"region": "east", "quantity": i % 100, "price": 1.5} for i in range(10000)]
+        size = len(json.dumps({"result_type": "dataframe", "data": records}))
+        self.assertLess(abs(output_nbytes({"result_type": "dataframe", "data": records}) - size), size * 0.3)
+
+if __name__ == '__main__':
+    unittest.main()
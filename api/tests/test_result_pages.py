@@ -0,0 +1,78 @@
+import unittest
+import tempfile
+import pandas as pd
+
+from src.services.result_pages import query_page, encode_rows, PanelResultStore
+from src.services.visualization import process_analysis_request
+
+class TestResultPages(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'category': ['电子产品', '配件', '电子产品', '配件'],
+            'quantity': [10, 50, 15, 5]
+        })
+
+    def test_query_page_filters_sorts_and_slices(self):
+        """测试服务端过滤、排序和分页"""
+        filters = [{"column": "category", "op": "==", "value": "电子产品"}]
+        page, total_rows = query_page(self.df, offset=0, limit=1, sort_by="quantity", ascending=False, filters=filters)
+
+        self.assertEqual(total_rows, 2)
+        self.assertEqual(page['quantity'].tolist(), [15])
+
+        page, total_rows = query_page(self.df, offset=1, limit=2, filters=[{"column": "quantity", "op": "in", "value": [5, 50]}])
+        self.assertEqual(total_rows, 2)
+        self.assertEqual(page['quantity'].tolist(), [5])
+
+    def test_columnar_encoding(self):
+        """测试按列编码只包含一次列名"""
+        self.assertEqual(encode_rows(self.df.head(2), "columns"), {'category': ['电子产品', '配件'], 'quantity': [10, 50]})
+        with self.assertRaises(ValueError):
+            encode_rows(self.df, "xml")
+
+    def test_paged_dataframe_result(self):
+        """测试表格结果保存在服务端, 只返回第一页"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paging = {"store_dir": tmp_dir, "handle": "a1", "page_size": 2}
+            result = process_analysis_request(self.df, "result = df[df['quantity'] > 5]", paging=paging)
+
+            self.assertEqual(result["result_type"], "dataframe")
+            self.assertEqual(len(result["data"]), 2)
+            self.assertEqual(result["page"]["total_rows"], 3)
+            self.assertEqual([column["name"] for column in result["page"]["schema"]], ['category', 'quantity'])
+
+            stored = PanelResultStore(tmp_dir).load("a1")
+            self.assertEqual(stored['quantity'].tolist(), [10, 50, 15])
+
+    def test_touch_reports_collected_handles(self):
+        """测试刷新访问时间, 已被回收的句柄返回False"""
+        import os
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = PanelResultStore(tmp_dir)
+            store.save("a1", self.df, page_size=2)
+            for path in store.store.paths("a1"):
+                if path.exists():
+                    os.utime(path, (0, 0))
+
+            self.assertTrue(store.touch("a1"))
+            self.assertGreater(store.store.last_access("a1"), 0)
+            store.delete("a1")
+            self.assertFalse(store.touch("a1"))
+
+    def test_invalid_handle_rejected(self):
+        """测试非十六进制的句柄(例如指向存储目录之外)在访问文件系统前被拒绝"""
+        from src.services.result_pages import is_valid_handle
+
+        self.assertTrue(is_valid_handle("0123456789abcdef"))
+        for handle in ["", "../objects/a1", "/etc/passwd", "A1", "a1.arrow", None, 1]:
+            self.assertFalse(is_valid_handle(handle), handle)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = PanelResultStore(tmp_dir)
+            with self.assertRaises(ValueError):
+                store.load("../a1")
+            with self.assertRaises(ValueError):
+                store.touch("../a1")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+
+import duckdb
+
+from src.database.rollups import Rollup, RollupManager
+
+class TestRollups(unittest.TestCase):
+
+    def setUp(self):
+        self.conn = duckdb.connect()
+        self.conn.execute("""
+        CREATE TABLE sales AS SELECT
+            i AS id,
+            ['华东', '华南', '华北'][i % 3 + 1] AS region,
+            ['配件', '家居'][i % 2 + 1] AS category,
+            DATE '2023-01-01' + (i % 90)::INTEGER AS sale_date,
+            (i % 7)::INTEGER AS quantity,
+            CASE WHEN i % 5 = 0 THEN NULL ELSE (i % 100)::DECIMAL(10, 2) END AS price
+        FROM range(3000) t(i)
+        """)
+        self.manager = RollupManager()
+        self.manager.register([
+            {"table": "sales", "dimensions": ["region", "category", "sale_date"],
+             "measures": {"quantity": ["sum"], "price": ["avg", "count", "min", "max"]}},
+            {"table": "sales", "dimensions": ["region"], "measures": {"quantity": "sum"}},
+        ])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def assertSameResult(self, sql, rollup_table=None):
+        routed_sql, table, stale = self.manager.route(self.conn, sql)
+        self.assertIsNotNone(routed_sql, sql)
+        self.assertFalse(stale)
+        if rollup_table:
+            self.assertEqual(table, rollup_table)
+        expected = self.conn.execute(sql).fetchdf()
+        result = self.conn.execute(routed_sql).fetchdf()
+        self.assertEqual(list(result.columns), list(expected.columns))
+        self.assertEqual(list(result.dtypes), list(expected.dtypes))
+        self.assertTrue(result.round(6).equals(expected.round(6)), f"{sql}\n{routed_sql}")
+
+    def test_routes_aggregate_queries(self):
+        """测试过滤和分组列都是维度的聚合查询改写为读取聚合表, 结果与基础表相同"""
+        self.assertEqual(len(self.manager.refresh(self.conn)), 2)
+        self.assertSameResult("SELECT region, sum(quantity) FROM sales GROUP BY region ORDER BY 1",
+                              Rollup("sales", ["region"], {"quantity": "sum"}).table_name)
+        self.assertSameResult(
+            "SELECT s.region, sum(quantity) AS q, count(*), avg(price), count(price), min(price), max(category) "
+            "FROM main.sales s WHERE sale_date >= '2023-02-01' AND category IN ('配件') "
+            "GROUP BY ALL HAVING sum(quantity) > 0 ORDER BY q DESC, 1 LIMIT 2")
+        self.assertSameResult("SELECT sum(quantity), count(*), avg(price) FROM sales WHERE region = '东北'")
+
+    def test_ineligible_queries_not_routed(self):
+        """测试明细查询、非维度列过滤、度量上的表达式或DISTINCT聚合不改写"""
+        self.manager.refresh(self.conn)
+        for sql in [
+            "SELECT * FROM sales WHERE region = '华东'",
+            "SELECT region, sum(quantity) FROM sales WHERE id > 10 GROUP BY region",
+            "SELECT region, sum(quantity * price) FROM sales GROUP BY region",
+            "SELECT region, count(DISTINCT quantity) FROM sales GROUP BY region",
+            "SELECT region, sum(quantity) FILTER (WHERE id > 10) FROM sales GROUP BY region",
+            "SELECT region, sum(quantity) FROM sales WHERE region IN (SELECT region FROM sales) GROUP BY region",
+            "SELECT region, median(quantity) FROM sales GROUP BY region",
+        ]:
+            self.assertEqual(self.manager.route(self.conn, sql), (None, None, False), sql)
+
+    def test_stale_rollup_not_used(self):
+        """测试聚合表生成前或基础表变化后不改写, 重新生成后继续改写"""
+        sql = "SELECT region, sum(quantity) FROM sales GROUP BY region"
+        self.assertEqual(self.manager.route(self.conn, sql), (None, None, True))
+        self.manager.refresh(self.conn)
+        self.assertIsNotNone(self.manager.route(self.conn, sql)[0])
+
+        self.conn.execute("INSERT INTO sales VALUES (9999, '华东', '配件', DATE '2023-01-01', 100, 1)")
+        self.assertEqual(self.manager.route(self.conn, sql), (None, None, True))
+        self.assertEqual(len(self.manager.refresh(self.conn)), 2)
+        self.assertSameResult(sql)
+
+    def test_invalid_definition_skipped(self):
+        """测试不支持的聚合方式被忽略"""
+        self.assertEqual(RollupManager().register([{"table": "sales", "measures": {"quantity": ["median"]}}]), [])
+        with self.assertRaises(ValueError):
+            Rollup("sales", ["count_star"], {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import tempfile
+import pandas as pd
+
+from src.services.session_manager import SessionManager
+from src.services.sandbox import SandboxPool
+
+class TestSandboxPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pool = SandboxPool(workers=1, timeout=5, memory_limit_bytes=2 * 1024 ** 3, max_tasks_per_worker=3)
+        cls.pool.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.stop()
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        df = pd.DataFrame({'category': ['电子产品', '配件', '电子产品'], 'quantity': [10, 50, 15]})
+        query_hash = self.manager.save_query_dataframe("s1", "SELECT 1", df)
+        self.data_ref = self.manager.get_result_ref(query_hash)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_run_from_cache_file(self):
+        """测试工作进程从缓存文件读取数据并执行代码"""
+        code = "print(category)\nresult = df[df['category'] == category]"
+        result = self.pool.run(self.data_ref, code, {"category": "配件"})
+
+        self.assertEqual(result["result_type"], "dataframe")
+        self.assertEqual(result["data"], [{'category': '配件', 'quantity': 50}])
+        self.assertEqual(result["print_output"], "配件\n")
+
+    def test_timeout_replaces_worker(self):
+        """测试超时的代码被终止, 之后的请求由新进程执行"""
+        result = self.pool.run(self.data_ref, "while True:\n    pass", timeout=0.5)
+        self.assertEqual(result["result_type"], "error")
+        self.assertIn("超时", result["error_message"])
+
+        result = self.pool.run(self.data_ref, "result = df")
+        self.assertEqual(result["result_type"], "dataframe")
+        self.assertGreaterEqual(self.pool.stats()["timeouts"], 1)
+
+    def test_workers_are_recycled(self):
+        """测试执行指定次数后工作进程被替换"""
+        pids = [self.pool.run(self.data_ref, "import os\nprint(os.getpid())\nresult = df")["print_output"] for _ in range(4)]
+
+        self.assertGreater(len(set(pids)), 1)
+        self.assertGreaterEqual(self.pool.stats()["recycled"], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+import unittest
+import tempfile
+import io
+import pandas as pd
+
+from src.services.session_manager import SessionManager
+
+class TestSessionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.df = pd.DataFrame({
+            'region': ['华东', '华南', '华北'],
+            'quantity': [10, 25, 50],
+            'sale_date': pd.to_datetime(['2023-01-15', '2023-01-20', '2023-01-25'])
+        })
+        self.config = {"parameters": [], "visualization": []}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_columnar_formats_preserve_dtypes(self):
+        """测试Arrow/Parquet格式保留数据类型"""
+        for cache_format in ["arrow", "parquet"]:
+            manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format=cache_format)
+            query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df, self.config)
+
+            df = manager.get_query_dataframe("s1", query_hash)
+            pd.testing.assert_frame_equal(df, self.df, check_dtype=False)
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['sale_date']))
+            self.assertEqual(manager.get_query_config("s1", query_hash), self.config)
+
+    def test_json_format_is_compatible(self):
+        """测试JSON格式与旧的缓存文件兼容"""
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="json")
+        query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df[['region', 'quantity']], self.config)
+
+        cached_result = manager.get_query_result("s1", query_hash)
+        self.assertEqual(cached_result["dashboard_config"], self.config)
+        self.assertEqual(len(pd.read_json(io.StringIO(cached_result["data"]))), 3)
+
+    def test_column_projection(self):
+        """测试只读取部分列"""
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df, self.config)
+
+        df = manager.get_query_dataframe("s1", query_hash, columns=['quantity'])
+        self.assertEqual(list(df.columns), ['quantity'])
+
+    def test_mixed_types_fall_back_to_json(self):
+        """测试无法转换为Arrow的数据退回JSON格式, 退回的次数记录在指标中"""
+        from src.utils.metrics import metrics_registry
+
+        def fallbacks():
+            histogram = metrics_registry.durations.get("cache_json_fallback")
+            return histogram.count if histogram else 0
+
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        df = pd.DataFrame({'mixed': [1, 'a', 2.5]})
+        before = fallbacks()
+        query_hash = manager.save_query_dataframe("s1", "SELECT 1", df, self.config)
+
+        self.assertEqual(manager.get_query_dataframe("s1", query_hash)['mixed'].tolist(), [1, 'a', 2.5])
+        self.assertEqual(fallbacks(), before + 1)
+
+    def test_save_query_stream(self):
+        """测试按批写入查询结果"""
+        import pyarrow as pa
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        table = pa.Table.from_pandas(self.df, preserve_index=False)
+        reader = pa.RecordBatchReader.from_batches(table.schema, table.to_batches(max_chunksize=1))
+        batch_rows = []
+        query_hash = manager.save_query_stream("s1", "SELECT 1", reader, self.config,
+                                               on_batch=lambda batch: batch_rows.append(batch.num_rows))
+
+        self.assertEqual(batch_rows, [1, 1, 1])
+        pd.testing.assert_frame_equal(manager.get_query_dataframe("s1", query_hash), self.df, check_dtype=False)
+        self.assertEqual(manager.result_store.load_meta(query_hash)["rows"], 3)
+
+    def test_cleanup_session(self):
+        """测试清理会话缓存"""
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df, self.config)
+        manager.cleanup_session("s1")
+
+        self.assertIsNone(manager.get_query_dataframe("s1", query_hash))
+        self.assertFalse(manager.result_store.exists(query_hash))
+
+    def test_sessions_share_one_copy(self):
+        """测试相同SQL的结果在会话之间只保存一份"""
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df, self.config)
+        self.assertEqual(manager.find_query_result("SELECT 1"), query_hash)
+        manager.add_ref("s2", query_hash, "SELECT 1", self.config)
+
+        self.assertEqual(manager.get_refcount(query_hash), 2)
+        self.assertEqual(len(list(manager.result_store.store_dir.glob("*.arrow"))), 1)
+
+        # 释放一个引用后, 其他会话仍可读取
+        manager.cleanup_session("s1")
+        self.assertEqual(manager.get_refcount(query_hash), 1)
+        self.assertIsNone(manager.get_query_dataframe("s1", query_hash))
+        self.assertEqual(len(manager.get_query_dataframe("s2", query_hash)), 3)
+
+    def test_hash_depends_on_processed_sql_and_source(self):
+        """测试不同的SQL或数据源生成不同的哈希"""
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        hashes = {
+            manager.generate_query_hash("SELECT * FROM sales WHERE region = '华东'"),
+            manager.generate_query_hash("SELECT * FROM sales WHERE region = '华南'"),
+            manager.generate_query_hash("SELECT * FROM sales WHERE region = '华东'", "share:1"),
+        }
+        self.assertEqual(len(hashes), 3)
+
+    def test_reuse_by_source_fingerprint(self):
+        """测试结果按数据表的指纹复用, 指纹相同时按fingerprint_max_age限制生成时间"""
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df, self.config, source_fingerprint="v1")
+
+        self.assertEqual(manager.find_query_result("SELECT 1", max_age=-1, source_fingerprint="v1",
+                                                   fingerprint_max_age=60), query_hash)
+        self.assertIsNone(manager.find_query_result("SELECT 1", max_age=-1, source_fingerprint="v1"))
+        self.assertIsNone(manager.find_query_result("SELECT 1", source_fingerprint="v2", fingerprint_max_age=60))
+        # 没有指纹时按生成时间判断
+        self.assertIsNone(manager.find_query_result("SELECT 1", max_age=-1))
+        self.assertEqual(manager.find_query_result("SELECT 1"), query_hash)
+
+    def test_unreported_update_not_reused_after_max_age(self):
+        """测试未报告的原地UPDATE不改变表的指纹, 超过复用时间上限后不再复用旧结果"""
+        import time
+        from unittest import mock
+
+        import duckdb
+        from src.database.table_versions import query_fingerprint
+
+        conn = duckdb.connect()
+        conn.execute("CREATE TABLE sales AS SELECT * FROM (VALUES (1, 10), (2, 20)) t(id, quantity)")
+        sql = "SELECT sum(quantity) AS total FROM sales"
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        fingerprint = query_fingerprint(conn, sql)
+        query_hash = manager.save_query_dataframe("s1", sql, conn.execute(sql).fetchdf(), self.config,
+                                                  source_fingerprint=fingerprint)
+
+        conn.execute("UPDATE sales SET quantity = quantity + 1")
+        self.assertEqual(query_fingerprint(conn, sql), fingerprint)
+        conn.close()
+        self.assertEqual(manager.find_query_result(sql, max_age=300, source_fingerprint=fingerprint,
+                                                   fingerprint_max_age=3600), query_hash)
+        with mock.patch("time.time", return_value=time.time() + 3601):
+            self.assertIsNone(manager.find_query_result(sql, max_age=300, source_fingerprint=fingerprint,
+                                                        fingerprint_max_age=3600))
+
+    def test_distinct_values_cached_with_result(self):
+        """测试列唯一值按结果缓存, 结果替换后重新计算"""
+        from unittest import mock
+
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df, self.config)
+
+        distinct = manager.get_distinct_values(query_hash, ['region', 'missing'], max_choices=2)
+        self.assertEqual(distinct, {'region': {'values': ['华东', '华南'], 'truncated': True, 'max_choices': 2}})
+
+        # 新的进程从结果旁的索引文件读取, 不再读取数据
+        manager = SessionManager(cache_dir=self.tmp_dir.name, cache_format="arrow")
+        with mock.patch.object(manager.result_store, "load", side_effect=AssertionError):
+            self.assertEqual(manager.get_distinct_values(query_hash, ['region'], max_choices=2), distinct)
+            self.assertEqual(manager.get_distinct_values(query_hash, ['region'], max_choices=1)['region']['values'], ['华东'])
+
+        # 缓存的值不足以确定更大的上限时重新计算
+        self.assertEqual(manager.get_distinct_values(query_hash, ['region'])['region']['values'], ['华东', '华南', '华北'])
+
+        manager.save_query_dataframe("s1", "SELECT 1", self.df.iloc[::-1], self.config)
+        self.assertEqual(manager.get_distinct_values(query_hash, ['region'])['region']['values'], ['华北', '华南', '华东'])
+
+if __name__ == '__main__':
+    unittest.main()
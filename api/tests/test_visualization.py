@@ -0,0 +1,113 @@
+import unittest
+import tempfile
+import json
+import pandas as pd
+
+from src.services.session_manager import SessionManager
+from src.services.visualization import process_analysis_request, compile_code, RawJSON
+
+class TestProcessAnalysisRequest(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'category': ['电子产品', '配件', '电子产品'],
+            'quantity': [10, 50, 15]
+        })
+
+    def test_dataframe_result(self):
+        """测试返回DataFrame结果和print输出"""
+        code = "print('rows', len(df))\nresult = df[df['quantity'] > 10]"
+        result = process_analysis_request(self.df, code)
+
+        self.assertEqual(result["result_type"], "dataframe")
+        self.assertEqual(len(result["data"]), 2)
+        self.assertEqual(result["print_output"], "rows 3\n")
+
+    def test_figure_result_with_options(self):
+        """测试使用选项值生成Plotly图表"""
+        code = "result = px.bar(df[df['category'] == category], x='category', y='quantity')"
+        result = process_analysis_request(self.df, code, {"category": "配件"})
+
+        self.assertEqual(result["result_type"], "figure")
+        self.assertEqual(list(result["plot_data"]["data"][0]["x"]), ["配件"])
+
+    def test_figure_raw_json(self):
+        """测试图表直接以序列化后的JSON文本返回, 内容与解析后的字典一致"""
+        code = "result = px.bar(df, x='category', y='quantity')"
+        raw = process_analysis_request(self.df, code, raw_json=True)
+        parsed = process_analysis_request(self.df, code)
+
+        self.assertIsInstance(raw["plot_data"], RawJSON)
+        self.assertEqual(json.loads(raw["plot_data"]), parsed["plot_data"])
+
+    def test_missing_result_is_error(self):
+        """测试未设置result变量时返回错误"""
+        result = process_analysis_request(self.df, "x = 1")
+
+        self.assertEqual(result["result_type"], "error")
+        self.assertIn("result", result["error_message"])
+
+    def test_code_cannot_modify_cached_dataframe(self):
+        """测试用户代码修改df不影响内存映射的缓存数据"""
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            manager = SessionManager(cache_dir=tmp_dir, cache_format="arrow")
+            query_hash = manager.save_query_dataframe("s1", "SELECT 1", self.df)
+            cached_df = manager.get_query_dataframe("s1", query_hash)
+
+            code = "df.loc[0, 'quantity'] = -1\ndf['quantity'] *= 2\nresult = df"
+            result = process_analysis_request(cached_df, code)
+
+            self.assertEqual(result["data"][0]["quantity"], -2)
+            self.assertEqual(cached_df['quantity'].tolist(), [10, 50, 15])
+
+    def test_copy_on_write_scoped_to_panel_code(self):
+        """测试pandas<3上只在执行面板代码期间开启写时复制, 并发的面板都结束后才恢复原值"""
+        from unittest import mock
+        from src.services import visualization
+
+        options = {"mode.copy_on_write": False}
+        with mock.patch.object(visualization, "_COPY_ON_WRITE_BUILTIN", False), \
+                mock.patch.object(visualization.pd, "get_option", side_effect=options.get), \
+                mock.patch.object(visualization.pd, "set_option", side_effect=options.__setitem__):
+            with visualization.copy_on_write():
+                self.assertTrue(options["mode.copy_on_write"])
+                with visualization.copy_on_write():
+                    self.assertTrue(options["mode.copy_on_write"])
+                self.assertTrue(options["mode.copy_on_write"])
+            self.assertFalse(options["mode.copy_on_write"])
+
+            code = "result = pd.DataFrame({'cow': [pd.get_option('mode.copy_on_write')]})"
+            result = process_analysis_request(self.df, code)
+            self.assertEqual(result["data"], [{"cow": True}])
+            self.assertFalse(options["mode.copy_on_write"])
+
+    def test_concurrent_print_output_is_isolated(self):
+        """测试并发执行的面板各自捕获自己的print输出"""
+        from concurrent.futures import ThreadPoolExecutor
+        code = "import time\nfor i in range(5):\n    print(name)\n    time.sleep(0.01)\nresult = df"
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [pool.submit(process_analysis_request, self.df, code, {"name": f"panel{i}"}) for i in range(4)]
+            outputs = [future.result()["print_output"] for future in futures]
+
+        for i, output in enumerate(outputs):
+            self.assertEqual(output, f"panel{i}\n" * 5)
+
+    def test_compiled_code_is_reused(self):
+        """测试相同代码只编译一次, 不同选项值复用编译结果"""
+        code = "result = df[df['category'] == category]"
+        self.assertIs(compile_code(code), compile_code(code))
+
+        first = process_analysis_request(self.df, code, {"category": "配件"})
+        second = process_analysis_request(self.df, code, {"category": "电子产品"})
+        self.assertEqual(len(first["data"]), 1)
+        self.assertEqual(len(second["data"]), 2)
+
+    def test_namespace_is_not_shared_between_calls(self):
+        """测试上一次执行定义的变量不会泄漏到下一次执行"""
+        process_analysis_request(self.df, "leaked = 1\nresult = df", {"category": "配件"})
+        result = process_analysis_request(self.df, "print('leaked' in globals(), 'category' in globals())\nresult = df")
+
+        self.assertEqual(result["print_output"], "False False\n")
+
+if __name__ == '__main__':
+    unittest.main()